@@ -1,6 +1,29 @@
-from collections import defaultdict
+from collections import defaultdict, Counter
+from array import array
+import operator
 import json
 
+# Row flags of ArmInstructionColumns.flags
+F_BRANCH = 0x01
+F_UNDEFINED = 0x02
+
+# Edge kinds of ControlFlowGraph.kinds (bit mask: one edge can be both)
+E_FALL_THROUGH = 0x01
+E_JUMP = 0x02
+E_CALL = 0x04
+
+_CONDITIONS = frozenset(['eq', 'ne', 'cs', 'hs', 'cc', 'lo', 'mi', 'pl', 'vs', 'vc', 'hi', 'ls', 'ge', 'lt', 'gt', 'le', 'al'])
+_UNCONDITIONAL_JUMPS = frozenset(['b', 'b.n', 'b.w', 'bx', 'bx.n'])
+
+def branch_kind(mnemonic):
+    """
+    E_CALL for bl/blx and the conditional ARM forms (bleq, blcc, ...), E_JUMP otherwise.
+    Thumb conditional branches such as ble.n or bls.w are jumps.
+    """
+    if mnemonic in ('bl', 'blx') or (mnemonic[:2] == 'bl' and mnemonic[2:] in _CONDITIONS):
+        return E_CALL
+    return E_JUMP
+
 class ArmInstruction:
     """
     Represents a single ARM instruction.
@@ -80,17 +103,84 @@ class ArmCodeBlock:
 
         return instruction
 
+class ArmInstructionColumns:
+    """
+    Array-backed storage for the instructions of one section.
+    Each disassembly line is one row of typed arrays instead of an ArmInstruction
+    object; code blocks are referenced by index and mnemonics by interned id.
+    """
+    __slots__ = ('cb_address', 'cb_label', 'cb_first_row',
+                 'op_address', 'op_opcode', 'op_mnemonic', 'cb_index', 'flags', 'b_target_addr')
+
+    def __init__(self):
+        self.cb_address = array('Q')
+        self.cb_label = []
+        self.cb_first_row = array('Q')
+        self.op_address = array('Q')
+        self.op_opcode = array('Q')
+        self.op_mnemonic = array('I')
+        self.cb_index = array('I')
+        self.flags = array('B')
+        self.b_target_addr = array('Q')
+
+    def __len__(self):
+        return len(self.op_address)
+
+    def add_code_block(self, cb_address, cb_label):
+        self.cb_address.append(cb_address)
+        self.cb_label.append(cb_label)
+        self.cb_first_row.append(len(self.op_address))
+        return len(self.cb_address) - 1
+
+    def add_instruction(self, cb_index, op_address, op_opcode, mnemonic_id, flags, b_target_addr):
+        self.op_address.append(op_address)
+        self.op_opcode.append(op_opcode)
+        self.op_mnemonic.append(mnemonic_id)
+        self.cb_index.append(cb_index)
+        self.flags.append(flags)
+        self.b_target_addr.append(b_target_addr)
+
+    def extend(self, other, mnemonic_map):
+        """
+        Append the rows of other, renumbering its code block indexes and mnemonic ids.
+        """
+        row_base, cb_base = len(self.op_address), len(self.cb_address)
+        self.cb_address.extend(other.cb_address)
+        self.cb_label.extend(other.cb_label)
+        self.cb_first_row.extend(row + row_base for row in other.cb_first_row)
+        self.op_address.extend(other.op_address)
+        self.op_opcode.extend(other.op_opcode)
+        self.op_mnemonic.extend(mnemonic_map[mnemonic_id] for mnemonic_id in other.op_mnemonic)
+        self.cb_index.extend(cb_index + cb_base for cb_index in other.cb_index)
+        self.flags.extend(other.flags)
+        self.b_target_addr.extend(other.b_target_addr)
+
+    def code_block_rows(self, cb_index):
+        end = self.cb_first_row[cb_index + 1] if cb_index + 1 < len(self.cb_first_row) else len(self.op_address)
+        return range(self.cb_first_row[cb_index], end)
+
+    def op_offset(self, row):
+        return self.op_address[row] - self.cb_address[self.cb_index[row]]
+
+    def b_target_offset(self, row):
+        if not self.flags[row] & F_BRANCH:
+            return 0
+        return self.b_target_addr[row] - self.cb_address[self.cb_index[row]]
+
 class ArmSection:
     """
     Represents a section in the ARM assembly file.
     """
-    def __init__(self, section_name):
+    def __init__(self, section_name, columnar=False):
         self.section_name = section_name
         self.section_addr = 0
         self.code_blocks_count = 0
         self.code_blocks = {}
+        self.columns = ArmInstructionColumns() if columnar else None
+        self.cb_addresses = set() if columnar else None  # columnar mode: addresses of the code blocks so far
         self.total_cb_instructions_count = 0
         self.total_b_branches_count = 0
+        self.total_undefined_count = 0  # <UNDEFINED> entries, kept but left out of the features
         self.op_asm_total_count = 0
         self.op_asm_count = defaultdict(int)
         self.op_asm_offset_list = {}
@@ -110,23 +200,339 @@ class ArmSection:
     def get_code_blocks_count(self):
         return self.code_blocks_count
 
+    def add_code_block_row(self, cb_address, cb_label):
+        """
+        Columnar counterpart of add_code_block; returns the code block index.
+        """
+        if cb_address in self.cb_addresses:
+            raise KeyError(f"Code block with address {cb_address} already exists.")
+        self.cb_addresses.add(cb_address)
+        self.code_blocks_count += 1
+        return self.columns.add_code_block(cb_address, cb_label)
+
+    def add_instruction_row(self, cb_index, op_address, op_opcode, mnemonic_id, flags, b_target_addr):
+        """
+        Columnar counterpart of ArmCodeBlock.add_instruction.
+        """
+        self.columns.add_instruction(cb_index, op_address, op_opcode, mnemonic_id, flags, b_target_addr)
+        self.total_cb_instructions_count += 1
+        if flags & F_BRANCH:
+            self.total_b_branches_count += 1
+
+    def merge(self, other, mnemonic_map):
+        """
+        Append a later part of the same section parsed separately (columnar mode only).
+        """
+        duplicates = self.cb_addresses & other.cb_addresses
+        if duplicates:
+            raise KeyError(f"Code block with address {min(duplicates)} already exists.")
+        self.cb_addresses |= other.cb_addresses
+        self.columns.extend(other.columns, mnemonic_map)
+        self.code_blocks_count += other.code_blocks_count
+        self.total_cb_instructions_count += other.total_cb_instructions_count
+        self.total_b_branches_count += other.total_b_branches_count
+        self.total_undefined_count += other.total_undefined_count
+
+    def _build_code_block(self, cb_index, mnemonics, last_cb):
+        """
+        Build the ArmCodeBlock of one columnar code block. The section totals were
+        counted by the parser, so the ones add_instruction adds are taken back.
+        """
+        cols = self.columns
+        totals = (self.total_cb_instructions_count, self.total_b_branches_count)
+        cb = ArmCodeBlock(cols.cb_address[cb_index], cols.cb_label[cb_index], self, last_cb)
+        for row in cols.code_block_rows(cb_index):
+            op_opcode = f"{cols.op_opcode[row]:x}"
+            op_asm = mnemonics[cols.op_mnemonic[row]]
+            op_branch = None
+            if cols.flags[row] & F_BRANCH:
+                op_branch = {
+                    "address": cols.op_address[row],
+                    "op": op_opcode,
+                    "op_asm": op_asm,
+                    "target_addr": cols.b_target_addr[row],
+                    "label": ''
+                }
+            cb.add_instruction(cols.op_address[row], op_opcode, op_asm, '', op_branch)
+        self.total_cb_instructions_count, self.total_b_branches_count = totals
+        return cb
+
+    def iter_code_blocks(self, mnemonics):
+        """
+        Yield the code blocks in address order without keeping them: in columnar mode
+        each ArmCodeBlock is built from the rows when it is reached and is not linked
+        to the previous one, so only one block is alive at a time. cb_size is the
+        distance to the next block (0 for the last one).
+        """
+        if self.columns is None or self.code_blocks:
+            yield from self.code_blocks.values()
+            return
+        cb_addresses = self.columns.cb_address
+        for cb_index in range(len(cb_addresses)):
+            cb = self._build_code_block(cb_index, mnemonics, None)
+            if cb_index + 1 < len(cb_addresses):
+                cb.cb_size = cb_addresses[cb_index + 1] - cb.cb_address
+            yield cb
+
+    def materialize(self, mnemonics):
+        """
+        Build ArmCodeBlock/ArmInstruction objects from the columnar rows on demand.
+        Only the fields kept in the columns are restored: op_asm is the interned
+        mnemonic and op_comment is empty.
+        """
+        if self.columns is None or self.code_blocks:
+            return self.code_blocks
+        last_cb = None
+        for cb_index, cb_address in enumerate(self.columns.cb_address):
+            last_cb = self.code_blocks[cb_address] = self._build_code_block(cb_index, mnemonics, last_cb)
+        self.code_blocks_count = len(self.code_blocks)
+        return self.code_blocks
+
+class ControlFlowGraph:
+    """
+    Basic-block control-flow graph of one file in CSR form.
+    Blocks start at code block labels, at branch targets and after jumps; calls do
+    not end a block. Edges are branch targets (E_JUMP/E_CALL) and fall-through to the
+    next block of the same code block (E_FALL_THROUGH, omitted after b/b.n/b.w/bx).
+    The successors of block i are targets[offsets[i]:offsets[i + 1]] with their kinds.
+    Branches to addresses that are not an instruction of the file are only counted.
+    Edge kinds come from the mnemonic, so a columnar parse with used_op_asm disabled
+    (opcodes instead of mnemonics) marks every branch as a conditional jump.
+    """
+    __slots__ = ('block_address', 'block_size', 'block_function', 'function_address', 'function_label',
+                 'offsets', 'targets', 'kinds', 'external_edges', '_networkx')
+
+    def __init__(self):
+        self.block_address = array('Q')
+        self.block_size = array('I')       # instructions per block
+        self.block_function = array('I')   # code block (function) index of every block
+        self.function_address = array('Q')
+        self.function_label = []
+        self.offsets = array('Q', [0])
+        self.targets = array('I')
+        self.kinds = array('B')
+        self.external_edges = 0
+        self._networkx = None
+
+    def __len__(self):
+        return len(self.block_address)
+
+    @staticmethod
+    def _iter_code_blocks(file_info):
+        """
+        Yield (address, label, [(op_address, mnemonic, branch target or None)]) per code block.
+        """
+        for section in file_info.sections.values():
+            cols = section.columns
+            if cols is None:
+                for cb in section.code_blocks.values():
+                    yield cb.cb_address, cb.cb_label, [
+                        (ins.op_address, ins.op_opcode_asm, ins.branch.b_target_addr if ins.branch else None)
+                        for ins in cb.instructions
+                    ]
+                continue
+            mnemonics = file_info.mnemonics
+            for cb_index, cb_address in enumerate(cols.cb_address):
+                yield cb_address, cols.cb_label[cb_index], [
+                    (cols.op_address[row], mnemonics[cols.op_mnemonic[row]],
+                     cols.b_target_addr[row] if cols.flags[row] & F_BRANCH else None)
+                    for row in cols.code_block_rows(cb_index)
+                ]
+
+    @classmethod
+    def from_file_info(cls, file_info):
+        cfg = cls()
+        code_blocks = list(cls._iter_code_blocks(file_info))
+        leaders = {target for _, _, rows in code_blocks for _, _, target in rows if target is not None}
+
+        # Split every code block into basic blocks and remember the branches of each block
+        branches = []  # (source block, target address, kind)
+        edges = {}     # (source << 32) | destination -> kind mask
+        for function_index, (cb_address, cb_label, rows) in enumerate(code_blocks):
+            cfg.function_address.append(cb_address)
+            cfg.function_label.append(cb_label)
+            block, closed, falls_through = None, True, False
+            for op_address, mnemonic, target in rows:
+                if closed or op_address in leaders:
+                    new_block = len(cfg.block_address)
+                    if block is not None and falls_through:
+                        edges[(block << 32) | new_block] = E_FALL_THROUGH
+                    block, closed = new_block, False
+                    cfg.block_address.append(op_address)
+                    cfg.block_size.append(0)
+                    cfg.block_function.append(function_index)
+                cfg.block_size[block] += 1
+                falls_through = True
+                if target is None:
+                    continue
+                kind = branch_kind(mnemonic)
+                branches.append((block, target, kind))
+                if kind == E_JUMP:
+                    # A jump ends the block; the next instruction starts a new one
+                    closed = True
+                    falls_through = mnemonic not in _UNCONDITIONAL_JUMPS
+
+        block_index = {address: index for index, address in enumerate(cfg.block_address)}
+        for block, target, kind in branches:
+            destination = block_index.get(target)
+            if destination is None:
+                cfg.external_edges += 1
+                continue
+            key = (block << 32) | destination
+            edges[key] = edges.get(key, 0) | kind
+
+        counts = Counter(key >> 32 for key in edges)
+        total = 0
+        for block in range(len(cfg.block_address)):
+            total += counts.get(block, 0)
+            cfg.offsets.append(total)
+        for key in sorted(edges):
+            cfg.targets.append(key & 0xFFFFFFFF)
+            cfg.kinds.append(edges[key])
+        return cfg
+
+    def successors(self, block):
+        """
+        Return [(destination block, kind mask)] of one block.
+        """
+        start, end = self.offsets[block], self.offsets[block + 1]
+        return list(zip(self.targets[start:end], self.kinds[start:end]))
+
+    def out_degrees(self):
+        return array('I', map(operator.sub, self.offsets[1:], self.offsets[:-1]))
+
+    def in_degrees(self):
+        counts = Counter(self.targets)
+        return array('I', (counts.get(block, 0) for block in range(len(self))))
+
+    def function_block_counts(self):
+        """
+        Number of basic blocks of every code block (function), in file order.
+        """
+        counts = Counter(self.block_function)
+        return array('I', (counts.get(function, 0) for function in range(len(self.function_address))))
+
+    def features(self):
+        """
+        Graph features: sizes, degree histograms, blocks per function and edge kinds.
+        """
+        kind_counts = Counter(self.kinds)
+        return {
+            "blocks": len(self),
+            "edges": len(self.targets),
+            "functions": len(self.function_address),
+            "external_edges": self.external_edges,
+            "out_degree_histogram": dict(sorted(Counter(self.out_degrees()).items())),
+            "in_degree_histogram": dict(sorted(Counter(self.in_degrees()).items())),
+            "function_block_histogram": dict(sorted(Counter(self.function_block_counts()).items())),
+            "edge_kinds": {
+                name: sum(count for mask, count in kind_counts.items() if mask & kind)
+                for name, kind in (("fall_through", E_FALL_THROUGH), ("jump", E_JUMP), ("call", E_CALL))
+            },
+        }
+
+    def to_networkx(self):
+        """
+        Export as a networkx.DiGraph; networkx is imported only here. Nodes are block
+        indexes with address and function attributes, edges carry the kind mask.
+        """
+        if self._networkx is None:
+            import networkx as nx
+            graph = nx.DiGraph()
+            for block, address in enumerate(self.block_address):
+                graph.add_node(block, address=address, function=self.function_label[self.block_function[block]])
+            for block in range(len(self)):
+                for destination, kind in self.successors(block):
+                    graph.add_edge(block, destination, kind=kind)
+            self._networkx = graph
+        return self._networkx
+
 class ArmFileInfo:
     """
     Represents an ARM assembly file containing multiple sections.
     """
-    def __init__(self, file_name, file_type):
+    def __init__(self, file_name, file_type, columnar=False):
         self.file_name = file_name
         self.file_type = file_type
+        self.columnar = columnar
         self.sections_count = 0
         self.sections = {}
         self.sections_addrs = {}
         #self.op_asm_total_count = 0
         #self.op_asm_count = defaultdict(int)
         self.op_asm_offset_list = {}
+        # columnar mode: interned mnemonics and per-opcode (cb_offset, op_offset, b_target_offset) columns
+        self.mnemonics = []
+        self.mnemonic_ids = {}
+        self.op_asm_offset_columns = {}
+        self.cfg = None
 
     def add_section(self, section_name):
         if section_name not in self.sections:
-            self.sections[section_name] = ArmSection(section_name)
+            self.sections[section_name] = ArmSection(section_name, self.columnar)
             self.sections_count = len(self.sections)
         return self.sections[section_name]
+
+    def intern_mnemonic(self, op_asm_keyword):
+        mnemonic_id = self.mnemonic_ids.get(op_asm_keyword)
+        if mnemonic_id is None:
+            mnemonic_id = len(self.mnemonics)
+            self.mnemonics.append(op_asm_keyword)
+            self.mnemonic_ids[op_asm_keyword] = mnemonic_id
+        return mnemonic_id
+
+    def add_op_asm_offset(self, op_asm_keyword, cb_offset, op_offset, b_target_offset):
+        columns = self.op_asm_offset_columns.get(op_asm_keyword)
+        if columns is None:
+            columns = self.op_asm_offset_columns[op_asm_keyword] = (array('q'), array('q'), array('q'))
+        columns[0].append(cb_offset)
+        columns[1].append(op_offset)
+        columns[2].append(b_target_offset)
+
+    def merge(self, other):
+        """
+        Append a later part of the same file parsed separately (columnar mode only).
+        Offsets are appended in order, so the merged lists equal those of a serial parse.
+        """
+        mnemonic_map = [self.intern_mnemonic(op_asm_keyword) for op_asm_keyword in other.mnemonics]
+        for section_name, section in other.sections.items():
+            if section_name in self.sections:
+                self.sections[section_name].merge(section, mnemonic_map)
+            else:
+                section.columns.op_mnemonic = array('I', (mnemonic_map[mnemonic_id] for mnemonic_id in section.columns.op_mnemonic))
+                self.sections[section_name] = section
+        self.sections_count = len(self.sections)
+        for op_asm_keyword, other_columns in other.op_asm_offset_columns.items():
+            columns = self.op_asm_offset_columns.get(op_asm_keyword)
+            if columns is None:
+                self.op_asm_offset_columns[op_asm_keyword] = other_columns
+                continue
+            for column, other_column in zip(columns, other_columns):
+                column.extend(other_column)
+
+    def iter_op_asm_offset_lists(self):
+        """
+        Yield (opcode, offset list) pairs in either storage mode.
+        In columnar mode each list is built only while it is being consumed.
+        """
+        if not self.columnar:
+            yield from self.op_asm_offset_list.items()
+            return
+        for op_asm_keyword, (cb_offsets, op_offsets, b_target_offsets) in self.op_asm_offset_columns.items():
+            yield op_asm_keyword, list(zip(cb_offsets, op_offsets, b_target_offsets))
+
+    def build_cfg(self):
+        """
+        Build (or rebuild) the basic-block ControlFlowGraph of the file.
+        """
+        self.cfg = ControlFlowGraph.from_file_info(self)
+        return self.cfg
+
+    def materialize(self):
+        """
+        Materialize the object graph of every section (columnar mode only).
+        """
+        for section in self.sections.values():
+            section.materialize(self.mnemonics)
+        return self.sections
   
@@ -0,0 +1,193 @@
+import os
+import json
+from ARM_InstructionLayout import branch_kind, E_CALL
+
+REPORT_SIMPLE = 'simple'
+REPORT_FULL = 'full'
+REPORT_TYPES = (REPORT_SIMPLE, REPORT_FULL)
+DEFAULT_REPORT_DIR = "./output/reports/"
+
+# Opcode of <UNDEFINED> entries; they are counted but left out of the maps, as in the features
+_UNDEFINED_OP_ASM = '@'
+
+def report_settings(config):
+    """
+    Return (report type, enabled) from asm_analysis_report_type/asm_analysis_report_enable.
+    """
+    report_type = config.get("asm_analysis_report_type", REPORT_SIMPLE)  # full, simple
+    if report_type not in REPORT_TYPES:
+        raise ValueError(f"unknown asm_analysis_report_type {report_type!r}, expected one of {', '.join(REPORT_TYPES)}")
+    report_enable = config.get("asm_analysis_report_enable", 'enable')  # enable, disable
+    return report_type, report_enable == 'enable'
+
+def full_report_enabled(config):
+    report_type, enabled = report_settings(config)
+    return enabled and report_type == REPORT_FULL
+
+def report_file_for(feature_file, config):
+    """
+    Return the report path of an image if a full report is enabled, else None.
+    """
+    if not full_report_enabled(config):
+        return None
+    stem = os.path.splitext(os.path.basename(feature_file))[0]
+    return os.path.join(config.get("asm_analysis_report_dir", DEFAULT_REPORT_DIR), f"{stem}_report.jsonl")
+
+def _region_lists(regions):
+    # update_region keeps the last instruction as a fifth element; only the offsets are reported
+    return {op_asm_keyword: list(region[:4]) for op_asm_keyword, region in regions.items()}
+
+class AsmReport:
+    """
+    Full analysis report of a parse result: one JSON line per file, code block and
+    section. The records are generated lazily, one code block at a time, and written
+    as they are produced; a key listed in ignore_keys is neither computed nor written.
+
+    Code block keys: section_name, cb_address, cb_label, cb_offset, cb_size,
+    instructions_count, branches_count, branch (call/jump and forward/backward counts),
+    op_asm_map_count_per_cb, op_asm_map_per_cb ([op_offset, b_target_offset] rows),
+    op_asm_offset_region_per_cb ([min, max op_offset, min, max b_target_offset]) and
+    instructions (op_address, op_opcode, op_asm, op_comment, op_branch).
+    Section keys: section_name, section_addr, code_blocks_count,
+    total_cb_instructions_count, total_b_branches_count, total_undefined_count, branch
+    and the op_asm_*_per_section maps, whose rows also hold the cb_offset.
+    Columnar parse results keep only the mnemonic as op_asm and no comments.
+    """
+    def __init__(self, controller, ignored_keys=()):
+        self.controller = controller
+        self.ignored_keys = frozenset(ignored_keys)
+
+    @classmethod
+    def from_config(cls, controller, config):
+        return cls(controller, config.get("ignore_keys", []))
+
+    def wants(self, key):
+        return key not in self.ignored_keys
+
+    def _filter(self, record):
+        return {key: value for key, value in record.items() if key not in self.ignored_keys}
+
+    def _instruction_record(self, instruction):
+        record = {
+            "op_address": instruction.op_address,
+            "op_opcode": instruction.op_opcode,
+            "op_asm": instruction.op_asm,
+            "op_comment": instruction.op_comment,
+        }
+        if instruction.branch and self.wants("op_branch"):
+            branch = instruction.branch
+            record["op_branch"] = self._filter({
+                "b_opcode": branch.b_opcode,
+                "b_asm": branch.b_asm,
+                "b_label": branch.b_label,
+                "b_target_addr": branch.b_target_addr,
+                "b_target_offset": branch.b_target_offset,
+            })
+        return self._filter(record)
+
+    @staticmethod
+    def _count_branch(stats, instruction):
+        branch = instruction.branch
+        kind = "calls" if branch_kind(branch.b_opcode_asm) == E_CALL else "jumps"
+        stats[kind] = stats.get(kind, 0) + 1
+        direction = "backward" if branch.b_target_offset < instruction.op_offset else "forward"
+        stats[direction] = stats.get(direction, 0) + 1
+
+    def iter_section_records(self, section, mnemonics):
+        """
+        Yield the code block records of one section, then the section record.
+        """
+        update_region = self.controller.update_region
+        want_cb_counts = self.wants("op_asm_map_count_per_cb")
+        want_cb_map = self.wants("op_asm_map_per_cb")
+        want_cb_regions = self.wants("op_asm_offset_region_per_cb")
+        want_instructions = self.wants("instructions")
+        want_branch = self.wants("branch")
+        want_section_counts = self.wants("op_asm_map_count_per_section")
+        want_section_map = self.wants("op_asm_map_per_section")
+        want_section_regions = self.wants("op_asm_offset_region_per_section")
+        per_instruction = (want_cb_counts or want_cb_map or want_cb_regions or want_instructions or want_branch
+                           or want_section_counts or want_section_map or want_section_regions)
+
+        section_counts, section_map, section_regions, section_branch = {}, {}, {}, {}
+        for cb in section.iter_code_blocks(mnemonics):
+            record = {
+                "type": "code_block",
+                "section_name": section.section_name,
+                "cb_address": cb.cb_address,
+                "cb_label": cb.cb_label,
+                "cb_offset": cb.cb_offset,
+                "cb_size": cb.cb_size,
+                "instructions_count": cb.instructions_count,
+                "branches_count": cb.branches_count,
+            }
+            if per_instruction:
+                cb_counts, cb_map, cb_regions, cb_branch, instructions = {}, {}, {}, {}, []
+                for instruction in cb.instructions:
+                    if want_instructions:
+                        instructions.append(self._instruction_record(instruction))
+                    op_asm_keyword = instruction.op_opcode_asm
+                    if op_asm_keyword == _UNDEFINED_OP_ASM:
+                        continue
+                    if instruction.branch and want_branch:
+                        self._count_branch(cb_branch, instruction)
+                        self._count_branch(section_branch, instruction)
+                    b_target_offset = instruction.branch.b_target_offset if instruction.branch else 0
+                    if want_cb_counts:
+                        cb_counts[op_asm_keyword] = cb_counts.get(op_asm_keyword, 0) + 1
+                    if want_section_counts:
+                        section_counts[op_asm_keyword] = section_counts.get(op_asm_keyword, 0) + 1
+                    if want_cb_map:
+                        cb_map.setdefault(op_asm_keyword, []).append([instruction.op_offset, b_target_offset])
+                    if want_section_map:
+                        section_map.setdefault(op_asm_keyword, []).append([cb.cb_offset, instruction.op_offset, b_target_offset])
+                    if want_cb_regions:
+                        cb_regions[op_asm_keyword] = update_region(cb_regions.get(op_asm_keyword), instruction)
+                    if want_section_regions:
+                        section_regions[op_asm_keyword] = update_region(section_regions.get(op_asm_keyword), instruction)
+                record["branch"] = cb_branch
+                record["op_asm_map_count_per_cb"] = cb_counts
+                record["op_asm_map_per_cb"] = cb_map
+                record["op_asm_offset_region_per_cb"] = _region_lists(cb_regions)
+                record["instructions"] = instructions
+            yield self._filter(record)
+
+        yield self._filter({
+            "type": "section",
+            "section_name": section.section_name,
+            "section_addr": section.section_addr,
+            "code_blocks_count": section.code_blocks_count,
+            "total_cb_instructions_count": section.total_cb_instructions_count,
+            "total_b_branches_count": section.total_b_branches_count,
+            "total_undefined_count": section.total_undefined_count,
+            "branch": section_branch,
+            "op_asm_map_count_per_section": section_counts,
+            "op_asm_map_per_section": section_map,
+            "op_asm_offset_region_per_section": _region_lists(section_regions),
+        })
+
+    def iter_records(self, asm_metadata):
+        """
+        Yield the report records of a {file name: ArmFileInfo} parse result in file order.
+        """
+        for file_name, file_info in asm_metadata.items():
+            yield self._filter({
+                "type": "file",
+                "file_name": file_name,
+                "file_type": file_info.file_type,
+                "sections_count": file_info.sections_count,
+            })
+            for section in file_info.sections.values():
+                yield from self.iter_section_records(section, file_info.mnemonics)
+
+    def write(self, asm_metadata, report_file):
+        """
+        Stream the records to report_file as JSON lines, replacing it atomically.
+        """
+        os.makedirs(os.path.dirname(report_file) or '.', exist_ok=True)
+        tmp_file = report_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for record in self.iter_records(asm_metadata):
+                f.write(json.dumps(record, separators=(',', ':')))
+                f.write('\n')
+        os.replace(tmp_file, report_file)
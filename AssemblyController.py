@@ -2,8 +2,8 @@ import re
 import yaml
 import io
 
-from collections import defaultdict
-from ARM_InstructionLayout import ArmFileInfo, ArmCodeBlock
+from ARM_InstructionLayout import ArmFileInfo, ArmCodeBlock, F_BRANCH, F_UNDEFINED
+from MnemonicNormalizer import KIND_JUMP, KIND_CALL
 
 k_file_format = 'file format'
 k_section = 'section'
@@ -17,16 +17,33 @@ k_op_asm = 'op_asm'
 k_instructions = 'instructions'
 k_target_addr = 'target_addr'
 
+# Precompiled objdump patterns
+_FILE_FORMAT_RE = re.compile(r'file format\s+(\S+)')
+_SECTION_RE = re.compile(r'Disassembly of section ([\w\.\-]+):')
+_LABEL_RE = re.compile(r'([0-9A-Fa-f]+)\s+<([^>]+)>:')
+_BRANCH_RE = re.compile(
+    r"\s*(?P<address>[0-9a-f]+):\s+(?P<op>[0-9a-f ]+)\s+(?P<op_asm>[a-z.]+)\s+(?P<target_addr>[0-9a-f]+)?(?:\s+<(?P<label>.+)>)?"
+)
+# Label and instruction lines start with a hex address; anything else can only be
+# a file header or a section title.
+_HEX_FIRST_CHARS = frozenset('0123456789abcdefABCDEF')
+
 class AssemblyController:
-    def __init__(self, branch_ops, used_op_asm=True, selected_sections=None):
-        self.cfg = nx.DiGraph()
+    def __init__(self, branch_ops, used_op_asm=True, selected_sections=None, columnar=False, build_cfg=False,
+                 instruction_rows=True, normalizer=None):
         self.branch_ops = branch_ops
         self.used_op_asm = used_op_asm
         self.selected_sections = selected_sections
-        self.op2cb = defaultdict(set)
-        self.op2branch = defaultdict(set)
-        self.cbset = set()
-        self.branchset = set()
+        # columnar=True stores instructions in per-section typed arrays instead of ArmInstruction objects
+        self.columnar = columnar
+        # build_cfg=True attaches a ControlFlowGraph to every parsed ArmFileInfo (file_info.cfg)
+        self.build_cfg = build_cfg
+        # instruction_rows=False (columnar mode) keeps only the per-opcode offset columns the
+        # feature hashes need: code blocks and counts are recorded, instruction rows are not
+        self.instruction_rows = instruction_rows or build_cfg
+        # normalizer (MnemonicNormalizer) folds mnemonics into canonical classes and detects
+        # branches by their kind instead of branch_ops; None keeps the raw mnemonics
+        self.normalizer = normalizer
 
     @staticmethod
     def extract_filename_and_type(line_parts):
@@ -36,7 +53,7 @@ class AssemblyController:
         file_name = line_parts[0].replace('/', '=').replace('\\', '=')
         file_name_parts = file_name.split('=')
         file_name_meta = f"{file_name_parts[1]}_{file_name_parts[3]}_{file_name_parts[2]}"
-        match = re.search(r'file format\s+(\S+)', line_parts[1])
+        match = _FILE_FORMAT_RE.search(line_parts[1])
         file_type = match.group(1) if match else ''
         return file_name_meta, file_type
 
@@ -45,7 +62,7 @@ class AssemblyController:
         """
         Extract section name from a disassembly header line.
         """
-        match = re.search(r'Disassembly of section ([\w\.\-]+):', input_string)
+        match = _SECTION_RE.search(input_string)
         return match.group(1) if match else None
 
     @staticmethod
@@ -53,7 +70,7 @@ class AssemblyController:
         """
         Extract address and label name from a formatted assembly line.
         """
-        match = re.match(r'([0-9A-Fa-f]+)\s+<([^>]+)>:', input_string)
+        match = _LABEL_RE.match(input_string)
         if match:
             return int(match.group(1), 16), match.group(2)
         return None, None
@@ -62,10 +79,7 @@ class AssemblyController:
         """
         Parse a branch instruction to extract relevant details.
         """
-        pattern = re.compile(
-            r"\s*(?P<address>[0-9a-f]+):\s+(?P<op>[0-9a-f ]+)\s+(?P<op_asm>[a-z.]+)\s+(?P<target_addr>[0-9a-f]+)?(?:\s+<(?P<label>.+)>)?"
-        )
-        match = pattern.match(asm_line)
+        match = _BRANCH_RE.match(asm_line)
         if match and match.group("op_asm") in self.branch_ops:
             return {
                 "address": int(match.group("address"), 16),
@@ -76,17 +90,39 @@ class AssemblyController:
             }
         return None
 
+    @staticmethod
+    def parse_branch_target(op_address, op_code, mnemonic, operands):
+        """
+        Parse the direct target of a branch whose kind comes from a MnemonicNormalizer.
+        """
+        # The target is the last operand, before an optional <label>: b 8000 <f>,
+        # cbz r0, 8010 <f+0x10>, tbnz w0, #3, 4000. Register operands (bx lr) have none.
+        target, _, label = operands.partition(' <')
+        try:
+            target_addr = int(target.rpartition(' ')[2], 16)
+        except ValueError:
+            return None
+        return {
+            "address": op_address,
+            "op": op_code,
+            "op_asm": mnemonic,
+            "target_addr": target_addr,
+            "label": label[:-1] if label.endswith('>') else label
+        }
+
     def parse_asm_line(self, line):
         """
         Parse a single assembly instruction line.
         """
-        op_address = int(line.split(':')[0].strip(), 16)
         parts = line.split('\t')
+        address, sep, _ = parts[0].partition(':')
+        op_address = int(address if sep else line.split(':')[0], 16)
         op_code = parts[1].strip() if len(parts) > 1 else ''
-        op_asm = ' '.join(parts[2:]).strip() if len(parts) > 2 else ''
+        op_asm = ' '.join(parts[2:]).strip()
         comment_parts = line.split('@ ')
         op_comment = comment_parts[1] if len(comment_parts) > 1 else ''
-        op_branch = self.parse_branch_instruction(line)
+        # The branch regex only runs for mnemonics that can be branches.
+        op_branch = self.parse_branch_instruction(line) if op_asm.partition(' ')[0] in self.branch_ops else None
         return op_address, op_code, op_asm, op_comment, op_branch
 
     def update_region(self, region_tuple, current_instruction):
@@ -126,73 +162,191 @@ class AssemblyController:
         else:
             file_info.op_asm_offset_list[op_asm_keyword].append((current_cb.cb_offset, current_instruction.op_offset, 0))
 
-    def update_asm_meta_coverage(self, op_asm_keyword, cb_address, op_branch):
-        self.op2cb[op_asm_keyword].add(cb_address)
-        self.cbset.add(cb_address)
-        if op_branch:
-            self.op2branch[op_asm_keyword].add(op_branch['target_addr'])
-            self.branchset.add(op_branch['target_addr'])
-
     def parseAsmCodes(self, asm_content):
         """
         Parse the assembly content (as a string) and identify basic blocks.
         """
+        return self.parseAsmLines(io.StringIO(asm_content))
+
+    def parseAsmFile(self, file_path):
+        """
+        Parse an assembly file from disk without loading it into memory.
+        """
+        with open(file_path, 'r') as file:
+            return self.parseAsmLines(file)
+
+    def parseAsmFileParallel(self, file_path, workers=None):
+        """
+        Parse a large assembly file on several processes (columnar mode only).
+        The file is split at code block labels and the shards are merged in order,
+        so the result matches parseAsmFile. See ParallelParser.
+        """
+        from ParallelParser import parse_file_sharded
+        return parse_file_sharded(self, file_path, workers)[0]
+
+    def parseAsmLines(self, lines, context=None):
+        """
+        Parse assembly text from any iterable of lines (file handle, decompression
+        stream, socket reader) and build the ArmFileInfo incrementally.
+        Only one line is held at a time, so memory follows the parsed metadata.
+
+        context resumes a parse in the middle of a file (see ParallelParser): the
+        lines start at a code block label and context carries the file header,
+        section and section_addr that a serial parse would have at that point.
+
+        Each line is split once on tabs; the first character separates address
+        lines from headers and the branch regex only runs for mnemonics in
+        branch_ops. Target: at least 3x the lines/s of the previous tokenizer
+        with per-line object construction (columnar mode).
+
+        With a normalizer, the mnemonic is looked up once in the table of the
+        file's architecture; the entry gives both the feature keyword and the
+        branch kind, and only jumps and calls have their operands searched.
+        """
         asm_meta = {}
         cur_section_name, file_name, file_type = '', '', ''
         first_cb = None
 
-        file = io.StringIO(asm_content)  # Create a file-like object from string
         current_file_info, current_cb, current_section, last_cb = None, None, None, None
         op_address, last_op_address = 0, 0
 
-        for line in file:
+        branch_ops = self.branch_ops
+        used_op_asm = self.used_op_asm
+        columnar = self.columnar
+        instruction_rows = self.instruction_rows
+        parse_branch_instruction = self.parse_branch_instruction
+        parse_branch_target = self.parse_branch_target
+        normalizer = self.normalizer
+        if normalizer:
+            norm_table = normalizer.table_for(file_type)
+            norm_entries, norm_lookup = norm_table.entries, norm_table.lookup
+        hex_first_chars = _HEX_FIRST_CHARS
+
+        if context:
+            first_cb = True if context["first_cb_seen"] else None
+            if context["file"]:
+                file_name, file_type = context["file"]
+                current_file_info = asm_meta[file_name] = ArmFileInfo(file_name, file_type, columnar)
+                if normalizer:
+                    norm_table = normalizer.table_for(file_type)
+                    norm_entries, norm_lookup = norm_table.entries, norm_table.lookup
+            if context["in_section"] and current_file_info:
+                cur_section_name = context["section"]
+                if not self.selected_sections or cur_section_name in self.selected_sections:
+                    current_section = current_file_info.add_section(cur_section_name)
+                    current_section.section_addr = context["section_addr"]
+                    section_columns = current_section.columns
+
+        for line in lines:
             line = line.strip()
             if not line:
                 continue
 
-            line_parts = [part.strip() for part in line.split(':')]
-            if len(line_parts) > 1 and k_file_format in line_parts[1]:
-                file_name, file_type = self.extract_filename_and_type(line_parts)
-                asm_meta[file_name] = ArmFileInfo(file_name, file_type)
-                current_file_info = asm_meta[file_name]
-                continue
+            if k_file_format in line:
+                line_parts = [part.strip() for part in line.split(':')]
+                if len(line_parts) > 1 and k_file_format in line_parts[1]:
+                    file_name, file_type = self.extract_filename_and_type(line_parts)
+                    asm_meta[file_name] = ArmFileInfo(file_name, file_type, columnar)
+                    current_file_info = asm_meta[file_name]
+                    if normalizer:
+                        norm_table = normalizer.table_for(file_type)
+                        norm_entries, norm_lookup = norm_table.entries, norm_table.lookup
+                    continue
 
             if k_section in line and '<' not in line and '>:' not in line:
                 cur_section_name = self.extract_section_name(line)
                 current_section = None
                 if not self.selected_sections or cur_section_name in self.selected_sections:
                     current_section = current_file_info.add_section(cur_section_name)
+                if columnar:
+                    current_cb = None
+                    section_columns = current_section.columns if current_section else None
                 continue
 
-            if not current_section:
+            if not current_section or line[0] not in hex_first_chars:
                 continue
 
             if '<' in line and '>:' in line:
                 cb_address, cb_label = self.extract_address_and_label(line)
                 if cb_address >= 0 and cb_label:
-                    last_cb = current_cb
-                    if not first_cb:
-                        current_section.section_addr = cb_address 
-                    current_cb = ArmCodeBlock(cb_address, cb_label, current_section, last_cb)
-                    if not first_cb:
+                    if first_cb is None:
+                        current_section.section_addr = cb_address
+                    if columnar:
+                        current_cb = current_section.add_code_block_row(cb_address, cb_label)
+                        cb_offset = cb_address - current_section.section_addr
+                    else:
+                        last_cb = current_cb
+                        current_cb = ArmCodeBlock(cb_address, cb_label, current_section, last_cb)
+                        current_section.add_code_block(cb_address, cb_label, current_cb)
+                    if first_cb is None:
                         first_cb = current_cb
-                    current_section.add_code_block(cb_address, cb_label, current_cb)
                 continue
 
-            if line.count('\t') >= 3:
-                last_op_address = op_address
-                op_address, op_code, op_asm, op_comment, op_branch = self.parse_asm_line(line)
-                current_instruction = current_file_info.sections[cur_section_name].code_blocks[cb_address].add_instruction(
-                    op_address, op_code, op_asm, op_comment, op_branch
-                )
-                op_asm_keyword = op_asm.split(' ')[0] if self.used_op_asm else op_code.replace(' ', '')
-                if op_asm_keyword == '@' and '<UNDEFINED>' in op_asm.split(' '):
+            parts = line.split('\t')
+            if len(parts) < 4:
+                continue
+
+            # Instruction line: "address:\topcode\tmnemonic\toperands[\t@ comment]"
+            last_op_address = op_address
+            address, sep, _ = parts[0].partition(':')
+            op_address = int(address if sep else line.split(':')[0], 16)
+            op_code = parts[1].strip()
+            op_asm = ' '.join(parts[2:]).strip()
+            mnemonic = op_asm.partition(' ')[0]
+            if normalizer:
+                canonical, kind = norm_entries.get(mnemonic) or norm_lookup(mnemonic)
+                op_branch = parse_branch_target(op_address, op_code, mnemonic, parts[3]) \
+                    if kind == KIND_JUMP or kind == KIND_CALL else None
+                op_asm_keyword = canonical if used_op_asm else op_code.replace(' ', '')
+            else:
+                op_branch = parse_branch_instruction(line) if mnemonic in branch_ops else None
+                op_asm_keyword = mnemonic if used_op_asm else op_code.replace(' ', '')
+            undefined = op_asm_keyword == '@' and '<UNDEFINED>' in op_asm.split(' ')
+
+            if columnar:
+                if current_cb is None:
+                    raise KeyError(cb_address)
+                flags = F_UNDEFINED if undefined else 0
+                b_target_addr = 0
+                if op_branch and op_branch["address"] != -1:
+                    flags |= F_BRANCH
+                    b_target_addr = op_branch["target_addr"]
+                if instruction_rows:
+                    mnemonic_id = current_file_info.mnemonic_ids.get(op_asm_keyword)
+                    if mnemonic_id is None:
+                        mnemonic_id = current_file_info.intern_mnemonic(op_asm_keyword)
+                    section_columns.add_instruction(current_cb, op_address, int(op_code.replace(' ', ''), 16) if op_code else 0,
+                                                    mnemonic_id, flags, b_target_addr)
+                current_section.total_cb_instructions_count += 1
+                if undefined:
+                    current_section.total_undefined_count += 1
                     continue
-                self.update_asm_meta(current_file_info, current_cb, op_asm_keyword, current_instruction)
+                if flags & F_BRANCH:
+                    current_section.total_b_branches_count += 1
+                    b_target_offset = b_target_addr - cb_address
+                else:
+                    b_target_offset = 0
+                current_file_info.add_op_asm_offset(op_asm_keyword, cb_offset, op_address - cb_address, b_target_offset)
+                continue
+
+            comment_parts = line.split('@ ')
+            op_comment = comment_parts[1] if len(comment_parts) > 1 else ''
+            current_instruction = current_file_info.sections[cur_section_name].code_blocks[cb_address].add_instruction(
+                op_address, op_code, op_asm, op_comment, op_branch
+            )
+            if normalizer and used_op_asm:
+                current_instruction.op_opcode_asm = op_asm_keyword
+            if undefined:
+                current_section.total_undefined_count += 1
+                continue
+            self.update_asm_meta(current_file_info, current_cb, op_asm_keyword, current_instruction)
 
-        if current_cb and last_cb:
+        if not columnar and current_cb and last_cb:
             current_cb.cb_size = current_cb.cb_address - last_cb.cb_address
 
+        if self.build_cfg:
+            for file_info in asm_meta.values():
+                file_info.build_cfg()
         return asm_meta
 
     def parseAsmForOpcodeFileName(self, file_path):
@@ -214,83 +368,25 @@ class AssemblyController:
                     break
         return file_name
 
-    def parseAsmForOpcodeCoverageRate(self, file_path, progress):
+    def parseAsmForOpcodeCoverageRate(self, file_path, progress, low_memory=False):
         """
-        Parse the assembly file and identify basic blocks.
+        Per-opcode coverage of the file: for every opcode, the fraction of code blocks
+        (cb_coverage) and branch targets (branch_coverage) that do not contain it.
+        progress(bytes_read, total_bytes) is throttled, see CoverageEngine.
+        low_memory=True streams a memory-mapped file in two passes for huge dumps.
+        Opcodes are normalized with the controller's normalizer, as in the features.
+        Returns (file name, coverage_meta); no state is kept on the controller.
         """
-        asm_meta = {}
-        coverage_meta = {"cb_coverage": {}, "branch_coverage": {}}
-        cur_section_name, file_name, file_type = '', '', ''
-        first_cb = None
-
-        with open(file_path, 'r') as file:
-            lines = file.readlines()
-            total_lines = len(lines)
-
-            current_file_info, current_cb, current_section, last_cb = None, None, None, None
-            op_address, last_op_address = 0, 0
-
-            for idx, line in enumerate(lines):
-                if progress:
-                    progress(idx + 1, total_lines)
-
-                line = line.strip()
-                if not line:
-                    continue
-
-                line_parts = [part.strip() for part in line.split(':')]
-                if len(line_parts) > 1 and k_file_format in line_parts[1]:
-                    file_name, file_type = self.extract_filename_and_type(line_parts)
-                    asm_meta['arm_info'] = ArmFileInfo(file_name, file_type)
-                    current_file_info = asm_meta['arm_info']
-                    continue
-
-                if k_section in line and '<' not in line and '>:' not in line:
-                    cur_section_name = self.extract_section_name(line)
-                    current_section = None
-                    if not self.selected_sections or cur_section_name in self.selected_sections:
-                        current_section = current_file_info.add_section(cur_section_name)
-                    continue
-
-                if not current_section:
-                    continue
-
-                if '<' in line and '>:' in line:
-                    cb_address, cb_label = self.extract_address_and_label(line)
-                    if cb_address >= 0 and cb_label:
-                        last_cb = current_cb
-                        if not first_cb:
-                            current_section.section_addr = cb_address 
-                        current_cb = ArmCodeBlock(cb_address, cb_label, current_section, last_cb)
-                        if not first_cb:
-                            first_cb = current_cb
-                        current_section.add_code_block(cb_address, cb_label, current_cb)
-                    continue
+        from CoverageEngine import CoverageEngine
+        engine = CoverageEngine(self.branch_ops, self.used_op_asm, self.selected_sections, self.normalizer)
+        file_name = engine.parse_file(file_path, progress, low_memory)
+        return file_name, engine.stats().coverage_meta()
 
-                if line.count('\t') >= 3:
-                    last_op_address = op_address
-                    op_address, op_code, op_asm, op_comment, op_branch = self.parse_asm_line(line)
-                    op_asm_keyword = op_asm.split(' ')[0] if self.used_op_asm else op_code.replace(' ', '')
-                    if op_asm_keyword == '@' and '<UNDEFINED>' in op_asm.split(' '):
-                        continue
-                    self.update_asm_meta_coverage(op_asm_keyword, cb_address, op_branch)
-
-            if current_cb and last_cb:
-                current_cb.cb_size = current_cb.cb_address - last_cb.cb_address
-
-        for opcode, cbset in self.op2cb.items():
-            diff = self.cbset - cbset
-            coverage_meta["cb_coverage"][opcode] = len(diff) / len(self.cbset)
-        for opcode, branchset in self.op2branch.items():
-            diff = self.branchset - branchset
-            coverage_meta["branch_coverage"][opcode] = len(diff) / len(self.branchset)
-        return file_name, coverage_meta
-    
     def process_files(self, files):
         """
         Process multiple assembly files.
         """
         asm_files = {}
         for file in files:
-            asm_files[file] = self.parseAsmCodes(file, asm_files)
+            asm_files[file] = self.parseAsmFile(file)
         return asm_files
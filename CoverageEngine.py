@@ -0,0 +1,344 @@
+import os
+import sys
+import json
+import mmap
+import argparse
+from array import array
+from bisect import bisect_left
+from AssemblyController import AssemblyController, k_file_format, k_section, _HEX_FIRST_CHARS
+from MnemonicNormalizer import MnemonicNormalizer, KIND_JUMP, KIND_CALL
+
+PROGRESS_INTERVAL_BYTES = 1 << 20
+# Collected addresses are sorted and deduplicated whenever they grow by this many entries
+COMPACT_INTERVAL = 1 << 20
+
+def _set_bit(bitmap, index):
+    byte = index >> 3
+    if byte >= len(bitmap):
+        bitmap.extend(bytes(byte + 1 - len(bitmap)))
+    bitmap[byte] |= 1 << (index & 7)
+
+def _popcount(bitmap):
+    return int.from_bytes(bitmap, 'little').bit_count()
+
+class _AddressSet:
+    """
+    Distinct addresses as a sorted array('Q'): 8 bytes per address instead of a dict
+    entry. Addresses are appended unsorted and compacted in batches; after the last
+    compact() the dense id of an address is its rank.
+    """
+    __slots__ = ('addresses', 'compacted')
+
+    def __init__(self):
+        self.addresses = array('Q')
+        self.compacted = 0
+
+    def add(self, address):
+        self.addresses.append(address)
+        if len(self.addresses) - self.compacted >= COMPACT_INTERVAL:
+            self.compact()
+        return 0
+
+    def compact(self):
+        self.addresses = array('Q', sorted(set(self.addresses)))
+        self.compacted = len(self.addresses)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def rank(self, address):
+        return bisect_left(self.addresses, address)
+
+def iter_mmap_lines(mm, progress=None):
+    """
+    Decoded lines of a memory-mapped file. progress(offset, size) reports the bytes
+    consumed about every PROGRESS_INTERVAL_BYTES; the pages read so far are then
+    released, so resident memory does not grow with the file size.
+    """
+    readline, tell, size = mm.readline, mm.tell, len(mm)
+    release = getattr(mmap, "MADV_DONTNEED", None) if hasattr(mm, "madvise") else None
+    released, next_progress = 0, PROGRESS_INTERVAL_BYTES
+    while True:
+        line = readline()
+        if not line:
+            break
+        if tell() >= next_progress:
+            offset = tell()
+            if progress:
+                progress(offset, size)
+            if release is not None:
+                end = offset - offset % mmap.PAGESIZE
+                mm.madvise(release, released, end - released)
+                released = end
+            next_progress = offset + PROGRESS_INTERVAL_BYTES
+        yield line.decode('utf-8')
+
+def iter_file_lines(file, progress=None, total_bytes=0):
+    """
+    Decoded lines of a file opened in binary mode. progress(bytes_read, total_bytes)
+    is called about every PROGRESS_INTERVAL_BYTES with the bytes read, which, unlike
+    the characters of non-ASCII lines, add up to the file size.
+    """
+    bytes_read, next_progress = 0, PROGRESS_INTERVAL_BYTES
+    for line in file:
+        bytes_read += len(line)
+        if progress and bytes_read >= next_progress:
+            progress(bytes_read, total_bytes)
+            next_progress = bytes_read + PROGRESS_INTERVAL_BYTES
+        yield line.decode('utf-8')
+
+class CoverageStats:
+    """
+    Per-opcode counts behind the coverage rates: how many code blocks (branch targets)
+    contain the opcode out of all code blocks (branch targets). Counts of different
+    files add up, so stats can be merged into corpus-wide rates.
+    """
+    def __init__(self):
+        self.cb_total = 0
+        self.branch_total = 0
+        self.cb_hits = {}      # opcode -> code blocks containing it
+        self.branch_hits = {}  # opcode -> distinct branch targets it jumps to
+
+    def merge(self, other):
+        self.cb_total += other.cb_total
+        self.branch_total += other.branch_total
+        for opcode, hits in other.cb_hits.items():
+            self.cb_hits[opcode] = self.cb_hits.get(opcode, 0) + hits
+        for opcode, hits in other.branch_hits.items():
+            self.branch_hits[opcode] = self.branch_hits.get(opcode, 0) + hits
+        return self
+
+    def coverage_meta(self):
+        """
+        Return {"cb_coverage": {...}, "branch_coverage": {...}} with, per opcode, the
+        fraction of code blocks (branch targets) that do not contain it.
+        """
+        return {
+            "cb_coverage": {opcode: (self.cb_total - hits) / self.cb_total for opcode, hits in self.cb_hits.items()},
+            "branch_coverage": {opcode: (self.branch_total - hits) / self.branch_total for opcode, hits in self.branch_hits.items()},
+        }
+
+    def to_dict(self):
+        return {"cb_total": self.cb_total, "branch_total": self.branch_total,
+                "cb_hits": self.cb_hits, "branch_hits": self.branch_hits}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.cb_total, stats.branch_total = data["cb_total"], data["branch_total"]
+        stats.cb_hits, stats.branch_hits = dict(data["cb_hits"]), dict(data["branch_hits"])
+        return stats
+
+class CoverageEngine:
+    """
+    Opcode coverage of one parse. Code blocks and branch targets get dense ids and
+    every opcode keeps one bitmap over each id space, so the rates are popcounts
+    instead of set differences. All state belongs to the engine, not the controller.
+
+    parse_file(low_memory=True) reads a memory-mapped file in two passes: the first
+    collects the distinct code block and branch target addresses into sorted arrays,
+    the second numbers them by rank and sets the bitmaps. Only the arrays and the
+    bitmaps are held, instead of the address -> id dicts of the single pass.
+
+    With a normalizer (mnemonic_normalization), opcodes and branches are classified as
+    in the feature extraction, so the coverage rates use the same opcode keys.
+    """
+    def __init__(self, branch_ops, used_op_asm=True, selected_sections=None, normalizer=None):
+        self.controller = AssemblyController(branch_ops, used_op_asm, selected_sections, normalizer=normalizer)
+        self.cb_ids = {}         # code block address -> dense id
+        self.target_ids = {}     # branch target address -> dense id
+        self.cb_bitmaps = {}     # opcode -> bytearray over code block ids
+        self.branch_bitmaps = {}  # opcode -> bytearray over branch target ids
+
+    def parse_lines(self, lines, progress=None, total_bytes=0):
+        """
+        Add the instructions of an objdump text stream. progress(chars_read, total_bytes)
+        is called about every PROGRESS_INTERVAL_BYTES characters and once at the end;
+        parse_file reports bytes instead.
+        Returns the name of the last file header.
+        """
+        cb_ids, target_ids = self.cb_ids, self.target_ids
+        return self._scan(lines, progress, total_bytes,
+                          lambda address: cb_ids.setdefault(address, len(cb_ids)),
+                          lambda address: target_ids.setdefault(address, len(target_ids)))
+
+    def _scan(self, lines, progress, total_bytes, cb_id_of, target_id_of, set_bits=True):
+        """
+        The parse loop of parse_lines. cb_id_of/target_id_of map an address to its
+        dense id; they run once per code block and per branch, not per instruction.
+        set_bits=False only feeds the addresses to them (first low-memory pass).
+        """
+        controller = self.controller
+        branch_ops = controller.branch_ops
+        used_op_asm = controller.used_op_asm
+        selected_sections = controller.selected_sections
+        parse_branch_instruction = controller.parse_branch_instruction
+        parse_branch_target = controller.parse_branch_target
+        normalizer = controller.normalizer
+        norm_lookup = normalizer.table_for().lookup if normalizer else None
+        hex_first_chars = _HEX_FIRST_CHARS
+        cb_bitmaps, branch_bitmaps = self.cb_bitmaps, self.branch_bitmaps
+
+        file_name, in_section = '', False
+        cb_address, cb_id = None, None
+        bytes_read, next_progress = 0, PROGRESS_INTERVAL_BYTES
+
+        for line in lines:
+            if progress:
+                bytes_read += len(line)
+                if bytes_read >= next_progress:
+                    progress(bytes_read, total_bytes)
+                    next_progress = bytes_read + PROGRESS_INTERVAL_BYTES
+            line = line.strip()
+            if not line:
+                continue
+
+            if k_file_format in line:
+                line_parts = [part.strip() for part in line.split(':')]
+                if len(line_parts) > 1 and k_file_format in line_parts[1]:
+                    file_name, file_type = controller.extract_filename_and_type(line_parts)
+                    if normalizer:
+                        norm_lookup = normalizer.table_for(file_type).lookup
+                    continue
+
+            if k_section in line and '<' not in line and '>:' not in line:
+                section_name = controller.extract_section_name(line)
+                in_section = not selected_sections or section_name in selected_sections
+                continue
+
+            if not in_section or line[0] not in hex_first_chars:
+                continue
+
+            if '<' in line and '>:' in line:
+                address, label = controller.extract_address_and_label(line)
+                if address >= 0 and label:
+                    cb_address, cb_id = address, None
+                continue
+
+            parts = line.split('\t')
+            if len(parts) < 4:
+                continue
+            op_asm = ' '.join(parts[2:]).strip()
+            mnemonic = op_asm.partition(' ')[0]
+            if normalizer:
+                canonical, kind = norm_lookup(mnemonic)
+                op_asm_keyword = canonical if used_op_asm else parts[1].strip().replace(' ', '')
+            else:
+                kind = None
+                op_asm_keyword = mnemonic if used_op_asm else parts[1].strip().replace(' ', '')
+            if op_asm_keyword == '@' and '<UNDEFINED>' in op_asm.split(' '):
+                continue
+
+            if cb_id is None:
+                if cb_address is None:
+                    raise KeyError("instruction before the first code block label")
+                cb_id = cb_id_of(cb_address)
+            if set_bits:
+                bitmap = cb_bitmaps.get(op_asm_keyword)
+                if bitmap is None:
+                    bitmap = cb_bitmaps[op_asm_keyword] = bytearray()
+                _set_bit(bitmap, cb_id)
+
+            if kind == KIND_JUMP or kind == KIND_CALL:
+                op_branch = parse_branch_target(0, '', mnemonic, parts[3])
+            else:
+                op_branch = parse_branch_instruction(line) if kind is None and mnemonic in branch_ops else None
+            if op_branch:
+                target_id = target_id_of(op_branch['target_addr'])
+                if not set_bits:
+                    continue
+                bitmap = branch_bitmaps.get(op_asm_keyword)
+                if bitmap is None:
+                    bitmap = branch_bitmaps[op_asm_keyword] = bytearray()
+                _set_bit(bitmap, target_id)
+
+        if progress:
+            progress(total_bytes or bytes_read, total_bytes or bytes_read)
+        return file_name
+
+    def parse_file(self, file_path, progress=None, low_memory=False):
+        """
+        Add the instructions of an .asm file; see the class docstring for low_memory.
+        progress(bytes_read, total_bytes) counts both passes of the low-memory mode.
+        """
+        total_bytes = os.path.getsize(file_path)
+        if not low_memory:
+            # Read as bytes so the progress is counted in the unit of total_bytes
+            with open(file_path, 'rb') as file:
+                file_name = self.parse_lines(iter_file_lines(file, progress, total_bytes))
+            if progress:
+                progress(total_bytes, total_bytes)
+            return file_name
+        if self.cb_ids or self.target_ids or self.cb_bitmaps:
+            raise ValueError("low_memory parse_file needs a fresh engine")
+        if not total_bytes:
+            return ''  # an empty file cannot be memory-mapped
+        cb_set, target_set = _AddressSet(), _AddressSet()
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            first_pass = progress and (lambda done, total: progress(done, 2 * total))
+            self._scan(iter_mmap_lines(mm, first_pass), None, 0, cb_set.add, target_set.add, set_bits=False)
+            cb_set.compact()
+            target_set.compact()
+            mm.seek(0)
+            second_pass = progress and (lambda done, total: progress(total + done, 2 * total))
+            file_name = self._scan(iter_mmap_lines(mm, second_pass), None, 0, cb_set.rank, target_set.rank)
+        if progress:
+            progress(total_bytes, total_bytes)
+        self.cb_ids, self.target_ids = cb_set, target_set
+        return file_name
+
+    def stats(self):
+        stats = CoverageStats()
+        stats.cb_total = len(self.cb_ids)
+        stats.branch_total = len(self.target_ids)
+        stats.cb_hits = {opcode: _popcount(bitmap) for opcode, bitmap in self.cb_bitmaps.items()}
+        stats.branch_hits = {opcode: _popcount(bitmap) for opcode, bitmap in self.branch_bitmaps.items()}
+        return stats
+
+def corpus_coverage(file_paths, branch_ops, used_op_asm=True, selected_sections=None, progress=None, low_memory=False,
+                    normalizer=None):
+    """
+    Merge the coverage counts of many files. Returns ({file path: CoverageStats}, corpus CoverageStats).
+    """
+    per_file, corpus = {}, CoverageStats()
+    for file_path in file_paths:
+        engine = CoverageEngine(branch_ops, used_op_asm, selected_sections, normalizer)
+        engine.parse_file(file_path, progress, low_memory)
+        per_file[file_path] = engine.stats()
+        corpus.merge(per_file[file_path])
+    return per_file, corpus
+
+def main():
+    import yaml
+    parser = argparse.ArgumentParser(description="Per-opcode code block and branch coverage of one or more .asm files.")
+    parser.add_argument("files", nargs="+", help=".asm files")
+    parser.add_argument("-c", "--config", default="config.yaml", help="path to config.yaml")
+    parser.add_argument("-o", "--output", help="write per-file and corpus stats as JSON")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="two passes over a memory-mapped file, for dumps larger than the available memory")
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
+
+    def progress(done, total):
+        print(f"\r{done / max(total, 1):6.1%}", end='', file=sys.stderr)
+
+    per_file, corpus = corpus_coverage(args.files, set(config.get("branch_ops", [])), True,
+                                       config.get("select_sections", []), progress, args.low_memory,
+                                       MnemonicNormalizer.from_config(config))
+    print(file=sys.stderr)
+    report = {
+        "files": {path: stats.to_dict() for path, stats in per_file.items()},
+        "corpus": corpus.to_dict(),
+        "corpus_coverage": corpus.coverage_meta(),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report["corpus_coverage"], sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import io
+import os
+import re
+import sys
+import mmap
+import pickle
+import hashlib
+import argparse
+import tempfile
+from array import array
+from pathlib import Path
+from collections import namedtuple
+from ARM_InstructionLayout import F_BRANCH, F_UNDEFINED
+from MnemonicNormalizer import KIND_JUMP, KIND_CALL
+from ParallelParser import find_label_lines, scan_headers
+from ParseCache import ParseCache, CachedFileInfo, cache_asm_metadata
+from FeatureHasher import FeatureHasher
+from classify_asm_by_feature import load_config, build_controller
+
+DEFAULT_DELTA_DIR = "./output/delta_cache/"
+BLOCK_TABLE_FORMAT = "block-table-2"
+
+# Instruction line of a block: the address, "opcode bytes<TAB>mnemonic", the mnemonic and
+# the operands. Comments are left out and the addresses are taken relative to the block,
+# so a block that only moved keeps its fingerprint.
+_INSTRUCTION_RE = re.compile(rb'^[ \t]*([0-9A-Fa-f]+):\t([^\t\n]*\t([^\t\n ]*)[^\t\r\n]*)(?:\t([^\t\r\n]*))?', re.M)
+
+# One code block of iter_blocks(); file_pos is the position of its file header
+Block = namedtuple('Block', 'file_pos file_header section section_addr start end cb_address label')
+
+class BlockMismatch(Exception):
+    """
+    The parser found a code block the label scan did not; the file is parsed in full instead.
+    """
+
+class BranchMnemonics(dict):
+    """
+    mnemonic (bytes) -> whether the parser reads a branch target from its lines, for the
+    files of one file type: branch_ops, or the jumps and calls of the normalizer.
+    Mnemonics are classified on first use.
+    """
+    def __init__(self, controller, file_type):
+        super().__init__()
+        self.controller = controller
+        self.file_type = file_type
+
+    def __missing__(self, mnemonic):
+        name = mnemonic.decode('utf-8', 'replace')
+        normalizer = self.controller.normalizer
+        if normalizer:
+            kind = normalizer.table_for(self.file_type).lookup(name)[1]
+            is_branch = kind == KIND_JUMP or kind == KIND_CALL
+        else:
+            is_branch = name in self.controller.branch_ops
+        self[mnemonic] = is_branch
+        return is_branch
+
+def branch_target(controller, address, text, mnemonic, operands):
+    """
+    The target the parser reads from a branch line, 0 when it has none (blx r3).
+    """
+    if controller.normalizer:
+        op_branch = controller.parse_branch_target(0, '', mnemonic.decode('utf-8', 'replace'),
+                                                   operands.decode('utf-8', 'replace'))
+    else:
+        op_branch = controller.parse_branch_instruction((b"%s:\t%s\t%s" % (address, text, operands)).decode('utf-8', 'replace'))
+    return op_branch["target_addr"] if op_branch else 0
+
+def block_fingerprint(label, cb_address, data, controller, branch_mnemonics):
+    """
+    Position-independent fingerprint of one code block: its label and, per instruction,
+    the offset from the block start, the opcode bytes, the mnemonic and, for branches
+    (branch_mnemonics), the target relative to the block. Branches without a target
+    are left out: their stored offset is rebased on the block address when reused.
+    """
+    rows = _INSTRUCTION_RE.findall(data)
+    offsets = array('q', [int(row[0], 16) - cb_address for row in rows])
+    targets = []
+    for address, text, mnemonic, operands in rows:
+        if branch_mnemonics[mnemonic] and operands:
+            target = branch_target(controller, address, text, mnemonic, operands)
+            if target:
+                targets.append((int(address, 16) - cb_address, target - cb_address))
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(b"%s\0%d\0%r\0" % (label, len(rows), targets))
+    digest.update(offsets.tobytes())
+    digest.update(b'\n'.join([row[1] for row in rows]))
+    return digest.digest()
+
+def iter_blocks(mm, headers, selected_sections=None):
+    """
+    Yield a Block for every code block of a selected section, in file order. start:end is the byte range
+    from the label line up to the next label or header line. section_addr follows the
+    serial parser: the address of the first label, for that label's section only.
+    headers is the result of scan_headers(mm).
+    """
+    labels = find_label_lines(mm)
+    boundaries = sorted([pos for pos, _, _ in headers] + [pos for pos, _ in labels]) + [len(mm)]
+    next_boundary = {pos: boundaries[index + 1] for index, pos in enumerate(boundaries[:-1])}
+
+    header_index, file_pos, file_header, section = 0, None, None, None
+    first_label = None  # (section key, address)
+    for start, label_line in labels:
+        while header_index < len(headers) and headers[header_index][0] < start:
+            pos, kind, value = headers[header_index]
+            if kind == 'file':
+                file_pos, file_header = pos, value
+            elif not selected_sections or value in selected_sections:
+                section = (pos, value)
+            else:
+                section = None
+            header_index += 1
+        if section is None or file_header is None:
+            continue
+        address, label = label_line.split(None, 1)
+        cb_address = int(address, 16)
+        if first_label is None:
+            first_label = (section, cb_address)
+        section_addr = first_label[1] if first_label[0] == section else 0
+        yield Block(file_pos, file_header, section[1], section_addr, start, next_boundary[start], cb_address, label)
+
+class BlockTable:
+    """
+    Per-block contributions of the previous extraction of an image, keyed by fingerprint.
+    A contribution is (opcodes, row counts, op offsets, branch target offsets, absolute
+    rows): the rows of the block grouped by opcode in order of first use, as flat arrays.
+    The code block offset is added when the features are assembled, since it moves; so
+    is the block address to the targets of the absolute rows, the branches without a
+    target (stored as address 0), whose offset depends on where the block is.
+    """
+    def __init__(self, path, settings_key):
+        self.path = path
+        self.settings_key = settings_key
+        self.blocks = {}
+
+    @classmethod
+    def load(cls, path, settings_key):
+        table = cls(path, settings_key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, blocks = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return table
+        if stored_key == settings_key:
+            table.blocks = blocks
+        return table
+
+    def save(self, blocks):
+        """
+        Replace the stored table with blocks (only those of the latest image are kept).
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((self.settings_key, blocks), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.blocks = blocks
+
+class DeltaExtractor:
+    """
+    Re-extract the features of a new revision of an image by parsing only the code
+    blocks whose fingerprint is not in the block table of the previous revision.
+    Unchanged blocks reuse their stored contribution; the per-opcode columns are then
+    rebuilt in file order, so the result equals a full parse of the file.
+    """
+    def __init__(self, controller, table_path, hasher=None):
+        if not controller.columnar:
+            raise ValueError("delta extraction needs a columnar AssemblyController")
+        self.controller = controller
+        self.hasher = hasher or FeatureHasher()
+        self.table = BlockTable.load(table_path, ParseCache.key(BLOCK_TABLE_FORMAT, controller))
+        self.blocks_total = 0
+        self.blocks_parsed = 0
+        self.branch_mnemonics = {}  # file type -> BranchMnemonics
+
+    def _parse_run(self, mm, run):
+        """
+        Parse consecutive changed blocks of one section in a single call and split the
+        rows into one contribution per block.
+        """
+        file_header, section_name = run[0].file_header, run[0].section
+        context = {"file": file_header, "in_section": True, "section": section_name,
+                   "section_addr": 0, "first_cb_seen": True}
+        data = mm[run[0].start:run[-1].end]
+        asm_meta = self.controller.parseAsmLines(io.TextIOWrapper(io.BytesIO(data)), context)
+        file_info = asm_meta[file_header[0]]
+        cols = file_info.sections[section_name].columns
+        owner = {block.cb_address: index for index, block in enumerate(run)}
+        cb_owner = []
+        for cb_address in cols.cb_address:
+            if cb_address not in owner:
+                raise BlockMismatch(cb_address)
+            cb_owner.append(owner[cb_address])
+
+        rows = [{} for _ in run]  # per block: opcode -> [(op offset, branch target offset or None)]
+        mnemonics = file_info.mnemonics
+        for row in range(len(cols)):
+            flags = cols.flags[row]
+            if flags & F_UNDEFINED:
+                continue
+            cb_index = cols.cb_index[row]
+            cb_address = cols.cb_address[cb_index]
+            if flags & F_BRANCH:
+                b_target_addr = cols.b_target_addr[row]
+                b_target_offset = b_target_addr - cb_address if b_target_addr else None
+            else:
+                b_target_offset = 0
+            rows[cb_owner[cb_index]].setdefault(mnemonics[cols.op_mnemonic[row]], []).append(
+                (cols.op_address[row] - cb_address, b_target_offset))
+
+        contributions = []
+        for block_rows in rows:
+            op_offsets, b_target_offsets, absolute_rows = array('q'), array('q'), array('I')
+            for offsets in block_rows.values():
+                for op_offset, b_target_offset in offsets:
+                    if b_target_offset is None:
+                        absolute_rows.append(len(op_offsets))
+                        b_target_offset = 0
+                    op_offsets.append(op_offset)
+                    b_target_offsets.append(b_target_offset)
+            counts = array('I', map(len, block_rows.values()))
+            contributions.append((tuple(block_rows), counts, op_offsets, b_target_offsets, absolute_rows))
+        return contributions
+
+    def extract(self, file_path):
+        """
+        Return {file name: CachedFileInfo} for the file and update the block table.
+        """
+        try:
+            return self._extract(file_path)
+        except (BlockMismatch, KeyError):
+            # Label lines the scan and the parser disagree on: fall back to a full parse
+            return cache_asm_metadata(self.controller.parseAsmFile(file_path), self.hasher)
+
+    def _extract(self, file_path):
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            headers = scan_headers(mm)
+            # A repeated file header starts that file over, as in the serial parser
+            file_positions = {value[0]: pos for pos, kind, value in headers if kind == 'file'}
+            blocks = [block for block in iter_blocks(mm, headers, self.controller.selected_sections)
+                      if file_positions[block.file_header[0]] == block.file_pos]
+            for file_type in {block.file_header[1] for block in blocks} - set(self.branch_mnemonics):
+                self.branch_mnemonics[file_type] = BranchMnemonics(self.controller, file_type)
+            fingerprints = [block_fingerprint(block.label, block.cb_address, mm[block.start:block.end],
+                                              self.controller, self.branch_mnemonics[block.file_header[1]])
+                            for block in blocks]
+
+            known, table = self.table.blocks, {}
+            run, run_fingerprints, parsed = [], [], 0
+            for block, fingerprint in zip(blocks, fingerprints):
+                if fingerprint in known:
+                    table[fingerprint] = known[fingerprint]
+                    continue
+                if run and (run[-1].end != block.start or run[-1].section != block.section):
+                    table.update(zip(run_fingerprints, self._parse_run(mm, run)))
+                    run, run_fingerprints = [], []
+                run.append(block)
+                run_fingerprints.append(fingerprint)
+                parsed += 1
+            if run:
+                table.update(zip(run_fingerprints, self._parse_run(mm, run)))
+        self.blocks_total += len(blocks)
+        self.blocks_parsed += parsed
+
+        columns = {file_name: {} for file_name in file_positions}
+        for block, fingerprint in zip(blocks, fingerprints):
+            file_columns = columns[block.file_header[0]]
+            cb_offset = array('q', [block.cb_address - block.section_addr])
+            keywords, counts, op_offsets, b_target_offsets, absolute_rows = table[fingerprint]
+            if absolute_rows:
+                b_target_offsets = array('q', b_target_offsets)
+                for row in absolute_rows:
+                    b_target_offsets[row] -= block.cb_address
+            start = 0
+            for keyword, count in zip(keywords, counts):
+                keyword_columns = file_columns.get(keyword)
+                if keyword_columns is None:
+                    keyword_columns = file_columns[keyword] = (array('q'), array('q'), array('q'))
+                keyword_columns[0].extend(cb_offset * count)
+                keyword_columns[1].extend(op_offsets[start:start + count])
+                keyword_columns[2].extend(b_target_offsets[start:start + count])
+                start += count
+        if parsed or len(table) != len(known):
+            self.table.save(table)
+
+        asm_metadata = {}
+        for file_name, file_columns in columns.items():
+            hashes = {keyword: self.hasher.hash_columns(*keyword_columns) for keyword, keyword_columns in file_columns.items()}
+            asm_metadata[file_name] = CachedFileInfo(file_name, file_columns, hashes, self.hasher.version)
+        return asm_metadata
+
+def check_delta(controller, old_path, new_path, hasher=None):
+    """
+    Extract old_path into a scratch block table, re-extract new_path against it and
+    compare the feature hashes with a full parse of new_path.
+    Returns (mismatches as [(file name, opcode)], blocks parsed, blocks total).
+    """
+    hasher = hasher or FeatureHasher()
+    with tempfile.TemporaryDirectory(prefix="delta_check_") as table_dir:
+        table_path = os.path.join(table_dir, "check.blocks")
+        DeltaExtractor(controller, table_path, hasher).extract(old_path)
+        extractor = DeltaExtractor(controller, table_path, hasher)
+        delta = extractor.extract(new_path)
+    full = cache_asm_metadata(controller.parseAsmFile(new_path), hasher)
+    mismatches = []
+    for file_name in sorted(set(full) | set(delta)):
+        full_hashes = full[file_name].op_asm_hashes if file_name in full else {}
+        delta_hashes = delta[file_name].op_asm_hashes if file_name in delta else {}
+        mismatches.extend((file_name, opcode) for opcode in sorted(set(full_hashes) | set(delta_hashes))
+                          if full_hashes.get(opcode) != delta_hashes.get(opcode))
+    return mismatches, extractor.blocks_parsed, extractor.blocks_total
+
+def main():
+    root = Path(__file__).resolve().parent
+    parser = argparse.ArgumentParser(description="Check that delta re-extraction of a revision gives the features of a full parse.")
+    parser.add_argument("old_asm", help="previous revision, extracted into a scratch block table")
+    parser.add_argument("new_asm", help="revision re-extracted against that table")
+    parser.add_argument("--config", default=str(root / "config.yaml"))
+    args = parser.parse_args()
+
+    config = load_config(Path(args.config))
+    mismatches, parsed, total = check_delta(build_controller(config), args.old_asm, args.new_asm,
+                                            FeatureHasher.from_config(config))
+    print(f"Parsed {parsed} of {total} code blocks of {args.new_asm}")
+    for file_name, opcode in mismatches:
+        print(f"  {file_name}: {opcode} differs from a full parse")
+    if mismatches:
+        sys.exit(1)
+    print("The delta features match a full parse")
+
+if __name__ == "__main__":
+    main()
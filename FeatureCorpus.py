@@ -0,0 +1,237 @@
+import sys
+import csv
+import argparse
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from FeatureIndex import FeatureMatcher, feature_csv_files, read_feature_csv
+
+def intersect_count(a, b):
+    """
+    Number of ids shared by two ascending id arrays. Walks both arrays in step, or
+    binary-searches the longer one when the other is much shorter.
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    n, m = len(a), len(b)
+    if not n:
+        return 0
+    count = 0
+    if n * m.bit_length() < n + m:
+        lo = 0
+        for value in a:
+            lo = bisect_left(b, value, lo)
+            if lo == m:
+                break
+            if b[lo] == value:
+                count += 1
+                lo += 1
+        return count
+    i = j = 0
+    x, y = a[0], b[0]
+    while True:
+        if x < y:
+            i += 1
+            if i == n:
+                return count
+            x = a[i]
+        elif x > y:
+            j += 1
+            if j == m:
+                return count
+            y = b[j]
+        else:
+            count += 1
+            i += 1
+            j += 1
+            if i == n or j == m:
+                return count
+            x, y = a[i], b[j]
+
+class FeatureCorpus(FeatureMatcher):
+    """
+    Compact in-memory reference corpus. Every distinct (opcode, hash) pair is interned
+    once, with its digest as 32 raw bytes, and gets an integer feature id; a project is
+    an ascending array('I') of its feature ids. Related firmware variants share most
+    of their rows, so the corpus holds one copy of each instead of one per project.
+    document_frequency[feature id] counts the projects containing a feature.
+    Queries are ranked through posting lists derived from the id arrays on first use
+    (one flat array, offset by document frequency); two id arrays are compared by
+    merge intersection (shared_features, overlap).
+    """
+    def __init__(self):
+        self.projects = []            # project id -> project name
+        self.project_totals = []      # project id -> number of features
+        self.project_features = []    # project id -> array('I') of feature ids, ascending
+        self.project_hash_versions = []  # project id -> FeatureHasher version of the project's CSV
+        self.project_ids = {}         # project name -> project id
+        self.feature_ids = {}         # (opcode, digest bytes) -> feature id
+        self.feature_keys = []        # feature id -> (opcode, digest bytes)
+        self.document_frequency = array('I')
+        self._opcodes = {}            # interned opcode strings
+        self._posting_offsets = None  # feature id -> start of its projects in _posting_values
+        self._posting_values = None
+
+    def __len__(self):
+        return len(self.projects)
+
+    @classmethod
+    def from_csv_dir(cls, feature_dir):
+        """
+        Build the corpus from the <project>.csv files of extractor.py, one file at a time.
+        """
+        corpus = cls()
+        for csv_file in feature_csv_files(feature_dir):
+            corpus.add_project(csv_file.stem, read_feature_csv(csv_file))
+        return corpus
+
+    @staticmethod
+    def _digest(opcode, hashval):
+        try:
+            return bytes.fromhex(hashval)
+        except ValueError:
+            raise ValueError(f"Invalid digest for opcode {opcode}: {hashval}")
+
+    def intern(self, opcode, hashval):
+        """
+        Return the feature id of an (opcode, hex hash) pair, adding it if it is new.
+        """
+        opcode = self._opcodes.setdefault(opcode, opcode)
+        key = (opcode, self._digest(opcode, hashval))
+        feature_id = self.feature_ids.get(key)
+        if feature_id is None:
+            feature_id = self.feature_ids[key] = len(self.feature_keys)
+            self.feature_keys.append(key)
+            self.document_frequency.append(0)
+        return feature_id
+
+    def add_project(self, project, features):
+        """
+        Add a project given its {opcode: hash} features.
+        """
+        if project in self.project_ids:
+            raise ValueError(f"project {project} is already in the corpus")
+        ids = array('I', sorted({self.intern(opcode, hashval) for opcode, hashval in features.items()}))
+        for feature_id in ids:
+            self.document_frequency[feature_id] += 1
+        project_id = len(self.projects)
+        self.projects.append(project)
+        self.project_totals.append(len(features))
+        self.project_features.append(ids)
+        self.project_hash_versions.append(getattr(features, "hash_version", None))
+        self.project_ids[project] = project_id
+        self._posting_offsets = self._posting_values = None
+        self._project_weights = None
+        return project_id
+
+    def feature_id(self, opcode, hashval):
+        """
+        Return the feature id of an (opcode, hex hash) pair, or None if no project has it.
+        """
+        try:
+            return self.feature_ids.get((opcode, bytes.fromhex(hashval)))
+        except ValueError:
+            return None
+
+    def encode(self, query_features):
+        """
+        Return the ascending ids of the {opcode: hash} features known to the corpus.
+        """
+        ids = {self.feature_id(opcode, hashval) for opcode, hashval in query_features.items()}
+        ids.discard(None)
+        return array('I', sorted(ids))
+
+    def feature(self, feature_id):
+        """
+        Return (opcode, hex digest) of a feature id.
+        """
+        opcode, digest = self.feature_keys[feature_id]
+        return opcode, digest.hex()
+
+    def shared_features(self, project_a, project_b):
+        """
+        Number of features two reference projects have in common.
+        """
+        return intersect_count(self.project_features[self.project_ids[project_a]],
+                               self.project_features[self.project_ids[project_b]])
+
+    def overlap(self, query_features, project):
+        """
+        Number of features a query shares with one reference project.
+        """
+        return intersect_count(self.encode(query_features), self.project_features[self.project_ids[project]])
+
+    def _build_postings(self):
+        offsets = array('I', [0])
+        total = 0
+        for document_frequency in self.document_frequency:
+            total += document_frequency
+            offsets.append(total)
+        values = array('I', bytes(4 * total))
+        fill = array('I', offsets[:-1])
+        # Projects are visited in id order, so every posting comes out ascending
+        for project_id, ids in enumerate(self.project_features):
+            for feature_id in ids:
+                values[fill[feature_id]] = project_id
+                fill[feature_id] += 1
+        self._posting_offsets, self._posting_values = offsets, values
+
+    def posting(self, feature_id):
+        if self._posting_offsets is None:
+            self._build_postings()
+        return self._posting_values[self._posting_offsets[feature_id]:self._posting_offsets[feature_id + 1]]
+
+    def lookup(self, key):
+        feature_id = self.feature_id(*key)
+        return None if feature_id is None else self.posting(feature_id)
+
+    def iter_postings(self):
+        return (self.posting(feature_id) for feature_id in range(len(self.feature_keys)))
+
+    def iter_document_frequencies(self):
+        """
+        Yield (opcode, hex digest, document frequency) for every feature, most shared first.
+        """
+        document_frequency = self.document_frequency
+        for feature_id in sorted(range(len(document_frequency)), key=lambda i: (-document_frequency[i], i)):
+            opcode, digest = self.feature_keys[feature_id]
+            yield opcode, digest.hex(), document_frequency[feature_id]
+
+    def stats(self):
+        rows = sum(self.project_totals)
+        unique = len(self.feature_keys)
+        return {
+            "projects": len(self.projects),
+            "rows": rows,
+            "unique_features": unique,
+            "opcodes": len(self._opcodes),
+            "rows_per_feature": rows / unique if unique else 0.0,
+            "shared_features": sum(1 for df in self.document_frequency if df > 1),
+        }
+
+def write_document_frequency_csv(corpus, csv_file):
+    with open(csv_file, mode='w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Opcode', 'SHA-256 Hash', 'Projects'])  # Header row
+        writer.writerows(corpus.iter_document_frequencies())
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplicate a directory of feature CSVs and report feature document frequencies.")
+    parser.add_argument("feature_dir")
+    parser.add_argument("--top", type=int, default=10, help="print the N features shared by most projects")
+    parser.add_argument("--df-csv", help="write opcode, hash and project count of every feature to this CSV")
+    args = parser.parse_args()
+
+    corpus = FeatureCorpus.from_csv_dir(args.feature_dir)
+    stats = corpus.stats()
+    print(f"{stats['projects']} projects, {stats['rows']} feature rows, {stats['unique_features']} unique features "
+          f"({stats['rows_per_feature']:.1f} rows per feature), {stats['shared_features']} in more than one project")
+    for opcode, digest, document_frequency in islice(corpus.iter_document_frequencies(), max(args.top, 0)):
+        print(f"{document_frequency:8d}  {opcode:12s} {digest}")
+    if args.df_csv:
+        write_document_frequency_csv(corpus, args.df_csv)
+    if not stats["projects"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# Steps shared by the two extraction pipelines of extractor.py: the pool mode
+# (extractor.run_batch) and the staged pipeline (IngestPipeline). Planning the jobs,
+# parsing an image through the parse cache or the delta block table, hashing it and
+# writing its outputs.
+import re
+import os
+import time
+import csv
+from AssemblyController import AssemblyController
+from MnemonicNormalizer import MnemonicNormalizer
+from FuzzyFeatures import DEFAULT_SKETCH_SIZE, sketch_asm_metadata, write_sketch_csv
+from ParseCache import ParseCache, file_digest
+from SevenZipReader import list_asm_members
+from ParallelParser import parse_file_sharded
+from DeltaExtractor import DeltaExtractor, DEFAULT_DELTA_DIR
+from Metrics import metrics
+from FeatureHasher import FeatureHasher, HASH_JSON_V1, hash_header
+from AsmReport import AsmReport, full_report_enabled, report_file_for
+from FunctionIndex import DEFAULT_MIN_INSTRUCTIONS, function_enabled, function_file_for, write_function_csv
+
+OUTPUT_FEATURE_DIR = "./output/features/"
+
+# Job kinds of plan_jobs
+JOB_ASM = 'asm'
+JOB_ARCHIVE = '7z'
+
+DEFAULT_BRANCH_OPS = [
+    'b', 'bl', 'blcc', 'blcs', 'ble.n', 'ble.w',
+    'bleq', 'blge', 'blls', 'bllt', 'blmi', 'blne',
+    'bls.n', 'bls.w', 'blt.n', 'blt.w', 'blvs', 'blx'
+]
+
+class LineCounter:
+    """
+    Wrap a line iterator and count the lines and characters passed to the parser.
+    """
+    def __init__(self, lines):
+        self.lines = lines
+        self.line_count = 0
+        self.char_count = 0
+
+    def __iter__(self):
+        for line in self.lines:
+            self.line_count += 1
+            self.char_count += len(line)
+            yield line
+
+def member_stem(member):
+    """
+    The path of a 7z member without its extension, as one file name component (a/b.asm -> a_b).
+    """
+    return re.sub(r'[^\w.-]+', '_', os.path.splitext(member)[0]).strip('._')
+
+def feature_file_for(input_path, output_dir=OUTPUT_FEATURE_DIR, feature_mode='exact', member=None):
+    """
+    <name>_feature.csv for an .asm file, <archive name>__<member path>_feature.csv for
+    a member of a 7z archive, since members of different archives or folders can share
+    a file name. The report, function CSV and delta block table are named after it.
+    """
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    if member is not None:
+        stem = f"{stem}__{member_stem(member)}"
+    suffix = "minhash" if feature_mode == 'minhash' else "feature"
+    return os.path.join(output_dir, f"{stem}_{suffix}.csv")
+
+def is_up_to_date(input_path, feature_file, config_path, *extra_files):
+    """
+    True if the feature CSV and the extra outputs (report, function CSV; None when not
+    written) are newer than both the input image and the configuration.
+    """
+    for output_file in (feature_file,) + extra_files:
+        if output_file is None:
+            continue
+        if not os.path.exists(output_file):
+            return False
+        output_mtime = os.path.getmtime(output_file)
+        if output_mtime < os.path.getmtime(input_path) or output_mtime < os.path.getmtime(config_path):
+            return False
+    return True
+
+def write_feature_hashes(opcode_hashes, feature_file, hash_version=HASH_JSON_V1):
+    """
+    Write (opcode, hash) rows as the feature CSV atomically.
+    """
+    tmp_file = feature_file + ".tmp"
+    with open(tmp_file, mode='w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        # Header row; hashes other than the original JSON encoding are labelled with their version
+        writer.writerow(['Opcode', hash_header(hash_version)])
+        writer.writerows(opcode_hashes)
+    os.replace(tmp_file, feature_file)
+
+def iter_feature_hashes(asm_metadata, hasher=None):
+    hasher = hasher or FeatureHasher()
+    for filename, file_info in asm_metadata.items():
+        # Parse cache entries keep the hashes computed when they were stored
+        yield from hasher.iter_hashes(file_info)
+
+def write_feature_csv(asm_metadata, feature_file, hasher=None):
+    """
+    Hash every opcode offset list and write the feature CSV atomically.
+    """
+    hasher = hasher or FeatureHasher()
+    write_feature_hashes(iter_feature_hashes(asm_metadata, hasher), feature_file, hasher.version)
+
+def needs_instruction_rows(config):
+    return full_report_enabled(config) or function_enabled(config)
+
+def row_output_files(feature_file, config):
+    """
+    The report and function CSV paths of an image (None for outputs that are disabled).
+    """
+    return report_file_for(feature_file, config), function_file_for(feature_file, config)
+
+def build_reader(config):
+    # The feature hashes need only the per-opcode offset columns, so use the array-backed storage and
+    # skip the object graph; instruction rows are kept for a full report, function fingerprints
+    # and delta extraction.
+    instruction_rows = needs_instruction_rows(config) or config.get("delta_extraction", 'disable') == 'enable'
+    return AssemblyController(
+        set(config.get("branch_ops", DEFAULT_BRANCH_OPS)), True, config.get("select_sections", []), columnar=True,
+        instruction_rows=instruction_rows, normalizer=MnemonicNormalizer.from_config(config)
+    )
+
+def write_report(asm_metadata, report_file, controller, config, job_metrics=metrics):
+    with job_metrics.stage("report"):
+        AsmReport.from_config(controller, config).write(asm_metadata, report_file)
+
+def write_functions(asm_metadata, function_file, config, job_metrics=metrics):
+    with job_metrics.stage("functions"):
+        write_function_csv(asm_metadata, function_file, config.get("function_min_instructions", DEFAULT_MIN_INSTRUCTIONS))
+
+def write_row_outputs(asm_metadata, feature_file, controller, config, job_metrics=metrics):
+    """
+    Write the outputs built from the instruction rows: the full report and the function CSV.
+    """
+    report_file, function_file = row_output_files(feature_file, config)
+    if report_file:
+        write_report(asm_metadata, report_file, controller, config, job_metrics)
+    if function_file:
+        write_functions(asm_metadata, function_file, config, job_metrics)
+
+def compute_features(asm_metadata, config, job_metrics=metrics):
+    """
+    Return the MinHash sketches or the (opcode, hash) rows of a parse result.
+    """
+    if config.get("feature_mode", 'exact') == 'minhash':
+        with job_metrics.stage("sketch"):
+            return sketch_asm_metadata(asm_metadata, config.get("minhash_size", DEFAULT_SKETCH_SIZE))
+    with job_metrics.stage("hash"):
+        return list(iter_feature_hashes(asm_metadata, FeatureHasher.from_config(config)))
+
+def save_features(features, feature_file, config, job_metrics=metrics):
+    """
+    Write the result of compute_features as the feature CSV.
+    """
+    with job_metrics.stage("write"):
+        if config.get("feature_mode", 'exact') == 'minhash':
+            write_sketch_csv(features, feature_file)
+        else:
+            write_feature_hashes(features, feature_file, FeatureHasher.from_config(config).version)
+
+def write_features(asm_metadata, feature_file, config, job_metrics=metrics):
+    save_features(compute_features(asm_metadata, config, job_metrics), feature_file, config, job_metrics)
+
+def feature_stats(input_name, feature_file, lines, start, delta=None, job_metrics=None):
+    if job_metrics is not None and job_metrics.enabled:
+        if lines:
+            job_metrics.count("lines", lines.line_count)
+            job_metrics.count("bytes", lines.char_count)
+        job_metrics.count("cache_hits" if lines is None and delta is None else "images_parsed")
+    return {
+        "input": input_name,
+        "output": feature_file,
+        "lines": lines.line_count if lines else 0,
+        "bytes": lines.char_count if lines else 0,
+        "cached": lines is None and delta is None,
+        "delta": delta,
+        "seconds": time.perf_counter() - start,
+        # Worker metrics travel with the stats and are merged in the main process
+        "metrics": job_metrics.snapshot() if job_metrics is not None and job_metrics.enabled else None,
+    }
+
+def delta_table_for(feature_file, config):
+    """
+    Return the block table path of an image if delta_extraction is enabled, else None.
+    """
+    if config.get("delta_extraction", 'disable') != 'enable':
+        return None
+    return os.path.join(config.get("delta_cache_dir", DEFAULT_DELTA_DIR), os.path.basename(feature_file) + ".blocks")
+
+def load_asm_metadata(input_path, feature_file, config, asmReader, job_metrics, input_digest=None,
+                      shard_executor=None, shard_workers=None, delta_extraction=True):
+    """
+    Parse one .asm file through the parse cache or the delta block table, as configured.
+    input_digest overrides the cache key digest (archive members spooled to a file).
+    Returns (asm_metadata, LineCounter or None when nothing was read, delta or None).
+    """
+    lines, delta = None, None
+    # A full report and function fingerprints need the instruction rows, which neither
+    # the parse cache nor the block table keep, so the image is parsed in full
+    full_parse = needs_instruction_rows(config)
+    delta_table = delta_table_for(feature_file, config) if not full_parse and delta_extraction else None
+
+    def parse():
+        nonlocal lines, delta
+        with job_metrics.stage("parse"):
+            if delta_table:
+                # Only the code blocks changed since the previous revision of the image are parsed
+                extractor = DeltaExtractor(asmReader, delta_table, FeatureHasher.from_config(config))
+                asm_metadata = extractor.extract(input_path)
+                delta = (extractor.blocks_parsed, extractor.blocks_total)
+                job_metrics.count("delta_blocks_parsed", extractor.blocks_parsed)
+                job_metrics.count("delta_blocks_total", extractor.blocks_total)
+                return asm_metadata
+            if shard_executor is not None:
+                asm_metadata, line_count = parse_file_sharded(asmReader, input_path, shard_workers, shard_executor)
+                lines = LineCounter(())
+                lines.line_count, lines.char_count = line_count, os.path.getsize(input_path)
+            else:
+                with open(input_path, 'r') as asm_stream:
+                    lines = LineCounter(asm_stream)
+                    asm_metadata = asmReader.parseAsmLines(lines)
+        job_metrics.record_asm_metadata(asm_metadata)
+        return asm_metadata
+
+    parse_cache = ParseCache.from_config(config) if not full_parse else None
+    if parse_cache:
+        # An unchanged image with unchanged parser settings is not parsed again
+        if input_digest is None:
+            with job_metrics.stage("digest"):
+                input_digest = file_digest(input_path)
+        asm_metadata = parse_cache.load_or_parse(input_digest, asmReader, parse, FeatureHasher.from_config(config))
+    else:
+        asm_metadata = parse()
+    return asm_metadata, lines, delta
+
+def print_throughput(stats):
+    if stats["cached"]:
+        print(f"Saved {stats['output']} from the parse cache in {stats['seconds']:.2f}s")
+        return
+    if stats["delta"]:
+        parsed, total = stats["delta"]
+        print(f"Saved {stats['output']}: parsed {parsed} of {total} code blocks in {stats['seconds']:.2f}s")
+        return
+    seconds = max(stats["seconds"], 1e-9)
+    mb = stats["bytes"] / (1024 * 1024)
+    print(f"Saved {stats['output']}: {stats['lines']} lines, {mb:.1f} MB in {seconds:.2f}s "
+          f"({stats['lines'] / seconds:,.0f} lines/s, {mb / seconds:.2f} MB/s)")
+
+def plan_jobs(inputs, config, config_path, output_dir=OUTPUT_FEATURE_DIR, force=False):
+    """
+    Return the (kind, input path, outputs) jobs of the inputs whose outputs are not up to date:
+    (JOB_ASM, .asm path, feature file) or (JOB_ARCHIVE, .7z path, [(member, feature file)]).
+    Raises ValueError when two inputs map to the same feature file.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    feature_mode = config.get("feature_mode", 'exact')
+    sources = {}  # feature file -> the input writing it
+
+    def claim(feature_file, input_name):
+        if feature_file in sources:
+            raise ValueError(f"{sources[feature_file]} and {input_name} would both be written to {feature_file}")
+        sources[feature_file] = input_name
+
+    pending = []
+    for input_path in inputs:
+        if not input_path.endswith('.7z'):
+            feature_file = feature_file_for(input_path, output_dir, feature_mode)
+            claim(feature_file, input_path)
+            if not force and is_up_to_date(input_path, feature_file, config_path, *row_output_files(feature_file, config)):
+                print(f"Skipping {input_path}: {feature_file} is up to date")
+                continue
+            pending.append((JOB_ASM, input_path, feature_file))
+            continue
+        # Every .asm member of an archive gets its own feature file; one job per archive
+        # so the archive is decompressed once.
+        member_outputs = []
+        for member in list_asm_members(input_path):
+            feature_file = feature_file_for(input_path, output_dir, feature_mode, member)
+            claim(feature_file, f"{input_path}:{member}")
+            if not force and is_up_to_date(input_path, feature_file, config_path, *row_output_files(feature_file, config)):
+                print(f"Skipping {input_path}:{member}: {feature_file} is up to date")
+                continue
+            member_outputs.append((member, feature_file))
+        if member_outputs:
+            pending.append((JOB_ARCHIVE, input_path, member_outputs))
+    return pending
@@ -0,0 +1,117 @@
+import sys
+import hashlib
+from array import array
+from itertools import islice
+
+# json-v1: SHA-256 of json.dumps(offset list, separators=(',', ':'), sort_keys=True),
+#          the encoding of every feature CSV written so far.
+# packed-v2: SHA-256 of a version tag, the row count and the cb_offset, op_offset and
+#          b_target_offset columns as little-endian int64, one column after the other.
+HASH_JSON_V1 = 'json-v1'
+HASH_PACKED_V2 = 'packed-v2'
+FEATURE_HASH_VERSIONS = (HASH_JSON_V1, HASH_PACKED_V2)
+DEFAULT_FEATURE_HASH = HASH_JSON_V1
+HASH_HEADER = 'SHA-256 Hash'
+
+_PACKED_V2_TAG = b'AssemblyExtractor/offsets/packed-v2\0'
+JSON_CHUNK_ROWS = 1 << 14
+_format_row = '[%d,%d,%d]'.__mod__
+
+def hash_header(version):
+    """
+    Hash column header of a feature CSV; versions other than json-v1 are named in it.
+    """
+    return HASH_HEADER if version == HASH_JSON_V1 else f'{HASH_HEADER} ({version})'
+
+def parse_hash_header(label):
+    """
+    Return the hash version named by the hash column header of a feature CSV.
+    """
+    if label == HASH_HEADER:
+        return HASH_JSON_V1
+    for version in FEATURE_HASH_VERSIONS:
+        if label == hash_header(version):
+            return version
+    raise ValueError(f"unknown feature hash column {label!r}, expected one of "
+                     f"{', '.join(hash_header(version) for version in FEATURE_HASH_VERSIONS)}")
+
+def _int64_column(column):
+    if isinstance(column, array) and column.typecode == 'q':
+        return column
+    return array('q', column)
+
+class FeatureHasher:
+    """
+    Canonical digest of one opcode's (cb_offset, op_offset, b_target_offset) list.
+    Rows are fed to SHA-256 as they are encoded, so no string of the whole list is built.
+    json-v1 reproduces the digests of the existing feature CSVs; packed-v2 hashes the
+    offset columns directly and is much faster, but its digests differ, so references
+    and queries have to be extracted with the same feature_hash setting.
+    """
+    def __init__(self, version=DEFAULT_FEATURE_HASH):
+        if version not in FEATURE_HASH_VERSIONS:
+            raise ValueError(f"unknown feature_hash {version!r}, expected one of {', '.join(FEATURE_HASH_VERSIONS)}")
+        self.version = version
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("feature_hash", DEFAULT_FEATURE_HASH))
+
+    @staticmethod
+    def _hash_json_rows(rows):
+        # Same bytes as json.dumps(list(rows), separators=(',', ':')), a chunk at a time
+        digest = hashlib.sha256(b'[')
+        separator = b''
+        while True:
+            chunk = ','.join(map(_format_row, islice(rows, JSON_CHUNK_ROWS)))
+            if not chunk:
+                break
+            digest.update(separator)
+            digest.update(chunk.encode('ascii'))
+            separator = b','
+        digest.update(b']')
+        return digest.hexdigest()
+
+    def hash_columns(self, cb_offsets, op_offsets, b_target_offsets):
+        if self.version == HASH_JSON_V1:
+            return self._hash_json_rows(zip(cb_offsets, op_offsets, b_target_offsets))
+        digest = hashlib.sha256(_PACKED_V2_TAG)
+        digest.update(len(cb_offsets).to_bytes(8, 'little'))
+        for column in (cb_offsets, op_offsets, b_target_offsets):
+            column = _int64_column(column)
+            if sys.byteorder == 'big':
+                column = array('q', column)
+                column.byteswap()
+            digest.update(column)
+        return digest.hexdigest()
+
+    def hash_offset_list(self, offset_list):
+        """
+        Digest of a list of (cb_offset, op_offset, b_target_offset) tuples.
+        """
+        if self.version == HASH_JSON_V1:
+            return self._hash_json_rows(iter(offset_list))
+        return self.hash_columns(
+            array('q', (offsets[0] for offsets in offset_list)),
+            array('q', (offsets[1] for offsets in offset_list)),
+            array('q', (offsets[2] for offsets in offset_list)),
+        )
+
+    def iter_hashes(self, file_info):
+        """
+        Yield (opcode, digest) for an ArmFileInfo or a parse cache entry. Digests stored
+        in a cache entry are reused when they were made with the same version.
+        """
+        if getattr(file_info, "hash_version", None) == self.version:
+            yield from file_info.iter_op_asm_hashes()
+            return
+        columns = getattr(file_info, "op_asm_offset_columns", None)
+        if columns:
+            for op_asm_keyword, (cb_offsets, op_offsets, b_target_offsets) in columns.items():
+                yield op_asm_keyword, self.hash_columns(cb_offsets, op_offsets, b_target_offsets)
+            return
+        for op_asm_keyword, offset_list in file_info.iter_op_asm_offset_lists():
+            yield op_asm_keyword, self.hash_offset_list(offset_list)
+
+def hash_offset_list(offset_list, version=DEFAULT_FEATURE_HASH):
+    return FeatureHasher(version).hash_offset_list(offset_list)
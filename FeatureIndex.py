@@ -0,0 +1,328 @@
+import os
+import csv
+import math
+import heapq
+import pickle
+from collections import Counter
+from pathlib import Path
+from FuzzyFeatures import SKETCH_SUFFIX
+from FeatureHasher import HASH_JSON_V1, parse_hash_header
+
+INDEX_FILE_NAME = ".feature_index.pkl"
+
+class FeatureSet(dict):
+    """
+    {opcode: hash} features of one project; hash_version is the FeatureHasher version
+    named in the header of its CSV.
+    """
+    def __init__(self, features=(), hash_version=HASH_JSON_V1):
+        super().__init__(features)
+        self.hash_version = hash_version
+
+def read_feature_csv(csv_file):
+    """
+    Read one project feature CSV (opcode, hex SHA-256) into an {opcode: hash} FeatureSet.
+    """
+    features = FeatureSet()
+    with open(csv_file, 'r') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header and len(header) == 2:
+            try:
+                features.hash_version = parse_hash_header(header[1])
+            except ValueError as e:
+                raise ValueError(f"{csv_file}: {e}")
+        for row in reader:
+            if len(row) == 2:
+                opcode, hashval = row
+                features[opcode] = hashval
+    return features
+
+def feature_csv_files(feature_dir):
+    """
+    The exact feature CSVs of feature_dir, sorted; MinHash sketch files written to the
+    same directory (feature_mode: minhash) are left out.
+    """
+    return [csv_file for csv_file in sorted(Path(feature_dir).glob("*.csv")) if not csv_file.stem.endswith(SKETCH_SUFFIX)]
+
+RANK_METRICS = ("containment", "query_containment", "jaccard", "weighted")
+
+class FeatureMatcher:
+    """
+    Similarity scoring shared by the reference feature indexes.
+    The reference set is a sparse project x (opcode, hash) matrix stored by column:
+    subclasses provide lookup() (the projects of one feature), iter_postings(),
+    projects, project_totals and project_hash_versions.
+    """
+    _project_weights = None  # project id -> sum of the IDF weights of its features
+    project_hash_versions = ()  # project id -> FeatureHasher version of its hashes (None once removed)
+
+    def check_hash_version(self, version):
+        """
+        Raise ValueError unless every reference project was hashed with the FeatureHasher
+        version of the queries. Digests of different versions never match, so the
+        queries would silently get no or partial matches.
+        """
+        counts = Counter(other for other in self.project_hash_versions if other is not None and other != version)
+        if counts:
+            found = ', '.join(f"{count} with {other}" for other, count in sorted(counts.items()))
+            raise ValueError(f"the queries are hashed with feature_hash {version}, but reference projects were "
+                             f"hashed otherwise ({found}); extract the references and queries with one feature_hash")
+
+    def lookup(self, key):
+        raise NotImplementedError
+
+    def iter_postings(self):
+        raise NotImplementedError
+
+    def match_counts(self, query_features):
+        """
+        Return {project id: number of (opcode, hash) pairs shared with the query}.
+        """
+        counts = {}
+        for key in query_features.items():
+            for project_id in self.lookup(key) or ():
+                counts[project_id] = counts.get(project_id, 0) + 1
+        return counts
+
+    def similarity(self, query_features):
+        """
+        Return {project: (similarity, matched, total)} for every project sharing a feature
+        with the query; similarity is matched / reference feature count.
+        """
+        result = {}
+        for project_id, matched in self.match_counts(query_features).items():
+            total = self.project_totals[project_id]
+            result[self.projects[project_id]] = (matched / total, matched, total)
+        return result
+
+    def feature_weight(self, document_frequency):
+        """
+        IDF weight of a feature: pairs shared by many projects (typically the mov/ldr
+        rows of related firmware) say little about which project a query belongs to.
+        """
+        return math.log1p(len(self) / document_frequency)
+
+    def project_weights(self):
+        if self._project_weights is None:
+            weights = [0.0] * len(self.project_totals)
+            for posting in self.iter_postings():
+                weight = self.feature_weight(len(posting))
+                for project_id in posting:
+                    weights[project_id] += weight
+            self._project_weights = weights
+        return self._project_weights
+
+    def score_many(self, queries):
+        """
+        Sparse matrix product of the reference matrix with a batch of query vectors.
+        Each distinct (opcode, hash) of the batch is looked up once and its posting is
+        accumulated into every query containing it. Returns one
+        {project id: [matched, weighted matched]} dict per query.
+        """
+        key_queries = {}
+        for query_id, query_features in enumerate(queries):
+            for key in query_features.items():
+                key_queries.setdefault(key, []).append(query_id)
+
+        scores = [{} for _ in queries]
+        for key, query_ids in key_queries.items():
+            posting = self.lookup(key)
+            if not posting:
+                continue
+            weight = self.feature_weight(len(posting))
+            for query_id in query_ids:
+                accumulator = scores[query_id]
+                for project_id in posting:
+                    entry = accumulator.get(project_id)
+                    if entry is None:
+                        accumulator[project_id] = [1, weight]
+                    else:
+                        entry[0] += 1
+                        entry[1] += weight
+        return scores
+
+    def rank_many(self, queries, top_k=5, metric="containment"):
+        """
+        Rank a batch of {opcode: hash} queries in one pass over the shared postings.
+        Every match reports all metrics; metric selects the ordering:
+          containment        matched / reference features (the classic similarity)
+          query_containment  matched / query features
+          jaccard            matched / (query + reference - matched)
+          weighted           IDF-weighted containment of the reference
+        """
+        if metric not in RANK_METRICS:
+            raise ValueError(f"Unknown metric {metric}, expected one of {RANK_METRICS}")
+        project_weights = self.project_weights() if queries else None
+        rankings = []
+        for query_features, accumulator in zip(queries, self.score_many(queries)):
+            query_total = len(query_features)
+            matches = []
+            for project_id, (matched, weighted) in accumulator.items():
+                total = self.project_totals[project_id]
+                matches.append({
+                    "project": self.projects[project_id],
+                    "similarity": matched / total,
+                    "matched": matched,
+                    "total": total,
+                    "query_containment": matched / query_total,
+                    "jaccard": matched / (query_total + total - matched),
+                    "weighted": weighted / project_weights[project_id],
+                })
+            key = "similarity" if metric == "containment" else metric
+            rankings.append(heapq.nlargest(top_k, matches, key=lambda match: (match[key], match["matched"])))
+        return rankings
+
+    def rank(self, query_features, top_k=5, metric="containment"):
+        """
+        Return the top_k matches of one query as dicts, best first.
+        """
+        return self.rank_many([query_features], top_k, metric)[0]
+
+    def classify(self, query_features):
+        """
+        Return the best (project, similarity, matched, total), or None if the index is empty.
+        """
+        best_match = None
+        best_score = -1
+        for project_id, matched in sorted(self.match_counts(query_features).items()):
+            total = self.project_totals[project_id]
+            similarity = matched / total
+            if similarity > best_score:
+                best_match = (self.projects[project_id], similarity, matched, total)
+                best_score = similarity
+        if best_match is None:
+            # No shared feature at all: report the first non-empty project at 0%.
+            for project_id, total in enumerate(self.project_totals):
+                if total > 0:
+                    return (self.projects[project_id], 0.0, 0, total)
+        return best_match
+
+class FeatureIndex(FeatureMatcher):
+    """
+    Inverted index from (opcode, sha256) to the reference projects containing it.
+    A query only touches the postings of its own features, so its cost does not
+    grow with the number of reference projects.
+    """
+    def __init__(self):
+        self.projects = []        # project id -> project name (None once removed)
+        self.project_totals = []  # project id -> number of features
+        self.project_keys = []    # project id -> list of (opcode, hash) keys, used for removal
+        self.project_hash_versions = []  # project id -> FeatureHasher version of the project's CSV
+        self.project_ids = {}     # project name -> project id
+        self.sources = {}         # project name -> (mtime_ns, size) of its CSV
+        self.postings = {}        # (opcode, hash) -> list of project ids
+
+    def __len__(self):
+        return len(self.project_ids)
+
+    @staticmethod
+    def read_features(csv_file):
+        return read_feature_csv(csv_file)
+
+    def add_project(self, project, features):
+        """
+        Add or replace a project given its {opcode: hash} features.
+        """
+        if project in self.project_ids:
+            self.remove_project(project, keep_id=True)
+            project_id = self.project_ids[project]
+        else:
+            project_id = len(self.projects)
+            self.projects.append(project)
+            self.project_totals.append(0)
+            self.project_keys.append([])
+            self.project_hash_versions.append(None)
+            self.project_ids[project] = project_id
+
+        self._project_weights = None
+        keys = list(features.items())
+        for key in keys:
+            self.postings.setdefault(key, []).append(project_id)
+        self.project_keys[project_id] = keys
+        self.project_totals[project_id] = len(keys)
+        self.project_hash_versions[project_id] = getattr(features, "hash_version", None)
+        return project_id
+
+    def remove_project(self, project, keep_id=False):
+        project_id = self.project_ids[project]
+        self._project_weights = None
+        for key in self.project_keys[project_id]:
+            posting = self.postings[key]
+            posting.remove(project_id)
+            if not posting:
+                del self.postings[key]
+        self.project_keys[project_id] = []
+        self.project_totals[project_id] = 0
+        self.project_hash_versions[project_id] = None
+        if not keep_id:
+            del self.project_ids[project]
+            self.projects[project_id] = None
+            self.sources.pop(project, None)
+
+    def update(self, feature_dir):
+        """
+        Bring the index in line with the CSVs in feature_dir: new or modified files are
+        (re)indexed and deleted ones removed. Returns the number of projects changed.
+        """
+        feature_dir = Path(feature_dir)
+        seen = set()
+        changed = 0
+        for csv_file in feature_csv_files(feature_dir):
+            project = csv_file.stem
+            seen.add(project)
+            stat = csv_file.stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self.sources.get(project) == signature:
+                continue
+            self.add_project(project, self.read_features(csv_file))
+            self.sources[project] = signature
+            changed += 1
+        for project in [p for p in self.project_ids if p not in seen]:
+            self.remove_project(project)
+            changed += 1
+        return changed
+
+    def save(self, index_path):
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)
+
+    @classmethod
+    def load(cls, index_path):
+        index = cls()
+        with open(index_path, 'rb') as f:
+            index.__dict__.update(pickle.load(f))
+        return index
+
+    @classmethod
+    def open(cls, feature_dir, index_path=None):
+        """
+        Load the persisted index for feature_dir (if any), apply incremental updates
+        for added/changed/deleted CSVs and save it back when something changed.
+        A missing feature_dir gives an empty index; when the index cannot be saved
+        (read-only reference directory) the in-memory index is used as it is.
+        """
+        index_path = Path(index_path) if index_path else Path(feature_dir) / INDEX_FILE_NAME
+        index = cls()
+        if index_path.exists():
+            try:
+                index = cls.load(index_path)
+            except (pickle.UnpicklingError, EOFError, AttributeError, KeyError):
+                index = cls()
+            if len(index.project_hash_versions) != len(index.projects):
+                index = cls()  # saved before the hash versions of the projects were recorded
+        changed = index.update(feature_dir)
+        if (changed or not index_path.exists()) and index_path.parent.is_dir():
+            try:
+                index.save(index_path)
+            except OSError as e:
+                print(f"Could not save feature index {index_path}: {e}")
+        return index
+
+    def lookup(self, key):
+        return self.postings.get(key)
+
+    def iter_postings(self):
+        return self.postings.values()
@@ -0,0 +1,286 @@
+import os
+import sys
+import csv
+import mmap
+import struct
+import argparse
+from array import array
+from bisect import bisect_right
+from FeatureIndex import FeatureMatcher, feature_csv_files, read_feature_csv
+from FeatureHasher import HASH_JSON_V1, hash_header
+
+STORE_MAGIC = b'AEFS'
+STORE_VERSION = 2  # 2: per-project hash versions
+
+# magic, version, digest size, opcode / feature / project / posting counts
+_HEADER = struct.Struct('<4sHHIIII')
+_SECTIONS = (
+    'opcode_offsets',           # u32[n_opcodes + 1] into opcode_blob
+    'opcode_blob',              # utf-8 opcode names, sorted
+    'opcode_feature_start',     # u32[n_opcodes + 1] feature id range of each opcode
+    'digests',                  # digest_size bytes per feature, sorted within each opcode
+    'posting_offsets',          # u32[n_features + 1] into postings
+    'postings',                 # u32 project ids, ascending per feature
+    'project_name_offsets',     # u32[n_projects + 1] into project_name_blob
+    'project_name_blob',        # utf-8 project names
+    'project_totals',           # u32[n_projects] features per project
+    'project_feature_offsets',  # u32[n_projects + 1] into project_features
+    'project_features',         # u32 feature ids, ascending per project
+    'project_hash_version_offsets',  # u32[n_projects + 1] into project_hash_version_blob
+    'project_hash_version_blob',     # utf-8 FeatureHasher version of each project
+)
+_SECTION_TABLE = struct.Struct('<' + 'Q' * len(_SECTIONS))
+_ALIGN = 8
+
+def _u32_array(values):
+    data = array('I', values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+class FeatureStore(FeatureMatcher):
+    """
+    Read-only, memory-mapped feature database.
+    Opcodes are interned once, each unique (opcode, digest) pair is stored once as raw
+    bytes (32-byte SHA-256 or a truncated 8-byte fingerprint) and points to the projects
+    containing it. Opening the store only reads the opcode and project tables; the
+    digests and postings stay in the page cache and are shared between processes.
+    """
+    def __init__(self, store_path):
+        self.store_path = store_path
+        self._file = open(store_path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.digest_size, self.n_opcodes, self.n_features, self.n_projects, self.n_postings = \
+            _HEADER.unpack_from(self._mm, 0)
+        if magic != STORE_MAGIC:
+            raise ValueError(f"{store_path} is not a feature store (version {STORE_VERSION})")
+        if version != STORE_VERSION:
+            raise ValueError(f"{store_path} is a version {version} feature store, expected version {STORE_VERSION}; "
+                             f"rebuild it with `FeatureStore.py import`")
+        self._offsets = dict(zip(_SECTIONS, _SECTION_TABLE.unpack_from(self._mm, _HEADER.size)))
+
+        self.opcode_feature_start = self._u32_section('opcode_feature_start', self.n_opcodes + 1)
+        self.posting_offsets = self._u32_section('posting_offsets', self.n_features + 1)
+        self.postings_data = self._u32_section('postings', self.n_postings)
+        self.project_totals = self._u32_section('project_totals', self.n_projects)
+        self.project_feature_offsets = self._u32_section('project_feature_offsets', self.n_projects + 1)
+        self.project_features = self._u32_section('project_features', self.n_postings)
+
+        self.opcodes = self._string_table('opcode_offsets', 'opcode_blob', self.n_opcodes)
+        self.opcode_ids = {opcode: opcode_id for opcode_id, opcode in enumerate(self.opcodes)}
+        self.projects = self._string_table('project_name_offsets', 'project_name_blob', self.n_projects)
+        self.project_hash_versions = self._string_table('project_hash_version_offsets', 'project_hash_version_blob',
+                                                        self.n_projects)
+
+    def _u32_section(self, name, count):
+        start = self._offsets[name]
+        if sys.byteorder == 'little':
+            return memoryview(self._mm)[start:start + 4 * count].cast('I')
+        data = array('I', self._mm[start:start + 4 * count])
+        data.byteswap()
+        return data
+
+    def _string_table(self, offsets_name, blob_name, count):
+        offsets = self._u32_section(offsets_name, count + 1)
+        blob = self._offsets[blob_name]
+        return [self._mm[blob + offsets[i]:blob + offsets[i + 1]].decode('utf-8') for i in range(count)]
+
+    def close(self):
+        for view in (self.opcode_feature_start, self.posting_offsets, self.postings_data,
+                     self.project_totals, self.project_feature_offsets, self.project_features):
+            if isinstance(view, memoryview):
+                view.release()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.n_projects
+
+    def find_feature(self, opcode, hashval):
+        """
+        Return the feature id of (opcode, hex digest), or None. Binary search within the opcode's range.
+        """
+        opcode_id = self.opcode_ids.get(opcode)
+        if opcode_id is None:
+            return None
+        try:
+            key = bytes.fromhex(hashval)[:self.digest_size]
+        except ValueError:
+            return None
+        size, base, mm = self.digest_size, self._offsets['digests'], self._mm
+        lo, hi = self.opcode_feature_start[opcode_id], self.opcode_feature_start[opcode_id + 1]
+        end = hi
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mm[base + mid * size:base + (mid + 1) * size] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < end and mm[base + lo * size:base + (lo + 1) * size] == key:
+            return lo
+        return None
+
+    def feature_projects(self, feature_id):
+        return self.postings_data[self.posting_offsets[feature_id]:self.posting_offsets[feature_id + 1]]
+
+    def lookup(self, key):
+        feature_id = self.find_feature(*key)
+        return None if feature_id is None else self.feature_projects(feature_id)
+
+    def iter_postings(self):
+        for feature_id in range(self.n_features):
+            yield self.feature_projects(feature_id)
+
+    def feature(self, feature_id):
+        """
+        Return (opcode, hex digest) of a feature id.
+        """
+        opcode_id = bisect_right(self.opcode_feature_start, feature_id) - 1
+        base = self._offsets['digests'] + feature_id * self.digest_size
+        return self.opcodes[opcode_id], self._mm[base:base + self.digest_size].hex()
+
+    def project_feature_items(self, project_id):
+        """
+        Yield (opcode, hex digest) for every feature of a project, ordered by feature id.
+        """
+        start, end = self.project_feature_offsets[project_id], self.project_feature_offsets[project_id + 1]
+        for feature_id in self.project_features[start:end]:
+            yield self.feature(feature_id)
+
+def build_feature_store(project_features, store_path, digest_size=32):
+    """
+    Write a feature store from {project: {opcode: hex sha256}}; the hash version of a
+    project is taken from its FeatureSet (json-v1 for a plain dict).
+    digest_size=8 keeps a truncated 64-bit fingerprint instead of the full digest.
+    """
+    if not 1 <= digest_size <= 32:
+        raise ValueError("digest_size must be between 1 and 32 bytes")
+    projects = sorted(project_features)
+    opcodes = sorted({opcode for features in project_features.values() for opcode in features})
+
+    # (opcode, digest) -> sorted project ids
+    postings = {}
+    for project_id, project in enumerate(projects):
+        for opcode, hashval in project_features[project].items():
+            try:
+                key = (opcode, bytes.fromhex(hashval)[:digest_size])
+            except ValueError:
+                raise ValueError(f"Invalid digest for opcode {opcode} in project {project}: {hashval}")
+            postings.setdefault(key, []).append(project_id)
+    keys = sorted(postings)
+    feature_ids = {key: feature_id for feature_id, key in enumerate(keys)}
+
+    opcode_feature_start = []
+    position = 0
+    for opcode in opcodes:
+        opcode_feature_start.append(position)
+        while position < len(keys) and keys[position][0] == opcode:
+            position += 1
+    opcode_feature_start.append(position)
+
+    posting_offsets, posting_values = [0], []
+    for key in keys:
+        posting_values.extend(postings[key])
+        posting_offsets.append(len(posting_values))
+
+    project_feature_offsets, project_feature_values, project_totals = [0], [], []
+    for project in projects:
+        ids = sorted({feature_ids[(opcode, bytes.fromhex(hashval)[:digest_size])]
+                      for opcode, hashval in project_features[project].items()})
+        project_feature_values.extend(ids)
+        project_feature_offsets.append(len(project_feature_values))
+        project_totals.append(len(project_features[project]))
+
+    def string_table(strings):
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = [0]
+        for s in encoded:
+            offsets.append(offsets[-1] + len(s))
+        return _u32_array(offsets), b''.join(encoded)
+
+    opcode_offsets, opcode_blob = string_table(opcodes)
+    project_name_offsets, project_name_blob = string_table(projects)
+    project_hash_version_offsets, project_hash_version_blob = string_table(
+        getattr(project_features[project], "hash_version", HASH_JSON_V1) for project in projects
+    )
+    sections = {
+        'opcode_offsets': opcode_offsets,
+        'opcode_blob': opcode_blob,
+        'opcode_feature_start': _u32_array(opcode_feature_start),
+        'digests': b''.join(digest for _, digest in keys),
+        'posting_offsets': _u32_array(posting_offsets),
+        'postings': _u32_array(posting_values),
+        'project_name_offsets': project_name_offsets,
+        'project_name_blob': project_name_blob,
+        'project_totals': _u32_array(project_totals),
+        'project_feature_offsets': _u32_array(project_feature_offsets),
+        'project_features': _u32_array(project_feature_values),
+        'project_hash_version_offsets': project_hash_version_offsets,
+        'project_hash_version_blob': project_hash_version_blob,
+    }
+
+    tmp_path = f"{store_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(STORE_MAGIC, STORE_VERSION, digest_size, len(opcodes), len(keys),
+                             len(projects), len(posting_values)))
+        position = _HEADER.size + _SECTION_TABLE.size
+        offsets = []
+        for name in _SECTIONS:
+            position += -position % _ALIGN
+            offsets.append(position)
+            position += len(sections[name])
+        f.write(_SECTION_TABLE.pack(*offsets))
+        for name, offset in zip(_SECTIONS, offsets):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(sections[name])
+    os.replace(tmp_path, store_path)
+
+def import_csv_dir(feature_dir, store_path, digest_size=32):
+    """
+    Build a feature store from a directory of <project>.csv files produced by extractor.py.
+    """
+    project_features = {csv_file.stem: read_feature_csv(csv_file) for csv_file in feature_csv_files(feature_dir)}
+    build_feature_store(project_features, store_path, digest_size)
+    return len(project_features)
+
+def export_csv_dir(store_path, feature_dir):
+    """
+    Write one <project>.csv per project in the extractor's format.
+    Stores built with truncated fingerprints export the truncated hex digests.
+    """
+    os.makedirs(feature_dir, exist_ok=True)
+    with FeatureStore(store_path) as store:
+        for project_id, project in enumerate(store.projects):
+            with open(os.path.join(feature_dir, f"{project}.csv"), mode='w', newline='') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(['Opcode', hash_header(store.project_hash_versions[project_id])])  # Header row
+                writer.writerows(store.project_feature_items(project_id))
+        return len(store.projects)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between feature CSV directories and a binary feature store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="build a store from a CSV directory")
+    import_parser.add_argument("feature_dir")
+    import_parser.add_argument("store_path")
+    import_parser.add_argument("--digest-size", type=int, default=32, help="bytes kept per digest (8 for 64-bit fingerprints)")
+    export_parser = subparsers.add_parser("export", help="write the store back out as CSVs")
+    export_parser.add_argument("store_path")
+    export_parser.add_argument("feature_dir")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        count = import_csv_dir(args.feature_dir, args.store_path, args.digest_size)
+        print(f"Stored {count} projects in {args.store_path}")
+    else:
+        count = export_csv_dir(args.store_path, args.feature_dir)
+        print(f"Exported {count} projects to {args.feature_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import os
+import csv
+import sys
+import hashlib
+import argparse
+from pathlib import Path
+from ARM_InstructionLayout import F_BRANCH, F_UNDEFINED
+from FeatureIndex import FeatureIndex, RANK_METRICS
+from classify_asm_by_feature import load_config, build_controller
+
+DEFAULT_FUNCTION_DIR = "./output/function_features/"
+DEFAULT_MIN_INSTRUCTIONS = 4
+FUNCTION_INDEX_FILE_NAME = ".function_index.pkl"
+
+# Opcode of <UNDEFINED> entries in the object graph; left out as in the file-level features
+_UNDEFINED_OP_ASM = '@'
+
+def function_enabled(config):
+    return config.get("function_features", 'disable') == 'enable'
+
+def function_file_for(feature_file, config):
+    """
+    Return the function CSV path of an image if function_features is enabled, else None.
+    """
+    if not function_enabled(config):
+        return None
+    stem = os.path.splitext(os.path.basename(feature_file))[0]
+    if stem.endswith("_feature"):
+        stem = stem[:-len("_feature")]
+    return os.path.join(config.get("function_feature_dir", DEFAULT_FUNCTION_DIR), f"{stem}_functions.csv")
+
+def iter_function_rows(file_info):
+    """
+    Yield (label, rows) for every code block of an ArmFileInfo, where rows are the
+    (opcode, op_offset, branch target offset or None) of its instructions.
+    Columnar results must have been parsed with instruction rows.
+    """
+    for section in file_info.sections.values():
+        cols = section.columns
+        if cols is None or section.code_blocks:
+            for cb in section.code_blocks.values():
+                yield cb.cb_label, [
+                    (instruction.op_opcode_asm, instruction.op_offset,
+                     instruction.branch.b_target_offset if instruction.branch else None)
+                    for instruction in cb.instructions if instruction.op_opcode_asm != _UNDEFINED_OP_ASM
+                ]
+            continue
+        if not len(cols) and section.total_cb_instructions_count:
+            raise ValueError("function fingerprints need a parse with instruction_rows=True")
+        mnemonics = file_info.mnemonics
+        for cb_index, cb_address in enumerate(cols.cb_address):
+            rows = []
+            for row in cols.code_block_rows(cb_index):
+                flags = cols.flags[row]
+                if flags & F_UNDEFINED:
+                    continue
+                b_target_offset = cols.b_target_addr[row] - cb_address if flags & F_BRANCH else None
+                rows.append((mnemonics[cols.op_mnemonic[row]], cols.op_address[row] - cb_address, b_target_offset))
+            yield cols.cb_label[cb_index], rows
+
+def function_fingerprint(rows):
+    """
+    Position-independent fingerprint of one function: the opcode and offset of every
+    instruction and the targets of branches that stay inside the function. Targets
+    outside it (calls, tail jumps) only count as external, so relinking the image
+    does not change the fingerprint of an unchanged function.
+    """
+    end = rows[-1][1] if rows else 0
+    encoded = []
+    for op_asm_keyword, op_offset, b_target_offset in rows:
+        if b_target_offset is None:
+            target = ''
+        elif 0 <= b_target_offset <= end:
+            target = b_target_offset
+        else:
+            target = 'x'
+        encoded.append(f"{op_asm_keyword}:{op_offset}:{target}")
+    return hashlib.blake2b('\n'.join(encoded).encode('utf-8'), digest_size=16).hexdigest()
+
+def iter_function_fingerprints(asm_metadata, min_instructions=DEFAULT_MIN_INSTRUCTIONS):
+    """
+    Yield (label, fingerprint, instruction count) per code block. Blocks shorter than
+    min_instructions (veneers, return stubs) are common to most images and are skipped.
+    """
+    for file_info in asm_metadata.values():
+        for label, rows in iter_function_rows(file_info):
+            if len(rows) >= min_instructions:
+                yield label, function_fingerprint(rows), len(rows)
+
+def function_features(asm_metadata, min_instructions=DEFAULT_MIN_INSTRUCTIONS):
+    """
+    Return the {fingerprint: instruction count} query features of a parse result.
+    """
+    return {fingerprint: instructions for _, fingerprint, instructions in iter_function_fingerprints(asm_metadata, min_instructions)}
+
+def write_function_csv(asm_metadata, function_file, min_instructions=DEFAULT_MIN_INSTRUCTIONS):
+    """
+    Write (label, fingerprint, instruction count) rows atomically.
+    """
+    os.makedirs(os.path.dirname(function_file) or '.', exist_ok=True)
+    tmp_file = function_file + ".tmp"
+    with open(tmp_file, mode='w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Function', 'Fingerprint', 'Instructions'])  # Header row
+        writer.writerows(iter_function_fingerprints(asm_metadata, min_instructions))
+    os.replace(tmp_file, function_file)
+
+def read_function_csv(csv_file):
+    """
+    Read one function CSV into a {fingerprint: instruction count} dict.
+    """
+    features = {}
+    with open(csv_file, 'r') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Skip header
+        for row in reader:
+            if len(row) == 3:
+                _, fingerprint, instructions = row
+                features[fingerprint] = int(instructions)
+    return features
+
+class FunctionIndex(FeatureIndex):
+    """
+    Inverted index from function fingerprint to the reference projects containing it,
+    built from the *_functions.csv files of extractor.py (function_features: enable).
+    Each lookup is one dict access however many functions are indexed. Scores count
+    matched functions, so a query holding part of a firmware image, or a relinked one,
+    keeps the share of its functions that are unchanged (query_containment).
+    """
+    read_features = staticmethod(read_function_csv)
+
+    @classmethod
+    def open(cls, function_dir, index_path=None):
+        return super().open(function_dir, index_path or Path(function_dir) / FUNCTION_INDEX_FILE_NAME)
+
+    def projects_with(self, fingerprint, instructions):
+        """
+        Return the names of the reference projects containing the function.
+        """
+        return [self.projects[project_id] for project_id in self.lookup((fingerprint, instructions)) or ()]
+
+def main():
+    root = Path(__file__).resolve().parent
+    parser = argparse.ArgumentParser(description="Rank reference projects by the functions they share with an .asm file.")
+    parser.add_argument("asm_file")
+    parser.add_argument("--function-dir", default=str(root / "output" / "function_features"))
+    parser.add_argument("--config", default=str(root / "config.yaml"))
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--metric", default="query_containment", choices=RANK_METRICS)
+    args = parser.parse_args()
+
+    config = load_config(Path(args.config))
+    controller = build_controller(config)
+    query = function_features(controller.parseAsmFile(args.asm_file),
+                              config.get("function_min_instructions", DEFAULT_MIN_INSTRUCTIONS))
+    index = FunctionIndex.open(args.function_dir)
+    print(f"{len(query)} functions in {args.asm_file}, {len(index)} reference projects")
+    for match in index.rank(query, args.top_k, args.metric):
+        print(f"{match['project']}: {match['matched']} shared functions, "
+              f"{match['query_containment']:.2%} of the query, {match['similarity']:.2%} of the reference")
+    if not query:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
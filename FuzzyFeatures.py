@@ -0,0 +1,181 @@
+import os
+import csv
+import heapq
+import struct
+import hashlib
+from array import array
+from pathlib import Path
+
+DEFAULT_SKETCH_SIZE = 32
+DEFAULT_LSH_BANDS = 8
+EMPTY_BIN = 0xFFFFFFFFFFFFFFFF
+SKETCH_SUFFIX = "_minhash"  # <project>_minhash.csv, next to the exact <project>_feature.csv files
+
+_OFFSET_TUPLE = struct.Struct('<qqq')
+
+def minhash_sketch(offset_list, sketch_size=DEFAULT_SKETCH_SIZE):
+    """
+    One-permutation MinHash of a set of (cb_offset, op_offset, b_target_offset) tuples.
+    Each tuple is hashed once; the hash picks one of sketch_size bins and the bin keeps
+    its minimum. Moving one instruction changes at most a couple of bins instead of
+    the whole feature, and the sketch size is fixed however long the offset list is.
+    """
+    sketch = array('Q', [EMPTY_BIN]) * sketch_size
+    pack = _OFFSET_TUPLE.pack
+    blake2b = hashlib.blake2b
+    for offsets in offset_list:
+        value = int.from_bytes(blake2b(pack(*offsets), digest_size=8).digest(), 'little')
+        bin_index = value % sketch_size
+        value //= sketch_size
+        if value < sketch[bin_index]:
+            sketch[bin_index] = value
+    return sketch
+
+def estimate_similarity(sketch_a, sketch_b):
+    """
+    Estimated Jaccard similarity of the two offset sets behind the sketches.
+    Bins empty in both sketches carry no information and are ignored.
+    """
+    matched = informative = 0
+    for a, b in zip(sketch_a, sketch_b):
+        if a == EMPTY_BIN and b == EMPTY_BIN:
+            continue
+        informative += 1
+        if a == b:
+            matched += 1
+    return matched / informative if informative else 0.0
+
+def sketch_asm_metadata(asm_metadata, sketch_size=DEFAULT_SKETCH_SIZE):
+    """
+    Return {opcode: sketch} for the ArmFileInfo objects returned by the parser.
+    """
+    sketches = {}
+    for _, file_info in asm_metadata.items():
+        for opcode, offsetlist in file_info.iter_op_asm_offset_lists():
+            sketches[opcode] = minhash_sketch(offsetlist, sketch_size)
+    return sketches
+
+def write_sketch_csv(sketches, sketch_file):
+    """
+    Write {opcode: sketch} as an (opcode, space separated hex bins) CSV atomically.
+    """
+    tmp_file = f"{sketch_file}.tmp"
+    with open(tmp_file, mode='w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Opcode', 'MinHash'])  # Header row
+        for opcode, sketch in sketches.items():
+            writer.writerow([opcode, ' '.join(f"{value:x}" for value in sketch)])
+    os.replace(tmp_file, sketch_file)
+
+def read_sketch_csv(sketch_file):
+    sketches = {}
+    with open(sketch_file, 'r') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Skip header
+        for row in reader:
+            if len(row) == 2:
+                opcode, values = row
+                sketches[opcode] = array('Q', (int(value, 16) for value in values.split()))
+    return sketches
+
+def sketch_csv_files(feature_dir):
+    """
+    The <project>_minhash.csv sketch files of feature_dir, sorted.
+    """
+    return sorted(Path(feature_dir).glob(f"*{SKETCH_SUFFIX}.csv"))
+
+class SketchIndex:
+    """
+    Reference projects stored as per-opcode MinHash sketches with an LSH banding index.
+    Each sketch is cut into bands; a (opcode, band, band values) bucket lists the
+    projects sharing it, so a query only scores projects that collide with it in at
+    least one band instead of scanning the whole corpus.
+    """
+    def __init__(self, sketch_size=DEFAULT_SKETCH_SIZE, bands=DEFAULT_LSH_BANDS):
+        if sketch_size % bands:
+            raise ValueError("sketch_size must be a multiple of bands")
+        self.sketch_size = sketch_size
+        self.bands = bands
+        self.rows = sketch_size // bands
+        self.projects = []          # project id -> name
+        self.project_sketches = []  # project id -> {opcode: sketch}
+        self.buckets = {}           # (opcode, band, band values) -> list of project ids
+
+    def __len__(self):
+        return len(self.projects)
+
+    def band_keys(self, opcode, sketch):
+        rows = self.rows
+        for band in range(self.bands):
+            values = tuple(sketch[band * rows:(band + 1) * rows])
+            if all(value == EMPTY_BIN for value in values):
+                continue
+            yield (opcode, band, values)
+
+    def add_project(self, project, sketches):
+        project_id = len(self.projects)
+        self.projects.append(project)
+        self.project_sketches.append(sketches)
+        for opcode, sketch in sketches.items():
+            if len(sketch) != self.sketch_size:
+                raise ValueError(f"{project}: sketch of {opcode} has {len(sketch)} bins, expected {self.sketch_size}")
+            for key in self.band_keys(opcode, sketch):
+                self.buckets.setdefault(key, []).append(project_id)
+        return project_id
+
+    @classmethod
+    def from_csv_dir(cls, feature_dir, sketch_size=DEFAULT_SKETCH_SIZE, bands=DEFAULT_LSH_BANDS):
+        index = cls(sketch_size, bands)
+        for sketch_file in sketch_csv_files(feature_dir):
+            index.add_project(sketch_file.stem[:-len(SKETCH_SUFFIX)], read_sketch_csv(sketch_file))
+        return index
+
+    def candidates(self, query_sketches):
+        """
+        Return {project id: number of colliding (opcode, band) buckets}.
+        """
+        hits = {}
+        for opcode, sketch in query_sketches.items():
+            for key in self.band_keys(opcode, sketch):
+                for project_id in self.buckets.get(key, ()):
+                    hits[project_id] = hits.get(project_id, 0) + 1
+        return hits
+
+    def score(self, project_id, query_sketches):
+        """
+        Mean estimated similarity over the project's opcodes (opcodes missing from the
+        query count as 0) and the number of opcodes with any overlap.
+        """
+        sketches = self.project_sketches[project_id]
+        total = 0.0
+        matched = 0
+        for opcode, sketch in sketches.items():
+            query_sketch = query_sketches.get(opcode)
+            if query_sketch is None:
+                continue
+            similarity = estimate_similarity(sketch, query_sketch)
+            total += similarity
+            if similarity > 0:
+                matched += 1
+        return (total / len(sketches) if sketches else 0.0), matched, len(sketches)
+
+    def rank(self, query_sketches, top_k=5):
+        """
+        Return the top_k candidate projects as dicts, best estimated similarity first.
+        """
+        matches = []
+        for project_id in self.candidates(query_sketches):
+            similarity, matched, total = self.score(project_id, query_sketches)
+            matches.append({"project": self.projects[project_id], "similarity": similarity,
+                            "matched": matched, "total": total})
+        return heapq.nlargest(top_k, matches, key=lambda match: (match["similarity"], match["matched"]))
+
+    def classify(self, query_sketches):
+        """
+        Return the best (project, similarity, matched, total), or None without any candidate.
+        """
+        ranked = self.rank(query_sketches, 1)
+        if not ranked:
+            return None
+        best = ranked[0]
+        return (best["project"], best["similarity"], best["matched"], best["total"])
@@ -0,0 +1,249 @@
+# Staged extraction pipeline (extract_pipeline: async in config.yaml).
+#
+#   read ──parse queue──> parse (process pool) ──write queue──> write
+#
+# The reader decompresses 7z members on a thread and spools each one to a file; plain
+# .asm files are queued as they are. The parsers parse and hash on worker processes, and
+# one writer thread writes the feature CSVs. Both queues are bounded, so a slow stage
+# stalls the stages in front of it instead of buffering members, and the throughput of
+# a batch follows the slowest stage. Unlike the pool mode (run_batch), the members of one
+# archive are spread over all workers.
+import os
+import time
+import shutil
+import asyncio
+import tempfile
+import threading
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from FeatureExtraction import (JOB_ARCHIVE, build_reader, load_asm_metadata, needs_instruction_rows, write_row_outputs,
+                               compute_features, save_features, feature_stats, print_throughput)
+from ParseCache import ParseCache, file_digest, member_digest
+from SevenZipReader import SevenZipAsmReader
+from Metrics import Metrics, metrics
+
+PIPELINE_POOL = 'pool'
+PIPELINE_ASYNC = 'async'
+PIPELINE_MODES = (PIPELINE_POOL, PIPELINE_ASYNC)
+SPOOL_CHUNK_SIZE = 1 << 20
+_END = None
+
+class PipelineCancelled(Exception):
+    pass
+
+def pipeline_mode(config):
+    mode = config.get("extract_pipeline", PIPELINE_POOL)  # pool, async
+    if mode not in PIPELINE_MODES:
+        raise ValueError(f"unknown extract_pipeline {mode!r}, expected one of {', '.join(PIPELINE_MODES)}")
+    return mode
+
+_worker_config = None
+_worker_reader = None
+
+def _init_worker(config):
+    global _worker_config, _worker_reader
+    _worker_config = config
+    _worker_reader = build_reader(config)
+
+def _parse_item(input_name, asm_path, feature_file, input_digest, spooled):
+    """
+    Parse one queued file and hash it; only the feature rows and the statistics go
+    back to the main process. Reports and function CSVs are written here, since they
+    need the instruction rows.
+    """
+    start = time.perf_counter()
+    job_metrics = Metrics.from_config(_worker_config)
+    # Spooled members keep the cache key of their archive member and skip the delta
+    # block table, as in extract_archive_features
+    asm_metadata, lines, delta = load_asm_metadata(asm_path, feature_file, _worker_config, _worker_reader, job_metrics,
+                                                   input_digest, delta_extraction=not spooled)
+    if needs_instruction_rows(_worker_config):
+        write_row_outputs(asm_metadata, feature_file, _worker_reader, _worker_config, job_metrics)
+    features = compute_features(asm_metadata, _worker_config, job_metrics)
+    return features, feature_stats(input_name, feature_file, lines, start, delta, job_metrics)
+
+class IngestPipeline:
+    """
+    Run the jobs of FeatureExtraction.plan_jobs through the read, parse and write stages.
+    At most queue_size files wait between two stages (2 * jobs by default), so no
+    more than that many members are spooled at a time. An error in one file is
+    reported and the batch goes on; an error in a stage cancels the pipeline,
+    stops the reader thread and removes the spool directory.
+    """
+    def __init__(self, config, jobs=None, queue_size=None, spool_dir=None):
+        self.config = config
+        self.jobs = jobs or os.cpu_count() or 1
+        self.queue_size = queue_size or 2 * self.jobs
+        self.spool_root = spool_dir or config.get("pipeline_spool_dir")
+        self.cancelled = threading.Event()
+        self.results = []
+        self.failures = []
+
+    def fail(self, input_name, error):
+        print(f"Failed to process {input_name}: {error}")
+        self.failures.append(input_name)
+
+    # -- read stage --
+    def _put_from_thread(self, queue, item, loop):
+        # Blocks the reader thread while the queue is full; gives up when the pipeline is cancelled
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+        while True:
+            if self.cancelled.is_set():
+                future.cancel()
+                raise PipelineCancelled()
+            try:
+                return future.result(timeout=0.1)
+            except concurrent.futures.TimeoutError:
+                continue
+
+    def _read_archive(self, archive_path, member_outputs, spool_dir, parse_queue, write_queue, loop):
+        """
+        Queue the members of one archive: cached members go straight to the writer,
+        the others are decompressed in one streaming pass and spooled to files.
+        Runs on the reader thread; returns the metrics snapshot of the archive.
+        """
+        job_metrics = Metrics.from_config(self.config)
+        full_parse = needs_instruction_rows(self.config)
+        parse_cache = ParseCache.from_config(self.config) if not full_parse else None
+        archive_digest = None
+        if parse_cache:
+            with job_metrics.stage("digest"):
+                archive_digest = file_digest(archive_path)
+        reader = build_reader(self.config) if parse_cache else None
+        pending = {}
+        for member, feature_file in member_outputs:
+            input_digest = member_digest(archive_digest, member) if parse_cache else None
+            cached_metadata = parse_cache.get(parse_cache.key(input_digest, reader)) if parse_cache else None
+            if cached_metadata is None:
+                pending[member] = (feature_file, input_digest)
+                continue
+            stats = feature_stats(f"{archive_path}:{member}", feature_file, None, time.perf_counter(),
+                                  job_metrics=Metrics.from_config(self.config))
+            self._put_from_thread(write_queue, (None, cached_metadata, stats), loop)
+        if not pending:
+            return job_metrics.snapshot() if job_metrics.enabled else None
+
+        members = iter(SevenZipAsmReader(archive_path, list(pending)))
+        try:
+            for member, asm_stream in members:
+                feature_file, input_digest = pending[member]
+                with job_metrics.stage("decompress"), asm_stream:
+                    fd, spool_path = tempfile.mkstemp(dir=spool_dir, suffix=".asm")
+                    with os.fdopen(fd, 'wb') as spool_file:
+                        shutil.copyfileobj(asm_stream.buffer, spool_file, SPOOL_CHUNK_SIZE)
+                self._put_from_thread(
+                    parse_queue, (f"{archive_path}:{member}", spool_path, feature_file, input_digest, True), loop
+                )
+        finally:
+            members.close()
+        return job_metrics.snapshot() if job_metrics.enabled else None
+
+    async def read(self, jobs, spool_dir, parse_queue, write_queue, read_executor):
+        loop = asyncio.get_running_loop()
+        for kind, input_path, outputs in jobs:
+            if kind != JOB_ARCHIVE:
+                await parse_queue.put((input_path, input_path, outputs, None, False))
+                continue
+            try:
+                archive_metrics = await loop.run_in_executor(
+                    read_executor, self._read_archive, input_path, outputs, spool_dir, parse_queue, write_queue, loop
+                )
+            except PipelineCancelled:
+                raise
+            except Exception as e:
+                self.fail(input_path, e)
+                continue
+            metrics.merge(archive_metrics)
+        for _ in range(self.jobs):
+            await parse_queue.put(_END)
+
+    # -- parse stage --
+    async def parse(self, parse_queue, write_queue, executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await parse_queue.get()
+            if item is _END:
+                return
+            input_name, asm_path, feature_file, input_digest, spooled = item
+            try:
+                features, stats = await loop.run_in_executor(executor, _parse_item, *item)
+            except Exception as e:
+                self.fail(input_name, e)
+                continue
+            finally:
+                if spooled:
+                    os.unlink(asm_path)
+            await write_queue.put((features, None, stats))
+
+    # -- write stage --
+    def _write_item(self, features, asm_metadata, stats):
+        job_metrics = Metrics.from_config(self.config)
+        if features is None:
+            # Parse cache hit: the stored hashes are reused
+            features = compute_features(asm_metadata, self.config, job_metrics)
+        save_features(features, stats["output"], self.config, job_metrics)
+        return job_metrics.snapshot() if job_metrics.enabled else None
+
+    async def write(self, write_queue, write_executor):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await write_queue.get()
+            if item is _END:
+                return
+            features, asm_metadata, stats = item
+            try:
+                write_metrics = await loop.run_in_executor(write_executor, self._write_item, features, asm_metadata, stats)
+            except Exception as e:
+                self.fail(stats["input"], e)
+                continue
+            print_throughput(stats)
+            metrics.merge(stats["metrics"])
+            metrics.merge(write_metrics)
+            self.results.append(stats)
+
+    async def run(self, jobs):
+        """
+        Process the jobs; returns (results, failures) like extractor.run_batch.
+        """
+        parse_queue = asyncio.Queue(self.queue_size)
+        write_queue = asyncio.Queue(self.queue_size)
+        if self.spool_root:
+            os.makedirs(self.spool_root, exist_ok=True)
+        spool_dir = tempfile.mkdtemp(prefix="asm_spool_", dir=self.spool_root)
+        executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker, initargs=(self.config,))
+        read_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-read")
+        write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pipeline-write")
+
+        async def parse_and_close():
+            # The writer ends once every parser has drained its share of the queue
+            await asyncio.gather(*(self.parse(parse_queue, write_queue, executor) for _ in range(self.jobs)))
+            await write_queue.put(_END)
+
+        tasks = [
+            asyncio.ensure_future(self.read(jobs, spool_dir, parse_queue, write_queue, read_executor)),
+            asyncio.ensure_future(parse_and_close()),
+            asyncio.ensure_future(self.write(write_queue, write_executor)),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+            await asyncio.gather(*tasks)
+        except BaseException:
+            self.cancelled.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            read_executor.shutdown(wait=True)
+            write_executor.shutdown(wait=True)
+            executor.shutdown(cancel_futures=True)
+            shutil.rmtree(spool_dir, ignore_errors=True)
+        return self.results, self.failures
+
+def run_pipeline(jobs, config, workers=None):
+    """
+    Run FeatureExtraction.plan_jobs output through an IngestPipeline on a new event loop.
+    """
+    return asyncio.run(IngestPipeline(config, workers).run(jobs))
@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory is not sampled
+    resource = None
+
+DEFAULT_METRICS_PREFIX = "asm_extractor"
+DEFAULT_METRICS_FILE = "./output/metrics.json"
+
+class _StageTimer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add_time(self.name, time.perf_counter() - self.start)
+        self.metrics.sample_memory()
+        return False
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+def peak_rss_bytes():
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class Metrics:
+    """
+    Stage timers, counters and peak memory of the extraction and classification jobs.
+    Stages are timed around whole files or phases, never per line, and every method
+    returns immediately while the metrics are disabled. Snapshots of worker processes
+    are merged with merge(); export with to_json() or to_prometheus().
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("metrics", 'disable') == 'enable')
+
+    def reset(self):
+        self.timers = {}    # stage -> [calls, seconds]
+        self.counters = {}  # name -> value
+        self.peak_rss_bytes = 0
+
+    def stage(self, name):
+        """
+        Context manager timing one run of a stage.
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _StageTimer(self, name)
+
+    def add_time(self, name, seconds, calls=1):
+        if not self.enabled:
+            return
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = [0, 0.0]
+        timer[0] += calls
+        timer[1] += seconds
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def sample_memory(self):
+        if not self.enabled:
+            return
+        self.peak_rss_bytes = max(self.peak_rss_bytes, peak_rss_bytes())
+
+    def record_asm_metadata(self, asm_metadata):
+        """
+        Count the files, code blocks, instructions, branches and skipped <UNDEFINED>
+        entries of a parser result. Parse cache entries only add to the file count.
+        """
+        if not self.enabled:
+            return
+        self.count("files", len(asm_metadata))
+        for file_info in asm_metadata.values():
+            for section in getattr(file_info, "sections", {}).values():
+                self.count("sections")
+                self.count("code_blocks", section.code_blocks_count)
+                self.count("instructions", section.total_cb_instructions_count)
+                self.count("branches", section.total_b_branches_count)
+                self.count("undefined", section.total_undefined_count)
+
+    def snapshot(self):
+        """
+        Return the current metrics as a dict (see merge) and start over.
+        """
+        data = self.to_dict()
+        self.reset()
+        return data
+
+    def merge(self, data):
+        """
+        Add the to_dict() snapshot of another process.
+        """
+        if not self.enabled or not data:
+            return
+        for name, timer in data["stages"].items():
+            self.add_time(name, timer["seconds"], timer["calls"])
+        for name, value in data["counters"].items():
+            self.count(name, value)
+        self.peak_rss_bytes = max(self.peak_rss_bytes, data["peak_rss_bytes"])
+
+    def to_dict(self):
+        return {
+            "stages": {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in self.timers.items()},
+            "counters": dict(self.counters),
+            "peak_rss_bytes": self.peak_rss_bytes,
+        }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_prometheus(self, prefix=DEFAULT_METRICS_PREFIX):
+        """
+        Prometheus text exposition format.
+        """
+        lines = [
+            f"# HELP {prefix}_stage_seconds_total Time spent per stage.",
+            f"# TYPE {prefix}_stage_seconds_total counter",
+        ]
+        lines += [f'{prefix}_stage_seconds_total{{stage="{name}"}} {seconds:.6f}' for name, (_, seconds) in self.timers.items()]
+        lines += [
+            f"# HELP {prefix}_stage_calls_total Runs per stage.",
+            f"# TYPE {prefix}_stage_calls_total counter",
+        ]
+        lines += [f'{prefix}_stage_calls_total{{stage="{name}"}} {calls}' for name, (calls, _) in self.timers.items()]
+        for name, value in self.counters.items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        lines.append(f"# TYPE {prefix}_peak_rss_bytes gauge")
+        lines.append(f"{prefix}_peak_rss_bytes {self.peak_rss_bytes}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """
+        Write the metrics to path: Prometheus text for *.prom, JSON otherwise.
+        """
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus() if path.endswith('.prom') else self.to_json() + '\n')
+
+# Process-wide instance; disabled (a no-op) unless configure_metrics() turns it on
+metrics = Metrics()
+
+def configure_metrics(config, metrics_file=None):
+    """
+    Enable the metrics if config.yaml has `metrics: enable` or a metrics file is given.
+    Returns the file the metrics should be written to, or None while disabled.
+    """
+    metrics.enabled = bool(metrics_file) or config.get("metrics", 'disable') == 'enable'
+    if not metrics.enabled:
+        return None
+    return metrics_file or config.get("metrics_file", DEFAULT_METRICS_FILE)
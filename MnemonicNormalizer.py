@@ -0,0 +1,176 @@
+import re
+
+# Branch categories of a mnemonic (MnemonicTable entries)
+KIND_NONE = 0
+KIND_JUMP = 1
+KIND_CALL = 2
+KIND_RETURN = 3
+
+NORMALIZE_NONE = 'none'
+NORMALIZE_ARM = 'arm'          # ARM (A32) and Thumb-2 (T32), arm-none-eabi-objdump
+NORMALIZE_AARCH64 = 'aarch64'  # A64, aarch64-linux-gnu-objdump
+NORMALIZE_AUTO = 'auto'        # per file, from the "file format" of its header
+NORMALIZATIONS = (NORMALIZE_NONE, NORMALIZE_ARM, NORMALIZE_AARCH64, NORMALIZE_AUTO)
+
+CONDITIONAL_JUMP = 'b.cond'
+
+_CONDITIONS = ('eq', 'ne', 'cs', 'hs', 'cc', 'lo', 'mi', 'pl', 'vs', 'vc', 'hi', 'ls', 'ge', 'lt', 'gt', 'le', 'al')
+_WIDTHS = ('n', 'w')
+
+# A32/T32 mnemonics, without condition, flag-setting or width suffixes
+_ARM_BASES = (
+    'adc', 'add', 'addw', 'adr', 'and', 'asr', 'bfc', 'bfi', 'bic', 'bkpt', 'clrex', 'clz', 'cmn', 'cmp',
+    'cpsid', 'cpsie', 'dbg', 'dmb', 'dsb', 'eor', 'isb', 'lda', 'ldab', 'ldah', 'ldm', 'ldmdb', 'ldmda', 'ldmib',
+    'ldr', 'ldrb', 'ldrbt', 'ldrd', 'ldrex', 'ldrexb', 'ldrexd', 'ldrexh', 'ldrh', 'ldrht', 'ldrsb', 'ldrsbt',
+    'ldrsh', 'ldrsht', 'ldrt', 'lsl', 'lsr', 'mcr', 'mcr2', 'mcrr', 'mla', 'mls', 'mov', 'movt', 'movw', 'mrc',
+    'mrc2', 'mrrc', 'mrs', 'msr', 'mul', 'mvn', 'neg', 'nop', 'orn', 'orr', 'pkhbt', 'pkhtb', 'pld', 'pldw',
+    'pli', 'pop', 'push', 'qadd', 'qadd16', 'qadd8', 'qdadd', 'qdsub', 'qsub', 'qsub16', 'qsub8', 'rbit', 'rev',
+    'rev16', 'revsh', 'ror', 'rrx', 'rsb', 'rsc', 'sadd16', 'sadd8', 'sbc', 'sbfx', 'sdiv', 'sel', 'sev',
+    'shadd16', 'shadd8', 'smlabb', 'smlabt', 'smlad', 'smlal', 'smlalbb', 'smlald', 'smlatb', 'smlatt', 'smlawb',
+    'smlawt', 'smlsd', 'smlsld', 'smmla', 'smmls', 'smmul', 'smuad', 'smulbb', 'smulbt', 'smull', 'smultb',
+    'smultt', 'smulwb', 'smulwt', 'smusd', 'ssat', 'ssat16', 'ssub16', 'ssub8', 'stl', 'stlb', 'stlh', 'stm',
+    'stmdb', 'stmda', 'stmib', 'str', 'strb', 'strbt', 'strd', 'strex', 'strexb', 'strexd', 'strexh', 'strh',
+    'strht', 'strt', 'sub', 'subw', 'svc', 'swp', 'swpb', 'sxtab', 'sxtab16', 'sxtah', 'sxtb', 'sxtb16', 'sxth',
+    'teq', 'tst', 'uadd16', 'uadd8', 'ubfx', 'udf', 'udiv', 'uhadd16', 'uhadd8', 'umaal', 'umlal', 'umull',
+    'uqadd16', 'uqadd8', 'uqsub16', 'uqsub8', 'usad8', 'usada8', 'usat', 'usat16', 'usub16', 'usub8', 'uxtab',
+    'uxtab16', 'uxtah', 'uxtb', 'uxtb16', 'uxth', 'wfe', 'wfi', 'yield',
+    'vabs', 'vadd', 'vcmp', 'vcmpe', 'vcvt', 'vcvtr', 'vdiv', 'vdup', 'vfma', 'vfms', 'vld1', 'vld2', 'vld3',
+    'vld4', 'vldm', 'vldmdb', 'vldmia', 'vldr', 'vmla', 'vmls', 'vmov', 'vmrs', 'vmsr', 'vmul', 'vneg', 'vnmla',
+    'vnmls', 'vnmul', 'vpop', 'vpush', 'vsqrt', 'vst1', 'vst2', 'vst3', 'vst4', 'vstm', 'vstmdb', 'vstmia',
+    'vstr', 'vsub',
+)
+# Bases taking the flag-setting "s" suffix; adds and add.w are one class
+_ARM_FLAG_BASES = frozenset((
+    'adc', 'add', 'and', 'asr', 'bic', 'eor', 'lsl', 'lsr', 'mla', 'mov', 'mul', 'mvn', 'neg', 'orn', 'orr',
+    'ror', 'rrx', 'rsb', 'rsc', 'sbc', 'smlal', 'smull', 'sub', 'umlal', 'umull',
+))
+# Default addressing modes spelled out
+_ARM_ALIASES = {'ldmia': 'ldm', 'ldmfd': 'ldm', 'stmia': 'stm', 'stmea': 'stm', 'stmfd': 'stmdb', 'ldmea': 'ldmdb'}
+_ARM_BRANCH_BASES = {'b': KIND_JUMP, 'bx': KIND_JUMP, 'bxj': KIND_JUMP, 'bl': KIND_CALL, 'blx': KIND_CALL}
+_ARM_UNCONDITIONAL = {'cbz': KIND_JUMP, 'cbnz': KIND_JUMP, 'tbb': KIND_JUMP, 'tbh': KIND_JUMP}
+_IT_RE = re.compile(r'it[te]{0,3}$')
+
+_AARCH64_KINDS = {
+    'b': KIND_JUMP, 'br': KIND_JUMP, 'braa': KIND_JUMP, 'brab': KIND_JUMP, 'braaz': KIND_JUMP, 'brabz': KIND_JUMP,
+    'cbz': KIND_JUMP, 'cbnz': KIND_JUMP, 'tbz': KIND_JUMP, 'tbnz': KIND_JUMP,
+    'bl': KIND_CALL, 'blr': KIND_CALL, 'blraa': KIND_CALL, 'blrab': KIND_CALL, 'blraaz': KIND_CALL, 'blrabz': KIND_CALL,
+    'ret': KIND_RETURN, 'retaa': KIND_RETURN, 'retab': KIND_RETURN,
+    'eret': KIND_RETURN, 'eretaa': KIND_RETURN, 'eretab': KIND_RETURN,
+}
+
+def normalization_setting(config):
+    """
+    Return mnemonic_normalization from config.yaml; raises ValueError for an unknown value.
+    """
+    arch = config.get("mnemonic_normalization", NORMALIZE_NONE)
+    if arch not in NORMALIZATIONS:
+        raise ValueError(f"unknown mnemonic_normalization {arch!r}, expected one of {', '.join(NORMALIZATIONS)}")
+    return arch
+
+class MnemonicTable:
+    """
+    Lookup table from raw mnemonic to (canonical class, branch kind) for one
+    architecture. The known spellings are compiled into entries when the table is
+    built, so the parser does one dict lookup per line; other mnemonics are
+    classified on first use and added.
+    """
+    def __init__(self, arch):
+        self.arch = arch
+        self.entries = {}
+        if arch == NORMALIZE_AARCH64:
+            self._compile_aarch64()
+        else:
+            self._compile_arm()
+
+    def _compile_arm(self):
+        entries = self.entries
+        # Plain spellings first, so a base such as teq or bls.n is never read as base + condition
+        for base in _ARM_BASES:
+            canonical = _ARM_ALIASES.get(base, base)
+            for width in ('',) + tuple('.' + width for width in _WIDTHS):
+                entries.setdefault(base + width, (canonical, KIND_NONE))
+        for alias, canonical in _ARM_ALIASES.items():
+            entries.setdefault(alias, (canonical, KIND_NONE))
+        for base, kind in _ARM_UNCONDITIONAL.items():
+            for width in ('', '.n', '.w'):
+                entries[base + width] = (base, kind)
+        for base, kind in _ARM_BRANCH_BASES.items():
+            for width in ('', '.n', '.w'):
+                entries[base + width] = (base, kind)
+        for condition in _CONDITIONS:
+            conditional = condition != 'al'
+            for base, kind in _ARM_BRANCH_BASES.items():
+                # Conditional jumps keep that they are conditional, calls do not
+                canonical = (CONDITIONAL_JUMP if base == 'b' else base + '.cond') if conditional and kind == KIND_JUMP else base
+                for width in ('', '.n', '.w'):
+                    entries.setdefault(base + condition + width, (canonical, kind))
+            for base in _ARM_BASES + tuple(_ARM_ALIASES):
+                canonical = _ARM_ALIASES.get(base, base)
+                flag_suffixes = ('', 's') if base in _ARM_FLAG_BASES else ('',)
+                for flags in flag_suffixes:
+                    for width in ('', '.n', '.w'):
+                        entries.setdefault(base + flags + condition + width, (canonical, KIND_NONE))
+        for base in _ARM_FLAG_BASES:
+            for width in ('', '.n', '.w'):
+                entries.setdefault(base + 's' + width, (base, KIND_NONE))
+
+    def _compile_aarch64(self):
+        entries = self.entries
+        for base, kind in _AARCH64_KINDS.items():
+            entries[base] = (base, kind)
+        for condition in _CONDITIONS:
+            entries['b.' + condition] = (CONDITIONAL_JUMP if condition != 'al' else 'b', KIND_JUMP)
+            entries['bc.' + condition] = (CONDITIONAL_JUMP if condition != 'al' else 'b', KIND_JUMP)
+
+    def _classify(self, mnemonic):
+        head, dot, suffix = mnemonic.partition('.')
+        if not dot:
+            if self.arch != NORMALIZE_AARCH64 and _IT_RE.match(mnemonic):
+                return ('it', KIND_NONE)
+            return (mnemonic, KIND_NONE)
+        if suffix in _WIDTHS:
+            return self.lookup(head) if head != mnemonic else (head, KIND_NONE)
+        # Data type suffixes (vadd.f32, vld1.8) stay part of the class
+        canonical, kind = self.lookup(head)
+        return (f"{canonical}.{suffix}", kind)
+
+    def lookup(self, mnemonic):
+        entry = self.entries.get(mnemonic)
+        if entry is None:
+            entry = self.entries[mnemonic] = self._classify(mnemonic)
+        return entry
+
+class MnemonicNormalizer:
+    """
+    Maps raw objdump mnemonics to canonical feature keys: condition codes, the
+    flag-setting "s" (ARM) and the .n/.w width suffixes are folded, so addeq, adds
+    and add.w all count as add. Conditional jumps become b.cond, calls bl/blx.
+    The branch kind (jump, call, return) replaces the branch_ops set for branch
+    detection. Covers ARM/Thumb-2 and AArch64; 'auto' picks the table per file.
+    """
+    def __init__(self, arch=NORMALIZE_ARM):
+        if arch not in NORMALIZATIONS or arch == NORMALIZE_NONE:
+            raise ValueError(f"unknown mnemonic_normalization {arch!r}, expected one of {', '.join(NORMALIZATIONS)}")
+        self.arch = arch
+        self.tables = {}
+        for table_arch in ((NORMALIZE_ARM, NORMALIZE_AARCH64) if arch == NORMALIZE_AUTO else (arch,)):
+            self.tables[table_arch] = MnemonicTable(table_arch)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Return the normalizer of mnemonic_normalization in config.yaml, or None for 'none'.
+        """
+        arch = normalization_setting(config)
+        return None if arch == NORMALIZE_NONE else cls(arch)
+
+    def table_for(self, file_type=''):
+        """
+        Return the MnemonicTable for a file with the given "file format" (elf32-littlearm, ...).
+        """
+        if self.arch != NORMALIZE_AUTO:
+            return self.tables[self.arch]
+        return self.tables[NORMALIZE_AARCH64 if 'aarch64' in file_type else NORMALIZE_ARM]
+
+    def normalize(self, mnemonic, file_type=''):
+        return self.table_for(file_type).lookup(mnemonic)[0]
@@ -0,0 +1,208 @@
+import io
+import os
+import re
+import mmap
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from AssemblyController import AssemblyController, k_file_format, k_section
+from MnemonicNormalizer import MnemonicNormalizer
+
+DEFAULT_MIN_SHARD_BYTES = 4 * 1024 * 1024
+SHARDS_PER_WORKER = 4  # more shards than workers evens out sections of different density
+
+# A line the parser treats as a code block label: "<hex address> <label>:"
+LABEL_LINE_RE = re.compile(rb'^[ \t\r\f\v]*[0-9A-Fa-f]+[ \t\r\f\v]+<[^>\n]+>:', re.M)
+# End of a label line; a literal prefix lets re skip the instruction lines quickly
+_LABEL_END_RE = re.compile(rb'>:[ \t\r\f\v]*$', re.M)
+
+def _line_at(mm, pos):
+    start = mm.rfind(b'\n', 0, pos) + 1
+    end = mm.find(b'\n', pos)
+    return start, (end if end != -1 else len(mm))
+
+def find_label_lines(mm):
+    """
+    Return the (line start, line) of every code block label line, in file order.
+    """
+    labels = []
+    for match in _LABEL_END_RE.finditer(mm):
+        start = mm.rfind(b'\n', 0, match.start()) + 1
+        line = LABEL_LINE_RE.match(mm, start)
+        if line:
+            labels.append((start, line.group()))
+    return labels
+
+def scan_headers(mm):
+    """
+    Return the sorted (line start, kind, value) of every line the parser treats as a
+    file header ('file', (file name, file type)) or a section title ('section', name).
+    """
+    headers = {}
+    for keyword in (k_file_format.encode(), k_section.encode()):
+        pos = mm.find(keyword)
+        while pos != -1:
+            start, end = _line_at(mm, pos)
+            if start not in headers:
+                line = mm[start:end].decode('utf-8', 'replace').strip()
+                # Same tests, in the same order, as AssemblyController.parseAsmLines
+                line_parts = [part.strip() for part in line.split(':')] if k_file_format in line else []
+                if len(line_parts) > 1 and k_file_format in line_parts[1]:
+                    headers[start] = ('file', AssemblyController.extract_filename_and_type(line_parts))
+                elif k_section in line and '<' not in line and '>:' not in line:
+                    headers[start] = ('section', AssemblyController.extract_section_name(line))
+            pos = mm.find(keyword, end)
+    return sorted((start, kind, value) for start, (kind, value) in headers.items())
+
+class _ParseState:
+    """
+    File header and section in effect at any byte offset, looked up from scan_headers().
+    """
+    def __init__(self, headers):
+        self.file_headers = [(pos, value) for pos, kind, value in headers if kind == 'file']
+        self.section_headers = [(pos, value) for pos, kind, value in headers if kind == 'section']
+        self.file_positions = [pos for pos, _ in self.file_headers]
+        self.section_positions = [pos for pos, _ in self.section_headers]
+
+    def file_at(self, pos):
+        index = bisect_left(self.file_positions, pos) - 1
+        return self.file_headers[index] if index >= 0 else (None, None)
+
+    def section_at(self, pos):
+        """
+        Return (section header position, section name, file header position owning the section).
+        """
+        index = bisect_left(self.section_positions, pos) - 1
+        if index < 0:
+            return None, None, None
+        section_pos, section_name = self.section_headers[index]
+        return section_pos, section_name, self.file_at(section_pos)[0]
+
+def find_shards(file_path, shard_count, selected_sections=None, min_shard_bytes=DEFAULT_MIN_SHARD_BYTES):
+    """
+    Split an objdump file at code block labels into at most shard_count byte ranges.
+    Returns [(start, end, context)]; context (None for the first shard) is the parser
+    state a serial parse would have at the shard start, as expected by parseAsmLines.
+    """
+    size = os.path.getsize(file_path)
+    shard_count = max(1, min(shard_count, size // max(1, min_shard_bytes)))
+    if shard_count == 1:
+        return [(0, size, None)]
+
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        state = _ParseState(scan_headers(mm))
+
+        def selected_section_at(pos):
+            section_pos, section_name, owner = state.section_at(pos)
+            if section_pos is None or state.file_at(section_pos)[0] is None:
+                return None
+            if selected_sections and section_name not in selected_sections:
+                return None
+            return section_name, owner
+
+        # The first label inside a selected section sets section_addr for its section only
+        first_label = None
+        for match in LABEL_LINE_RE.finditer(mm):
+            section = selected_section_at(match.start())
+            if section is not None:
+                first_label = (match.start(), int(match.group().split()[0], 16), section)
+                break
+
+        boundaries = []
+        for index in range(1, shard_count):
+            match = LABEL_LINE_RE.search(mm, size * index // shard_count)
+            if match and (not boundaries or match.start() > boundaries[-1]):
+                boundaries.append(match.start())
+
+        shards, start, context = [], 0, None
+        for boundary in boundaries:
+            shards.append((start, boundary, context))
+            file_pos, file_header = state.file_at(boundary)
+            section_pos, section_name, owner = state.section_at(boundary)
+            first_cb_seen = first_label is not None and first_label[0] < boundary
+            section_addr = 0
+            if first_cb_seen and first_label[2] == (section_name, owner):
+                section_addr = first_label[1]
+            context = {
+                "file": file_header,
+                "in_section": section_pos is not None,
+                "section": section_name,
+                "section_addr": section_addr,
+                "first_cb_seen": first_cb_seen,
+            }
+            start = boundary
+        shards.append((start, size, context))
+    return shards
+
+def _parse_shard(file_path, start, end, context, branch_ops, used_op_asm, selected_sections, instruction_rows=True,
+                 normalization=None):
+    # The normalizer is sent by name; its tables are rebuilt in the worker
+    controller = AssemblyController(branch_ops, used_op_asm, selected_sections, columnar=True,
+                                    instruction_rows=instruction_rows,
+                                    normalizer=MnemonicNormalizer(normalization) if normalization else None)
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # Same decoding and newline handling as open(file_path, 'r') in the serial parser
+    lines = io.TextIOWrapper(io.BytesIO(data))
+    line_count = 0
+
+    def counted():
+        nonlocal line_count
+        for line in lines:
+            line_count += 1
+            yield line
+
+    asm_meta = controller.parseAsmLines(counted(), context)
+    return asm_meta, line_count
+
+def merge_shard(merged, shard_meta, context):
+    """
+    Append one shard result to the merged {file name: ArmFileInfo}, in file order.
+    """
+    items = iter(shard_meta.items())
+    if context and context["file"] and context["file"][0] in shard_meta:
+        # The shard continues the file that was open at its first line
+        file_name, file_info = next(items)
+        merged[file_name].merge(file_info)
+    for file_name, file_info in items:
+        merged[file_name] = file_info
+    return merged
+
+def parse_file_sharded(controller, file_path, workers=None, executor=None, min_shard_bytes=DEFAULT_MIN_SHARD_BYTES):
+    """
+    Parse one large .asm file on several processes with the settings of controller
+    (which must use columnar storage). Returns (asm_meta, line count); the offset
+    lists are identical to controller.parseAsmFile(file_path).
+    """
+    if not controller.columnar:
+        raise ValueError("sharded parsing needs a columnar AssemblyController")
+    workers = workers or os.cpu_count() or 1
+    shards = find_shards(file_path, workers * SHARDS_PER_WORKER, controller.selected_sections, min_shard_bytes)
+    args = (controller.branch_ops, controller.used_op_asm, controller.selected_sections, controller.instruction_rows,
+            controller.normalizer.arch if controller.normalizer else None)
+    if len(shards) == 1:
+        asm_meta, line_count = _parse_shard(file_path, 0, shards[0][1], None, *args)
+        if controller.build_cfg:
+            for file_info in asm_meta.values():
+                file_info.build_cfg()
+        return asm_meta, line_count
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = [executor.submit(_parse_shard, file_path, start, end, context, *args) for start, end, context in shards]
+        merged, line_count = {}, 0
+        # Merge strictly in shard order so the offset lists keep the serial order
+        for (_, _, context), future in zip(shards, futures):
+            shard_meta, shard_lines = future.result()
+            merge_shard(merged, shard_meta, context)
+            line_count += shard_lines
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
+    if controller.build_cfg:
+        # Branches cross shard boundaries, so the graph is built on the merged result
+        for file_info in merged.values():
+            file_info.build_cfg()
+    return merged, line_count
@@ -0,0 +1,220 @@
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+from array import array
+from FeatureHasher import FeatureHasher, HASH_JSON_V1
+
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_DIR = "./output/parse_cache/"
+DEFAULT_CACHE_MAX_MB = 2048
+DIGEST_CHUNK_SIZE = 1 << 20
+RESCAN_FRACTION = 16  # rescan the cache after writing this fraction of its size, for the writes of other processes
+
+# cache_dir -> [estimated total bytes, bytes written since the last scan], per process
+_cache_sizes = {}
+
+def file_digest(path, member=None):
+    """
+    SHA-256 of the input file. For a 7z archive the member name is mixed in, so the
+    digest of the compressed archive identifies the member without decompressing it.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DIGEST_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    if member is not None:
+        return member_digest(digest.hexdigest(), member)
+    return digest.hexdigest()
+
+def member_digest(archive_digest, member):
+    return hashlib.sha256(f"{archive_digest}\0{member}".encode('utf-8')).hexdigest()
+
+class CachedFileInfo:
+    """
+    The feature-relevant part of an ArmFileInfo: per-opcode offset columns and their hashes.
+    Provides the same iter_op_asm_offset_lists() as ArmFileInfo, so the feature writers
+    and the MinHash sketcher accept either. hash_version is the FeatureHasher version
+    of op_asm_hashes.
+    """
+    __slots__ = ('file_name', 'op_asm_offset_columns', 'op_asm_hashes', 'hash_version')
+
+    def __init__(self, file_name, op_asm_offset_columns, op_asm_hashes, hash_version=HASH_JSON_V1):
+        self.file_name = file_name
+        self.op_asm_offset_columns = op_asm_offset_columns  # keyword -> (cb, op, b_target) array('q') columns
+        self.op_asm_hashes = op_asm_hashes                  # keyword -> SHA-256 hex digest
+        self.hash_version = hash_version
+
+    @classmethod
+    def from_file_info(cls, file_info, hasher=None):
+        hasher = hasher or FeatureHasher()
+        columns = getattr(file_info, "op_asm_offset_columns", None)
+        if not columns:
+            columns = {}
+            for op_asm_keyword, offsetlist in file_info.iter_op_asm_offset_lists():
+                columns[op_asm_keyword] = (
+                    array('q', (offsets[0] for offsets in offsetlist)),
+                    array('q', (offsets[1] for offsets in offsetlist)),
+                    array('q', (offsets[2] for offsets in offsetlist)),
+                )
+        hashes = {op_asm_keyword: hasher.hash_columns(*keyword_columns) for op_asm_keyword, keyword_columns in columns.items()}
+        return cls(file_info.file_name, columns, hashes, hasher.version)
+
+    def iter_op_asm_offset_lists(self):
+        for op_asm_keyword, (cb_offsets, op_offsets, b_target_offsets) in self.op_asm_offset_columns.items():
+            yield op_asm_keyword, list(zip(cb_offsets, op_offsets, b_target_offsets))
+
+    def iter_op_asm_hashes(self):
+        yield from self.op_asm_hashes.items()
+
+    def __getstate__(self):
+        return (self.file_name, self.op_asm_offset_columns, self.op_asm_hashes, self.hash_version)
+
+    def __setstate__(self, state):
+        if len(state) == 3:  # entries written before hash versions existed
+            state = state + (HASH_JSON_V1,)
+        self.file_name, self.op_asm_offset_columns, self.op_asm_hashes, self.hash_version = state
+
+def cache_asm_metadata(asm_metadata, hasher=None):
+    """
+    Convert the parser result {file name: ArmFileInfo} to {file name: CachedFileInfo}.
+    """
+    return {name: file_info if isinstance(file_info, CachedFileInfo) else CachedFileInfo.from_file_info(file_info, hasher)
+            for name, file_info in asm_metadata.items()}
+
+class ParseCache:
+    """
+    Content-addressed on-disk cache of parse results.
+    Entries are keyed by the input digest and the parser settings that change the
+    offsets (branch_ops, select_sections, used_op_asm). Writes go through a temporary
+    file and os.replace, so concurrent workers never see partial entries. A hit bumps
+    the entry mtime and put() evicts the least recently used entries beyond max_bytes.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Return the cache configured in config.yaml, or None if parse_cache is disabled.
+        """
+        if config.get("parse_cache", 'disable') != 'enable':
+            return None
+        return cls(config.get("parse_cache_dir", DEFAULT_CACHE_DIR),
+                   int(config.get("parse_cache_max_mb", DEFAULT_CACHE_MAX_MB)) * 1024 * 1024)
+
+    @staticmethod
+    def key(input_digest, controller):
+        settings = {
+            "version": CACHE_FORMAT_VERSION,
+            "input": input_digest,
+            "branch_ops": sorted(controller.branch_ops),
+            "select_sections": sorted(controller.selected_sections or []),
+            "used_op_asm": bool(controller.used_op_asm),
+        }
+        if controller.normalizer:
+            settings["mnemonic_normalization"] = controller.normalizer.arch
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".pkl")
+
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # Truncated or foreign file: treat as a miss, the next put() replaces it
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, cached_metadata):
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(cached_metadata, f, protocol=pickle.HIGHEST_PROTOCOL)
+                written = f.tell()
+            try:
+                written -= os.path.getsize(path)  # replacing an entry
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.account(written)
+
+    def account(self, written):
+        """
+        Add a write to the running size of the cache; the directory is only scanned
+        (and evicted) once that size passes max_bytes, on the first write of the
+        process, and after every max_bytes / RESCAN_FRACTION bytes written, so that
+        the entries written by other workers are counted too.
+        """
+        size = _cache_sizes.get(self.cache_dir)
+        if size is None:
+            self.evict()
+            return
+        size[0] += written
+        size[1] += written
+        if size[0] > self.max_bytes or size[1] > self.max_bytes // RESCAN_FRACTION:
+            self.evict()
+
+    def entries(self):
+        """
+        Return [(mtime, size, path)] of every cache entry.
+        """
+        entries = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(".pkl"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:  # removed by another worker
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            # Evict a little below the limit, so the next writes do not each trigger a scan
+            low_water = self.max_bytes - self.max_bytes // RESCAN_FRACTION
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                if total <= low_water:
+                    break
+        _cache_sizes[self.cache_dir] = [total, 0]
+
+    def load_or_parse(self, input_digest, controller, parse, hasher=None):
+        """
+        Return the cached {file name: CachedFileInfo} for the input, calling parse()
+        to produce the parser result on a miss. The stored hashes are made with hasher;
+        entries hashed with another version still serve their offset columns.
+        """
+        key = self.key(input_digest, controller)
+        cached_metadata = self.get(key)
+        if cached_metadata is None:
+            cached_metadata = cache_asm_metadata(parse(), hasher)
+            self.put(key, cached_metadata)
+        return cached_metadata
@@ -0,0 +1,237 @@
+import io
+import time
+import queue
+import contextlib
+import threading
+import py7zr
+
+try:
+    from py7zr.io import Py7zIO, WriterFactory
+except ImportError:  # py7zr < 0.22 has no writer factories; members are read one at a time instead
+    Py7zIO = WriterFactory = None
+
+STREAM_CHUNK_SIZE = 1 << 20  # py7zr hands over blocks of up to 128 MB; they are queued in slices of this size
+STREAM_QUEUE_CHUNKS = 8      # slices buffered between the 7z thread and the parser
+_END_OF_MEMBER = None
+
+class ExtractionCancelled(Exception):
+    pass
+
+class _MemberPipe(io.RawIOBase):
+    """
+    Read side of one archive member: bytes written by the extraction thread are
+    handed over through a bounded queue, so only a few chunks are ever buffered.
+    """
+    def __init__(self, name, expected_size, cancelled):
+        self.name = name
+        self.expected_size = expected_size
+        self.cancelled = cancelled
+        self.chunks = queue.Queue(STREAM_QUEUE_CHUNKS)
+        self.buffer = memoryview(b'')
+        self.written = 0
+        self.ended = False
+        self.eof = False
+        self.wait_seconds = 0.0  # time the parser spent waiting for decompressed data
+
+    # -- writer side (extraction thread) --
+    def put(self, item):
+        while True:
+            if self.cancelled.is_set():
+                raise ExtractionCancelled(self.name)
+            try:
+                self.chunks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def feed(self, data):
+        view = memoryview(data if isinstance(data, bytes) else bytes(data))
+        for start in range(0, len(view), STREAM_CHUNK_SIZE):
+            self.put(view[start:start + STREAM_CHUNK_SIZE])
+        self.written += len(view)
+        if self.written == self.expected_size:
+            self.finish()
+
+    def finish(self):
+        if not self.ended:
+            self.ended = True
+            self.put(_END_OF_MEMBER)
+
+    # -- reader side (parser thread) --
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            if self.eof:
+                return 0
+            start = time.perf_counter()
+            chunk = self.chunks.get()
+            self.wait_seconds += time.perf_counter() - start
+            if isinstance(chunk, BaseException):
+                raise chunk
+            if chunk is _END_OF_MEMBER:
+                self.eof = True
+                return 0
+            self.buffer = memoryview(chunk)
+        size = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+    def drain(self):
+        while self.readinto(bytearray(1 << 16)):
+            pass
+
+if WriterFactory is not None:
+    class _PipeWriter(Py7zIO):
+        def __init__(self, pipe):
+            self.pipe = pipe
+
+        def write(self, s):
+            self.pipe.feed(s)
+            return len(s)
+
+        def read(self, size=None):
+            return b''
+
+        def seek(self, offset, whence=0):
+            return self.pipe.written
+
+        def flush(self):
+            pass
+
+        def size(self):
+            return self.pipe.written
+
+        def close(self):
+            self.pipe.finish()
+
+    class _PipeWriterFactory(WriterFactory):
+        """
+        Creates one pipe per member, in the order py7zr decompresses them.
+        """
+        def __init__(self, member_sizes, members, cancelled):
+            self.member_sizes = member_sizes
+            self.members = members
+            self.cancelled = cancelled
+            self.current = None
+
+        def create(self, filename):
+            if self.current is not None:
+                # py7zr before the Py7zIO.close() hook never signals the end of a member
+                self.current.finish()
+            self.current = _MemberPipe(filename, self.member_sizes.get(filename), self.cancelled)
+            self.members.put(self.current)
+            return _PipeWriter(self.current)
+
+def list_asm_members(archive_path):
+    """
+    Return the names of the .asm members of a 7z archive without decompressing anything.
+    """
+    with py7zr.SevenZipFile(archive_path, mode='r') as archive:
+        return [info.filename for info in archive.list()
+                if not info.is_directory and info.filename.endswith('.asm')]
+
+class SevenZipAsmReader:
+    """
+    Iterate over (member name, text stream) for the selected .asm members of a 7z archive.
+
+    Only the requested members are decompressed. Extraction runs on a background
+    thread and each member reaches the parser as a UTF-8 stream decoded incrementally
+    from a bounded queue, so memory depends on the queue size rather than on the size
+    of a member or of the archive. Every stream has to be consumed (or abandoned)
+    before the next one is produced; unread data is skipped automatically.
+    wait_seconds adds up the time spent waiting for (or in) decompression.
+    """
+    def __init__(self, archive_path, targets=None, encoding='utf-8'):
+        self.archive_path = archive_path
+        self.targets = targets
+        self.encoding = encoding
+        self.read_wait_seconds = 0.0  # members read without streaming, or already consumed
+        self.current_pipe = None
+
+    @property
+    def wait_seconds(self):
+        return self.read_wait_seconds + (self.current_pipe.wait_seconds if self.current_pipe else 0.0)
+
+    def __iter__(self):
+        targets = self.targets if self.targets is not None else list_asm_members(self.archive_path)
+        if not targets:
+            return iter(())
+        if WriterFactory is None:
+            return self._iter_read_members(targets)
+        return self._iter_streamed_members(targets)
+
+    def _iter_read_members(self, targets):
+        # Old py7zr: read(targets=...) decompresses a single member into a BytesIO
+        for target in targets:
+            start = time.perf_counter()
+            with py7zr.SevenZipFile(self.archive_path, mode='r') as archive:
+                members = archive.read(targets=[target])
+            self.read_wait_seconds += time.perf_counter() - start
+            if target not in members:
+                raise FileNotFoundError(f"{target} not found in {self.archive_path}")
+            yield target, io.TextIOWrapper(members.pop(target), encoding=self.encoding)
+
+    def _iter_streamed_members(self, targets):
+        cancelled = threading.Event()
+        members = queue.Queue()
+
+        factory = None
+
+        def extract():
+            nonlocal factory
+            try:
+                # Passing an open file keeps py7zr on a single thread, which decompresses
+                # the members in order instead of one thread per folder in parallel.
+                with open(self.archive_path, 'rb') as fp, py7zr.SevenZipFile(fp, mode='r') as archive:
+                    member_sizes = {info.filename: info.uncompressed for info in archive.list()}
+                    missing = [target for target in targets if target not in member_sizes]
+                    if missing:
+                        raise FileNotFoundError(f"{', '.join(missing)} not found in {self.archive_path}")
+                    factory = _PipeWriterFactory(member_sizes, members, cancelled)
+                    archive.extract(targets=targets, factory=factory)
+                if factory.current is not None:
+                    factory.current.finish()
+                members.put(_END_OF_MEMBER)
+            except ExtractionCancelled:
+                pass
+            except BaseException as e:
+                # Wake up a parser blocked on the member being written as well
+                if factory is not None and factory.current is not None and not factory.current.ended:
+                    with contextlib.suppress(ExtractionCancelled):
+                        factory.current.put(e)
+                members.put(e)
+
+        thread = threading.Thread(target=extract, name="7z-extract", daemon=True)
+        thread.start()
+        try:
+            while True:
+                pipe = members.get()
+                if isinstance(pipe, BaseException):
+                    raise pipe
+                if pipe is _END_OF_MEMBER:
+                    break
+                self.current_pipe = pipe
+                yield pipe.name, io.TextIOWrapper(io.BufferedReader(pipe), encoding=self.encoding)
+                pipe.drain()
+                self.read_wait_seconds += pipe.wait_seconds
+                self.current_pipe = None
+        finally:
+            cancelled.set()
+            thread.join()
+
+@contextlib.contextmanager
+def open_asm_member(archive_path, target_filename):
+    """
+    Context manager yielding a text stream over a single .asm member of a 7z archive.
+    """
+    members = iter(SevenZipAsmReader(archive_path, [target_filename]))
+    try:
+        for _, stream in members:
+            yield stream
+            return
+        raise FileNotFoundError(f"{target_filename} not found in {archive_path}")
+    finally:
+        members.close()
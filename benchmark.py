@@ -0,0 +1,246 @@
+import os
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import contextlib
+import multiprocessing
+from queue import Empty
+from pathlib import Path
+from synthetic_objdump import generate_objdump, parse_branch_mix
+
+BENCHMARK_DIR = "./output/benchmarks/"
+RESULT_POLL_SECONDS = 1.0
+BENCHMARK_BRANCH_OPS = {
+    'b', 'bl', 'blcc', 'blcs', 'ble.n', 'ble.w', 'bleq', 'blge', 'blls', 'bllt', 'blmi', 'blne',
+    'bls.n', 'bls.w', 'blt.n', 'blt.w', 'blvs', 'blx'
+}
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def make_controller(columnar):
+    from AssemblyController import AssemblyController
+    return AssemblyController(BENCHMARK_BRANCH_OPS, True, None, columnar=columnar)
+
+# Each stage returns (setup, run): setup prepares untimed inputs, run(inputs) is timed.
+def stage_parse_objects(workload):
+    return (lambda: None, lambda _: make_controller(False).parseAsmFile(workload["asm_path"]))
+
+def stage_parse_columnar(workload):
+    return (lambda: None, lambda _: make_controller(True).parseAsmFile(workload["asm_path"]))
+
+def stage_parse_sharded(workload):
+    from ParallelParser import parse_file_sharded
+    return (lambda: None, lambda _: parse_file_sharded(make_controller(True), workload["asm_path"], workload["workers"]))
+
+def stage_coverage(workload):
+    return (lambda: None, lambda _: make_controller(False).parseAsmForOpcodeCoverageRate(workload["asm_path"], None))
+
+def stage_feature_hash(workload, version=None):
+    from FeatureExtraction import write_feature_csv
+    from FeatureHasher import FeatureHasher, DEFAULT_FEATURE_HASH
+    hasher = FeatureHasher(version or DEFAULT_FEATURE_HASH)
+
+    def run(asm_metadata):
+        write_feature_csv(asm_metadata, os.path.join(workload["tmp_dir"], "bench_feature.csv"), hasher)
+
+    return (lambda: make_controller(True).parseAsmFile(workload["asm_path"]), run)
+
+def stage_feature_hash_packed(workload):
+    from FeatureHasher import HASH_PACKED_V2
+    return stage_feature_hash(workload, HASH_PACKED_V2)
+
+def stage_classify(workload):
+    from FeatureIndex import FeatureIndex
+    from classify_asm_by_feature import classify_asm_file
+
+    def run(index):
+        with contextlib.redirect_stdout(io.StringIO()):
+            classify_asm_file(Path(workload["asm_path"]), index, make_controller(True))
+
+    return (lambda: FeatureIndex.open(workload["reference_dir"], os.path.join(workload["tmp_dir"], "index.pkl")), run)
+
+STAGES = {
+    "parse_objects": stage_parse_objects,
+    "parse_columnar": stage_parse_columnar,
+    "parse_sharded": stage_parse_sharded,
+    "coverage": stage_coverage,
+    "feature_hash": stage_feature_hash,
+    "feature_hash_packed": stage_feature_hash_packed,
+    "classify": stage_classify,
+}
+
+def run_stage(stage, workload, repeat, queue):
+    """
+    Child-process body: time the stage, then repeat it once under tracemalloc.
+    Running every stage in a fresh process keeps the peak RSS of one stage from
+    leaking into the next.
+    """
+    try:
+        setup, run = STAGES[stage](workload)
+        inputs = setup()
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run(inputs)
+            timings.append(time.perf_counter() - start)
+        rss = peak_rss_mb()
+
+        tracemalloc.start()
+        run(inputs)
+        current, peak = tracemalloc.get_traced_memory()
+        blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        tracemalloc.stop()
+
+        best = min(timings)
+        queue.put({
+            "seconds": best,
+            "seconds_all": timings,
+            "lines_per_second": workload["lines"] / best,
+            "mb_per_second": workload["bytes"] / (1024 * 1024) / best,
+            "peak_rss_mb": rss,
+            "traced_peak_mb": peak / (1024 * 1024),
+            "traced_live_blocks": blocks,
+        })
+    except Exception as e:
+        queue.put({"error": f"{type(e).__name__}: {e}"})
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def prepare_workload(args, tmp_dir):
+    asm_path = os.path.join(tmp_dir, "bench.asm")
+    with open(asm_path, 'w') as f:
+        lines = generate_objdump(f, args.sections, args.labels, args.instructions, args.branch_ratio,
+                                 args.branch_mix, args.undefined_ratio, args.seed)
+
+    # Reference feature set for the classify stage: a few other synthetic images plus the query itself.
+    reference_dir = os.path.join(tmp_dir, "references")
+    os.makedirs(reference_dir)
+    from FeatureExtraction import write_feature_csv
+    for index in range(args.references):
+        ref_path = os.path.join(tmp_dir, f"ref{index}.asm")
+        with open(ref_path, 'w') as f:
+            generate_objdump(f, args.sections, args.labels, args.instructions // 4, args.branch_ratio,
+                             args.branch_mix, args.undefined_ratio, args.seed + index + 1, f"Ref{index}")
+        write_feature_csv(make_controller(True).parseAsmFile(ref_path), os.path.join(reference_dir, f"ref{index}.csv"))
+        os.remove(ref_path)
+    write_feature_csv(make_controller(True).parseAsmFile(asm_path), os.path.join(reference_dir, "bench.csv"))
+
+    return {
+        "asm_path": asm_path,
+        "tmp_dir": tmp_dir,
+        "reference_dir": reference_dir,
+        "lines": lines,
+        "bytes": os.path.getsize(asm_path),
+        "workers": args.workers or os.cpu_count() or 1,
+    }
+
+def compare_results(current, baseline):
+    print(f"\nComparison with {baseline.get('revision', '?')} ({baseline.get('timestamp', '?')}):")
+    for stage, result in current["results"].items():
+        base = baseline.get("results", {}).get(stage)
+        if not base or "error" in base or "error" in result:
+            continue
+        ratio = result["lines_per_second"] / base["lines_per_second"]
+        print(f"  {stage:20s} {base['lines_per_second']:>12,.0f} -> {result['lines_per_second']:>12,.0f} lines/s  ({ratio:.2f}x)")
+
+def wait_for_result(process, queue):
+    """
+    Wait for the result of a stage process. A child that dies without reporting
+    (killed by the OOM killer, a crash in an extension) is reported as a failed stage
+    instead of leaving the harness blocked on the queue.
+    """
+    while True:
+        try:
+            return queue.get(timeout=RESULT_POLL_SECONDS)
+        except Empty:
+            if process.is_alive():
+                continue
+        # The child may have put its result just before exiting
+        try:
+            return queue.get(timeout=RESULT_POLL_SECONDS)
+        except Empty:
+            return {"error": f"stage process exited with code {process.exitcode} without a result"}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing, coverage, feature hashing and classification.")
+    parser.add_argument("--sections", type=int, default=4)
+    parser.add_argument("--labels", type=int, default=2000)
+    parser.add_argument("--instructions", type=int, default=200000)
+    parser.add_argument("--branch-ratio", type=float, default=0.1)
+    parser.add_argument("--branch-mix", type=parse_branch_mix, default=None, help="e.g. bl=4,b.n=3,blx=1")
+    parser.add_argument("--undefined-ratio", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--references", type=int, default=8, help="reference projects for the classify stage")
+    parser.add_argument("--workers", type=int, default=None, help="processes for the parse_sharded stage (default: CPU count)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated subset of " + ",".join(STAGES))
+    parser.add_argument("--output-dir", default=BENCHMARK_DIR)
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output_dir", "compare", "stages")},
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workload = prepare_workload(args, tmp_dir)
+        report["params"]["lines"] = workload["lines"]
+        report["params"]["bytes"] = workload["bytes"]
+        print(f"Workload: {workload['lines']:,} lines, {workload['bytes'] / (1024 * 1024):.1f} MB")
+        for stage in stages:
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=run_stage, args=(stage, workload, args.repeat, queue))
+            process.start()
+            result = wait_for_result(process, queue)
+            process.join()
+            report["results"][stage] = result
+            if "error" in result:
+                print(f"  {stage:20s} failed: {result['error']}")
+                continue
+            rss = f"{result['peak_rss_mb']:.0f} MB" if result['peak_rss_mb'] is not None else "n/a"
+            print(f"  {stage:20s} {result['seconds']:8.3f}s {result['lines_per_second']:>12,.0f} lines/s "
+                  f"{result['mb_per_second']:7.2f} MB/s  peak RSS {rss:>7s}  traced peak {result['traced_peak_mb']:.1f} MB")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    result_file = os.path.join(args.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{report['revision']}.json")
+    with open(result_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {result_file}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare_results(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -1,72 +1,127 @@
-import csv
-import json
-import hashlib
 import sys
+import argparse
 from pathlib import Path
 from AssemblyController import AssemblyController
+from FeatureIndex import RANK_METRICS, FeatureIndex, FeatureMatcher, feature_csv_files, read_feature_csv
+from FeatureStore import FeatureStore
+from FeatureCorpus import FeatureCorpus
+from FuzzyFeatures import DEFAULT_SKETCH_SIZE, DEFAULT_LSH_BANDS, SketchIndex, sketch_asm_metadata
+from ParseCache import ParseCache, file_digest
+from Metrics import metrics, configure_metrics
+from FeatureHasher import FeatureHasher
+from MnemonicNormalizer import MnemonicNormalizer
 import yaml
 
 def load_config(config_path: Path):
     with open(config_path, 'r') as f:
         return yaml.safe_load(f)
 
-def hash_offset_list(offset_list):
-    canonical_str = json.dumps(offset_list, sort_keys=True, separators=(',', ':'))
-    return hashlib.sha256(canonical_str.encode('utf-8')).hexdigest()
+def build_controller(config):
+    return AssemblyController(
+        set(config.get("branch_ops", [])),
+        True,
+        config.get("select_sections", []),
+        columnar=True,
+        normalizer=MnemonicNormalizer.from_config(config)
+    )
 
-def process_asm_file(asm_path, controller):
-    with open(asm_path, 'r') as f:
-        content = f.read()
-    result = controller.parseAsmCodes(content)
+def hash_asm_metadata(result, hasher: FeatureHasher = None):
+    hasher = hasher or FeatureHasher()
     opcode_hash = {}
     for _, file_info in result.items():
-        for opcode, offsetlist in file_info.op_asm_offset_list.items():
-            opcode_hash[opcode] = hash_offset_list(offsetlist)
+        opcode_hash.update(hasher.iter_hashes(file_info))
     return opcode_hash
 
+def parse_asm_file(asm_path, controller, parse_cache: ParseCache = None, hasher: FeatureHasher = None):
+    if parse_cache is None:
+        return controller.parseAsmFile(asm_path)
+    return parse_cache.load_or_parse(file_digest(asm_path), controller, lambda: controller.parseAsmFile(asm_path), hasher)
+
+def process_asm_file(asm_path, controller, parse_cache: ParseCache = None, hasher: FeatureHasher = None):
+    return hash_asm_metadata(parse_asm_file(asm_path, controller, parse_cache, hasher), hasher)
+
+def sketch_asm_file(asm_path, controller, sketch_size=DEFAULT_SKETCH_SIZE, parse_cache: ParseCache = None):
+    return sketch_asm_metadata(parse_asm_file(asm_path, controller, parse_cache), sketch_size)
+
 def load_project_features(feature_dir: Path):
     feature_sets = {}
-    for csv_file in feature_dir.glob("*.csv"):
-        project = csv_file.stem
-        features = {}
-        with open(csv_file, 'r') as f:
-            reader = csv.reader(f)
-            next(reader)  # Skip header
-            for row in reader:
-                if len(row) == 2:
-                    opcode, hashval = row
-                    features[opcode] = hashval
-        feature_sets[project] = features
+    for csv_file in feature_csv_files(feature_dir):
+        feature_sets[csv_file.stem] = read_feature_csv(csv_file)
     return feature_sets
 
-def classify_asm_file(asm_path: Path, all_project_features, controller):
-    asm_features = process_asm_file(asm_path, controller)
+def open_reference_index(feature_dir: Path, feature_store: Path = None, compact=False):
+    if feature_store and feature_store.exists():
+        # Memory-mapped binary store built with `FeatureStore.py import`
+        return FeatureStore(feature_store)
+    if compact:
+        # Deduplicated corpus (feature_corpus: enable): each (opcode, hash) once, projects as id arrays
+        return FeatureCorpus.from_csv_dir(feature_dir)
+    # Persisted inverted index, refreshed incrementally for added/changed CSVs
+    return FeatureIndex.open(feature_dir)
+
+def load_reference_index(config, feature_dir: Path, feature_store: Path = None):
+    """
+    Load the references as configured: MinHash sketches (feature_mode: minhash) or the
+    exact features, which must be hashed with the feature_hash of the queries.
+    """
+    if config.get("feature_mode", 'exact') == 'minhash':
+        # Fuzzy mode: per-opcode MinHash sketches looked up through LSH buckets
+        return SketchIndex.from_csv_dir(
+            feature_dir, config.get("minhash_size", DEFAULT_SKETCH_SIZE), config.get("lsh_bands", DEFAULT_LSH_BANDS)
+        )
+    index = open_reference_index(feature_dir, feature_store, config.get("feature_corpus", 'disable') == 'enable')
+    try:
+        index.check_hash_version(FeatureHasher.from_config(config).version)
+    except ValueError:
+        if hasattr(index, "close"):
+            index.close()
+        raise
+    return index
+
+def rank_features(index, features, top_k=5, metric="containment"):
+    if isinstance(index, SketchIndex):
+        # Sketches only estimate the containment of the reference
+        return index.rank(features, top_k)
+    return index.rank(features, top_k, metric)
+
+def classify_asm_file(asm_path: Path, index: FeatureMatcher, controller, parse_cache: ParseCache = None,
+                      hasher: FeatureHasher = None, top_k=5, metric="containment"):
+    """
+    Return the top_k reference projects for one .asm file as dicts, best first.
+    """
+    with metrics.stage("parse"):
+        asm_metadata = parse_asm_file(asm_path, controller, parse_cache, hasher)
+    metrics.record_asm_metadata(asm_metadata)
+    with metrics.stage("hash"):
+        if isinstance(index, SketchIndex):
+            asm_features = sketch_asm_metadata(asm_metadata, index.sketch_size)
+        else:
+            asm_features = hash_asm_metadata(asm_metadata, hasher)
     print(f"🔍 分析結果：{len(asm_features)} 個操作碼特徵")
-    best_match = None
-    best_score = -1
-
-    for project, features in all_project_features.items():
-        matched = 0
-        total = len(features)
-        #print(f"🔍 比對專案：{project}，特徵數量：{total}")
-        for opcode, hashval in features.items():
-            if opcode in asm_features and asm_features[opcode] == hashval:
-                matched += 1
-        #print(f"🔍 專案 {project} 匹配：{matched}/{total} ({matched/total*100:.2f}%)")
-        if total > 0:
-            similarity = matched / total
-            if similarity > best_score:
-                best_match = (project, similarity, matched, total)
-                best_score = similarity
-
-    return best_match
+    # Only projects sharing at least one (opcode, hash) with the query are scored.
+    with metrics.stage("classify"):
+        return rank_features(index, asm_features, top_k, metric)
+
+def print_matches(matches):
+    if not matches:
+        print("❌ 無比對結果。")
+        return
+    for rank, match in enumerate(matches, 1):
+        mark = "✅ 完全符合" if match["similarity"] == 1.0 else "📌 相近專案"
+        line = f"{mark} {rank}. {match['project']} - 相似度 {match['similarity']:.2%} ({match['matched']}/{match['total']})"
+        if "jaccard" in match:
+            line += (f", query {match['query_containment']:.2%}, jaccard {match['jaccard']:.2%},"
+                     f" weighted {match['weighted']:.2%}")
+        print(line)
 
 def main():
-    if len(sys.argv) < 2:
-        print("❌ 請提供 .asm 檔案的完整路徑作為參數。")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Classify one .asm file against the reference features.")
+    parser.add_argument("asm_path", help=".asm file to classify")
+    parser.add_argument("--top-k", type=int, default=5, help="number of ranked projects to print")
+    parser.add_argument("--metric", default="containment", choices=RANK_METRICS, help="ranking order")
+    args = parser.parse_args()
 
-    asm_path = Path(sys.argv[1])
+    asm_path = Path(args.asm_path)
     if not asm_path.exists() or not asm_path.is_file():
         print(f"❌ 找不到檔案：{asm_path}")
         sys.exit(1)
@@ -77,25 +132,25 @@ def main():
     config_path = root / "config.yaml"
 
     config = load_config(config_path)
-    controller = AssemblyController(
-        set(config.get("branch_ops", [])),
-        True,
-        config.get("select_sections", [])
-    )
-
-    all_project_features = load_project_features(feature_dir)
+    metrics_file = configure_metrics(config)
+    controller = build_controller(config)
+    parse_cache = ParseCache.from_config(config)
+    with metrics.stage("load_references"):
+        try:
+            index = load_reference_index(config, feature_dir, root / "output" / "mini_feature.fstore")
+        except ValueError as e:
+            print(f"❌ 發生錯誤：{e}")
+            sys.exit(1)
 
     print(f"🔍 分析檔案：{asm_path.name}")
     try:
-        result = classify_asm_file(asm_path, all_project_features, controller)
-        if result and result[1] == 1.0:
-            print(f"✅ 完全符合：{result[0]}")
-        elif result:
-            print(f"📌 最接近專案：{result[0]}")
-        else:
-            print("❌ 無比對結果。")
+        matches = classify_asm_file(asm_path, index, controller, parse_cache, FeatureHasher.from_config(config),
+                                    args.top_k, args.metric)
+        print_matches(matches)
     except Exception as e:
         print(f"❌ 發生錯誤：{e}")
+    if metrics_file:
+        metrics.write(metrics_file)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
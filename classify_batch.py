@@ -0,0 +1,218 @@
+# Batch classification of many unknown images against one loaded reference set.
+#
+#   python3 classify_batch.py ./dump/ -o output/classify_results.csv --top-k 5
+#   python3 classify_batch.py --list unknown_files.txt -o output/classify_results.jsonl
+#
+# The references are loaded once; the queries are parsed and hashed on a process pool
+# and every result is written (CSV or JSON lines, by the output extension) as soon as it
+# is scored. At most 2 * jobs queries are in flight, so memory does not grow with the batch.
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from classify_asm_by_feature import (load_config, build_controller, parse_asm_file, hash_asm_metadata, load_reference_index,
+                                     rank_features)
+from FuzzyFeatures import DEFAULT_SKETCH_SIZE, sketch_asm_metadata
+from FeatureIndex import RANK_METRICS
+from ParseCache import ParseCache
+from FeatureHasher import FeatureHasher
+from Metrics import metrics, configure_metrics
+
+DEFAULT_RESULTS_FILE = "./output/classify_results.jsonl"
+CSV_FIELDS = ["file", "rank", "project", "similarity", "matched", "total", "features",
+              "parse_seconds", "score_seconds", "error"]
+
+_worker_controller = None
+_worker_parse_cache = None
+_worker_hasher = None
+_worker_sketch_size = None
+
+def _init_worker(config):
+    global _worker_controller, _worker_parse_cache, _worker_hasher, _worker_sketch_size
+    _worker_controller = build_controller(config)
+    _worker_parse_cache = ParseCache.from_config(config)
+    _worker_hasher = FeatureHasher.from_config(config)
+    if config.get("feature_mode", 'exact') == 'minhash':
+        _worker_sketch_size = config.get("minhash_size", DEFAULT_SKETCH_SIZE)
+    configure_metrics(config)
+    metrics.reset()  # a forked worker starts with a copy of the main process metrics
+
+def _query_features(asm_path):
+    """
+    Parse one query and return (features, parse seconds, metrics snapshot). Only the
+    {opcode: hash} (or sketch) dict goes back to the main process, not the parse result.
+    """
+    start = time.perf_counter()
+    with metrics.stage("parse"):
+        asm_metadata = parse_asm_file(asm_path, _worker_controller, _worker_parse_cache, _worker_hasher)
+    metrics.record_asm_metadata(asm_metadata)
+    with metrics.stage("hash"):
+        if _worker_sketch_size is not None:
+            features = sketch_asm_metadata(asm_metadata, _worker_sketch_size)
+        else:
+            features = hash_asm_metadata(asm_metadata, _worker_hasher)
+    del asm_metadata
+    return features, time.perf_counter() - start, metrics.snapshot() if metrics.enabled else None
+
+def iter_queries(patterns, list_files=(), recursive=False):
+    """
+    Yield the .asm paths of directories, glob patterns, plain paths and list files
+    (one path per line, '#' comments allowed). List files are read lazily.
+    """
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            if recursive:
+                for dir_path, _, file_names in os.walk(pattern):
+                    yield from (os.path.join(dir_path, name) for name in sorted(file_names) if name.endswith('.asm'))
+            else:
+                yield from sorted(glob.glob(os.path.join(pattern, "*.asm")))
+        elif glob.has_magic(pattern):
+            yield from sorted(glob.glob(pattern, recursive=recursive))
+        else:
+            yield pattern
+    for list_file in list_files:
+        with open(list_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    yield line
+
+class ResultWriter:
+    """
+    Stream results to a .csv (one row per match) or JSON lines file (one object per query).
+    '-' writes JSON lines to stdout.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.is_csv = path.endswith('.csv')
+        if path == '-':
+            self.file = sys.stdout
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.file = open(path, 'w', newline='' if self.is_csv else None, encoding='utf-8')
+        if self.is_csv:
+            self.csv_writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS)
+            self.csv_writer.writeheader()
+
+    def write(self, result):
+        if not self.is_csv:
+            self.file.write(json.dumps(result, ensure_ascii=False) + '\n')
+        else:
+            row = {field: result.get(field, "") for field in ("file", "features", "parse_seconds", "score_seconds", "error")}
+            matches = result.get("matches") or [{}]
+            for rank, match in enumerate(matches, 1):
+                self.csv_writer.writerow({
+                    **row,
+                    "rank": rank if match else "",
+                    "project": match.get("project", ""),
+                    "similarity": match.get("similarity", ""),
+                    "matched": match.get("matched", ""),
+                    "total": match.get("total", ""),
+                })
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+def run_batch(queries, index, config, writer, jobs=None, top_k=5, metric="containment"):
+    """
+    Classify every query path against index, writing each result as it completes.
+    Returns (classified, failed) counts.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    classified = failed = 0
+    queries = iter(queries)
+    in_flight = {}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(config,)) as executor:
+        while True:
+            while len(in_flight) < 2 * jobs:
+                asm_path = next(queries, None)
+                if asm_path is None:
+                    break
+                in_flight[executor.submit(_query_features, asm_path)] = asm_path
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                asm_path = in_flight.pop(future)
+                try:
+                    features, parse_seconds, job_metrics = future.result()
+                except Exception as e:
+                    writer.write({"file": asm_path, "ok": False, "error": str(e)})
+                    failed += 1
+                    continue
+                metrics.merge(job_metrics)
+                start = time.perf_counter()
+                with metrics.stage("classify"):
+                    matches = rank_features(index, features, top_k, metric)
+                writer.write({
+                    "file": asm_path,
+                    "ok": True,
+                    "features": len(features),
+                    "matches": matches,
+                    "parse_seconds": round(parse_seconds, 6),
+                    "score_seconds": round(time.perf_counter() - start, 6),
+                })
+                classified += 1
+    return classified, failed
+
+def main():
+    root = Path(__file__).resolve().parent
+    parser = argparse.ArgumentParser(description="Classify many .asm files against the reference features in one run.")
+    parser.add_argument("inputs", nargs="*", help=".asm files, directories or glob patterns")
+    parser.add_argument("-l", "--list", action="append", default=[], help="file with one .asm path per line (repeatable)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="search directories recursively")
+    parser.add_argument("-o", "--output", default=DEFAULT_RESULTS_FILE, help="results file: .csv, .jsonl, or - for stdout")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--metric", default="containment", choices=RANK_METRICS)
+    parser.add_argument("--feature-dir", default=str(root / "output" / "mini_feature"))
+    parser.add_argument("--feature-store", default=str(root / "output" / "mini_feature.fstore"))
+    parser.add_argument("--config", default=str(root / "config.yaml"))
+    parser.add_argument("--metrics", help="write stage timers and counters to this file (.json, or .prom for Prometheus)")
+    args = parser.parse_args()
+    if not args.inputs and not args.list:
+        parser.error("no inputs: give .asm files, directories or --list")
+
+    config = load_config(Path(args.config))
+    metrics_file = configure_metrics(config, args.metrics)
+    if metrics_file:
+        config["metrics"] = 'enable'  # the worker processes read it from the config
+
+    feature_dir = Path(args.feature_dir)
+    with metrics.stage("load_references"):
+        try:
+            index = load_reference_index(config, feature_dir, Path(args.feature_store))
+        except ValueError as e:
+            print(f"Cannot load the references: {e}", file=sys.stderr)
+            sys.exit(1)
+    print(f"Loaded {len(index)} reference projects", file=sys.stderr)
+
+    writer = ResultWriter(args.output)
+    start = time.perf_counter()
+    try:
+        classified, failed = run_batch(
+            iter_queries(args.inputs, args.list, args.recursive), index, config, writer, args.jobs, args.top_k, args.metric
+        )
+    finally:
+        writer.close()
+        if hasattr(index, "close"):
+            index.close()
+    elapsed = time.perf_counter() - start
+    print(f"Classified {classified} file(s), {failed} failed, in {elapsed:.2f}s -> {args.output}", file=sys.stderr)
+    if metrics_file:
+        metrics.add_time("total", elapsed)
+        metrics.count("failures", failed)
+        metrics.sample_memory()
+        metrics.write(metrics_file)
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+# Long-running classification daemon.
+#
+# Loads config.yaml and the reference features once and answers requests over a
+# Unix socket (--unix) or localhost TCP. One JSON object per line, one JSON reply per line:
+#   {"path": "/abs/file.asm", "top_k": 5, "metric": "jaccard"}
+#   {"content_length": 1234, "name": "file.asm", "top_k": 5}   followed by 1234 bytes of .asm text
+#   {"command": "reload"} / {"command": "stats"}
+# Parsing runs in a process pool; the reference index is reloaded when the feature directory changes.
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from classify_asm_by_feature import (load_config, build_controller, parse_asm_file, hash_asm_metadata, load_reference_index,
+                                     rank_features)
+from FeatureIndex import feature_csv_files
+from FuzzyFeatures import DEFAULT_SKETCH_SIZE, sketch_asm_metadata, sketch_csv_files
+from ParseCache import ParseCache
+from FeatureHasher import FeatureHasher
+
+STREAM_CHUNK_SIZE = 1 << 20
+
+_worker_controller = None
+_worker_parse_cache = None
+_worker_hasher = None
+_worker_sketch_size = None
+
+def is_minhash_mode(config):
+    return config.get("feature_mode", 'exact') == 'minhash'
+
+def _init_worker(config):
+    global _worker_controller, _worker_parse_cache, _worker_hasher, _worker_sketch_size
+    _worker_controller = build_controller(config)
+    _worker_parse_cache = ParseCache.from_config(config)
+    _worker_hasher = FeatureHasher.from_config(config)
+    if is_minhash_mode(config):
+        _worker_sketch_size = config.get("minhash_size", DEFAULT_SKETCH_SIZE)
+
+def _hash_asm_file(asm_path):
+    start = time.perf_counter()
+    asm_metadata = parse_asm_file(asm_path, _worker_controller, _worker_parse_cache, _worker_hasher)
+    if _worker_sketch_size is not None:
+        features = sketch_asm_metadata(asm_metadata, _worker_sketch_size)
+    else:
+        features = hash_asm_metadata(asm_metadata, _worker_hasher)
+    return features, time.perf_counter() - start
+
+def feature_dir_signature(feature_dir: Path, feature_store: Path, minhash=False):
+    """
+    Cheap change detector: names, sizes and mtimes of the reference files, i.e. the
+    sketch CSVs in minhash mode and the feature CSVs and the store file otherwise.
+    """
+    if minhash:
+        return tuple((path.name, path.stat().st_size, path.stat().st_mtime_ns) for path in sketch_csv_files(feature_dir))
+    paths = feature_csv_files(feature_dir)
+    if feature_store.exists():
+        paths.append(feature_store)
+    return tuple((path.name, path.stat().st_size, path.stat().st_mtime_ns) for path in paths)
+
+class ClassificationServer:
+    def __init__(self, config, feature_dir: Path, feature_store: Path, workers=None, top_k=5, reload_interval=5.0):
+        self.config = config
+        self.feature_dir = feature_dir
+        self.feature_store = feature_store
+        self.workers = workers or os.cpu_count() or 1
+        self.top_k = top_k
+        self.reload_interval = reload_interval
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(config,))
+        # Bounds the number of queued parses so a flood of requests cannot pile up in memory.
+        self.parse_slots = asyncio.Semaphore(2 * self.workers)
+        self.index = None
+        self.signature = None
+        self.stats = {"requests": 0, "errors": 0, "reloads": 0, "started": time.time()}
+
+    async def load_index(self):
+        loop = asyncio.get_running_loop()
+        signature = self.feature_signature()
+        index = await loop.run_in_executor(None, load_reference_index, self.config, self.feature_dir, self.feature_store)
+        old_index, self.index, self.signature = self.index, index, signature
+        if hasattr(old_index, "close"):
+            old_index.close()
+        self.stats["reloads"] += 1
+        print(f"Loaded {len(index)} reference projects")
+
+    def feature_signature(self):
+        return feature_dir_signature(self.feature_dir, self.feature_store, is_minhash_mode(self.config))
+
+    async def watch_features(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                if self.feature_signature() != self.signature:
+                    await self.load_index()
+            except Exception as e:
+                print(f"Reload failed: {e}")
+
+    async def classify_path(self, asm_path, top_k, metric):
+        loop = asyncio.get_running_loop()
+        async with self.parse_slots:
+            features, parse_seconds = await loop.run_in_executor(self.executor, _hash_asm_file, asm_path)
+        start = time.perf_counter()
+        matches = rank_features(self.index, features, top_k, metric)
+        return {
+            "ok": True,
+            "features": len(features),
+            "matches": matches,
+            "parse_seconds": parse_seconds,
+            "score_seconds": time.perf_counter() - start,
+        }
+
+    async def spool_content(self, reader, length):
+        """
+        Copy streamed .asm content to a temporary file in bounded chunks.
+        """
+        fd, tmp_path = tempfile.mkstemp(suffix=".asm")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                remaining = length
+                while remaining:
+                    chunk = await reader.read(min(remaining, STREAM_CHUNK_SIZE))
+                    if not chunk:
+                        raise ConnectionError("connection closed before content_length bytes were received")
+                    f.write(chunk)
+                    remaining -= len(chunk)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return tmp_path
+
+    async def handle_request(self, request, reader):
+        command = request.get("command")
+        if command == "reload":
+            await self.load_index()
+            return {"ok": True, "projects": len(self.index)}
+        if command == "stats":
+            return {"ok": True, "projects": len(self.index), **self.stats}
+
+        top_k = int(request.get("top_k", self.top_k))
+        metric = request.get("metric", "containment")
+        if "content_length" in request:
+            tmp_path = await self.spool_content(reader, int(request["content_length"]))
+            try:
+                response = await self.classify_path(tmp_path, top_k, metric)
+            finally:
+                os.unlink(tmp_path)
+            response["file"] = request.get("name", "")
+            return response
+        if "path" in request:
+            asm_path = Path(request["path"])
+            if not asm_path.is_file():
+                return {"ok": False, "error": f"file not found: {asm_path}"}
+            response = await self.classify_path(str(asm_path), top_k, metric)
+            response["file"] = str(asm_path)
+            return response
+        return {"ok": False, "error": "expected 'path', 'content_length' or 'command'"}
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.stats["requests"] += 1
+                try:
+                    response = await self.handle_request(json.loads(line), reader)
+                except ConnectionError:
+                    break
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    response = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, unix_path=None, host="127.0.0.1", port=8765):
+        await self.load_index()
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_client, path=unix_path)
+            print(f"Listening on {unix_path}")
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+            print(f"Listening on {host}:{port}")
+        watcher = asyncio.create_task(self.watch_features())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            self.executor.shutdown(cancel_futures=True)
+
+def main():
+    root = Path(__file__).resolve().parent
+    parser = argparse.ArgumentParser(description="Serve .asm classification requests against resident reference features.")
+    parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--feature-dir", default=str(root / "output" / "mini_feature"))
+    parser.add_argument("--feature-store", default=str(root / "output" / "mini_feature.fstore"))
+    parser.add_argument("--config", default=str(root / "config.yaml"))
+    parser.add_argument("--reload-interval", type=float, default=5.0, help="seconds between feature directory checks")
+    args = parser.parse_args()
+
+    server = ClassificationServer(
+        load_config(Path(args.config)), Path(args.feature_dir), Path(args.feature_store),
+        args.workers, args.top_k, args.reload_interval
+    )
+    try:
+        asyncio.run(server.serve(args.unix, args.host, args.port))
+    except KeyboardInterrupt:
+        sys.exit(0)
+    except ValueError as e:
+        print(f"Cannot load the references: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,22 @@
-import re
 import os
 import sys
+import glob
+import time
+import argparse
 import yaml
-import json
-import hashlib
-import csv
-import py7zr
-from AssemblyController import AssemblyController
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from MnemonicNormalizer import normalization_setting
+from ParseCache import ParseCache, file_digest, member_digest, cache_asm_metadata
+from SevenZipReader import SevenZipAsmReader, open_asm_member
+from Metrics import Metrics, metrics, configure_metrics
+from FeatureHasher import FeatureHasher
+from AsmReport import report_settings
+from FeatureExtraction import (OUTPUT_FEATURE_DIR, JOB_ASM, JOB_ARCHIVE, LineCounter, build_reader, load_asm_metadata,
+                               needs_instruction_rows, write_row_outputs, write_features, feature_stats, print_throughput,
+                               plan_jobs)
+from IngestPipeline import PIPELINE_ASYNC, pipeline_mode, run_pipeline
 
 INPUT_ASSEMBLY_DIR = "./input/assemblies/"
-OUTPUT_FEATURE_DIR = "./output/features/"
 
 class ConfigManager:
     def __init__(self, config_path):
@@ -42,63 +49,198 @@ class ConfigManager:
             yaml.safe_dump(config, yaml_file)
 
 def read_asm_from_7z_in_memory(archive_path, target_filename="example.asm"):
-    with py7zr.SevenZipFile(archive_path, mode='r') as archive:
-        all_files = archive.readall()  # returns a dict: { 'filename': file-like object }
-
-        if target_filename in all_files:
-            file_obj = all_files[target_filename]
-            content = file_obj.read().decode('utf-8')  # Assuming .asm is UTF-8 encoded text
-            return content
+    # Only the requested member is decompressed; it is streamed and decoded incrementally
+    with open_asm_member(archive_path, target_filename) as asm_stream:
+        return asm_stream.read()
+
+def collect_inputs(patterns):
+    """
+    Expand directories, glob patterns and plain paths into a sorted list of .asm/.7z inputs.
+    """
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            candidates = glob.glob(os.path.join(pattern, "*.asm")) + glob.glob(os.path.join(pattern, "*.7z"))
+        elif glob.has_magic(pattern):
+            candidates = glob.glob(pattern)
         else:
-            raise FileNotFoundError(f"{target_filename} not found in {archive_path}")
+            candidates = [pattern]
+        inputs.extend(path for path in candidates if path.endswith(('.asm', '.7z')))
+    return sorted(set(inputs))
+
+def extract_features(input_path, feature_file, config, shard_executor=None, shard_workers=None):
+    """
+    Parse one .asm image and write its feature CSV. Runs inside a worker process, or
+    in the main process with the parse split across shard_executor.
+    Returns per-file statistics used for the throughput report.
+    """
+    start = time.perf_counter()
+    job_metrics = Metrics.from_config(config)
+    asmReader = build_reader(config)
+    asm_metadata, lines, delta = load_asm_metadata(input_path, feature_file, config, asmReader, job_metrics,
+                                                   shard_executor=shard_executor, shard_workers=shard_workers)
+    if needs_instruction_rows(config):
+        write_row_outputs(asm_metadata, feature_file, asmReader, config, job_metrics)
+    write_features(asm_metadata, feature_file, config, job_metrics)
+    return [feature_stats(input_path, feature_file, lines, start, delta, job_metrics)]
+
+def extract_archive_features(archive_path, member_outputs, config):
+    """
+    Parse the given (member, feature file) pairs of one 7z archive. Runs inside a worker process.
+    The members are decompressed in one streaming pass and parsed one at a time, so
+    memory follows a single member; members found in the parse cache are not decompressed.
+    """
+    start = time.perf_counter()
+    job_metrics = Metrics.from_config(config)
+    asmReader = build_reader(config)
+    # Members are parsed in full when a report or function CSV is written (see extract_features)
+    full_parse = needs_instruction_rows(config)
+    parse_cache = ParseCache.from_config(config) if not full_parse else None
+    archive_digest = None
+    if parse_cache:
+        with job_metrics.stage("digest"):
+            archive_digest = file_digest(archive_path)
+    results, pending = [], {}
+    for member, feature_file in member_outputs:
+        key = parse_cache.key(member_digest(archive_digest, member), asmReader) if parse_cache else None
+        cached_metadata = parse_cache.get(key) if parse_cache else None
+        if cached_metadata is None:
+            pending[member] = (feature_file, key)
+            continue
+        write_features(cached_metadata, feature_file, config, job_metrics)
+        results.append(feature_stats(f"{archive_path}:{member}", feature_file, None, start, job_metrics=job_metrics))
+        start = time.perf_counter()
+
+    reader = SevenZipAsmReader(archive_path, list(pending))
+    for member, asm_stream in reader:
+        feature_file, key = pending[member]
+        parse_start, wait_start = time.perf_counter(), reader.wait_seconds
+        with asm_stream:
+            lines = LineCounter(asm_stream)
+            asm_metadata = asmReader.parseAsmLines(lines)
+        # Decompression runs while the member is parsed; the time the parser waited
+        # for data is reported on its own and left out of the parse stage
+        wait = reader.wait_seconds - wait_start
+        job_metrics.add_time("decompress_wait", wait)
+        job_metrics.add_time("parse", time.perf_counter() - parse_start - wait)
+        job_metrics.record_asm_metadata(asm_metadata)
+        if full_parse:
+            write_row_outputs(asm_metadata, feature_file, asmReader, config, job_metrics)
+        if parse_cache:
+            asm_metadata = cache_asm_metadata(asm_metadata, FeatureHasher.from_config(config))
+            parse_cache.put(key, asm_metadata)
+        write_features(asm_metadata, feature_file, config, job_metrics)
+        results.append(feature_stats(f"{archive_path}:{member}", feature_file, lines, start, job_metrics=job_metrics))
+        start = time.perf_counter()
+    return results
+
+# Worker task of each plan_jobs job kind
+JOB_TASKS = {JOB_ASM: extract_features, JOB_ARCHIVE: extract_archive_features}
+
+def validate_config(config):
+    """
+    Check the settings the worker processes read, so that a bad value stops the run
+    before any job starts instead of failing every image. Raises ValueError.
+    """
+    # simple: only the feature CSVs; full: also a JSON lines report per image, without the ignore_keys
+    report_settings(config)
+    # none: raw mnemonics as feature keys; arm, aarch64, auto: canonical classes (MnemonicNormalizer);
+    # only the setting is checked, the tables are built by the workers
+    normalization_setting(config)
+
+def run_batch(pending, config, jobs=None):
+    """
+    Run the jobs of plan_jobs on a process pool.
+    At most 2 * jobs images are in flight so memory stays bounded for large batches.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    pending = list(pending)
+    results, failures = [], []
+
+    def collect(input_path, get_stats):
+        try:
+            file_stats = get_stats()
+        except Exception as e:
+            print(f"Failed to process {input_path}: {e}")
+            failures.append(input_path)
+            return
+        for stats in file_stats:
+            print_throughput(stats)
+            metrics.merge(stats["metrics"])
+            results.append(stats)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if jobs > 1 and len(pending) < jobs:
+            # Too few images to keep every worker busy: split each .asm across the pool instead
+            sharded = [job for job in pending if job[0] == JOB_ASM]
+            pending = [job for job in pending if job[0] != JOB_ASM]
+            for _, input_path, feature_file in sharded:
+                collect(input_path, lambda: extract_features(input_path, feature_file, config, executor, jobs))
+
+        in_flight = {}
+        pending.reverse()
+        while pending or in_flight:
+            while pending and len(in_flight) < 2 * jobs:
+                kind, input_path, outputs = pending.pop()
+                in_flight[executor.submit(JOB_TASKS[kind], input_path, outputs, config)] = input_path
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                input_path = in_flight.pop(future)
+                collect(input_path, future.result)
+    return results, failures
 
 def main():
+    parser = argparse.ArgumentParser(description="Extract opcode feature hashes from .asm/.7z images.")
+    parser.add_argument("inputs", nargs="*", default=[os.path.join(INPUT_ASSEMBLY_DIR, "example.7z")],
+                        help="input .asm/.7z files, directories or glob patterns")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("-o", "--output-dir", default=OUTPUT_FEATURE_DIR, help="directory for the feature CSVs")
+    parser.add_argument("-c", "--config", default="config.yaml", help="path to config.yaml")
+    parser.add_argument("-f", "--force", action="store_true", help="re-extract even if the output is up to date")
+    parser.add_argument("--metrics", help="write stage timers and counters to this file (.json, or .prom for Prometheus)")
+    args = parser.parse_args()
+
     # Load configuration
-    config_path = "config.yaml"
-    config_manager = ConfigManager(config_path)
+    config_manager = ConfigManager(args.config)
     config = config_manager.load_config()
-
-    report_type = config.get("asm_analysis_report_type", 'simple')  # full, simple
-    report_enable = config.get("asm_analysis_report_enable", 'enable')  # enable, disable
-    selected_sections = config.get("select_sections", [])
-    branch_operations = set(config.get("branch_ops", [
-        'b', 'bl', 'blcc', 'blcs', 'ble.n', 'ble.w',
-        'bleq', 'blge', 'blls', 'bllt', 'blmi', 'blne',
-        'bls.n', 'bls.w', 'blt.n', 'blt.w', 'blvs', 'blx'
-    ]))
-    ignored_keys = set(config.get("ignore_keys", []))
-
-    input_asm_file = os.path.join(INPUT_ASSEMBLY_DIR, "example.7z")
-    asm_content = read_asm_from_7z_in_memory(input_asm_file)
-    offsetlist_file = os.path.join(OUTPUT_FEATURE_DIR, "example_offsetlist.json")
-    feature_file = os.path.join(OUTPUT_FEATURE_DIR, "example_feature.csv")
-
-    # Initialize the AssemblyController with the branch operations, use_op_asm flag, and selected sections.
-    asmReader = AssemblyController(branch_operations, True, selected_sections)
-
-    asm_metadata = asmReader.parseAsmCodes(asm_content)
-
-    # Iterate over files with a progress bar
-    for filename, file_info in asm_metadata.items():
-        #json_output = json.dumps(file_info.op_asm_offset_list, indent=4)
-        #os.makedirs(OUTPUT_FEATURE_DIR, exist_ok=True)
-        #with open(offsetlist_file, "w") as json_file:
-        #    json_file.write(json_output)
-
-        with open(feature_file, mode='w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['Opcode', 'SHA-256 Hash'])  # Header row
-            for opcode, offsetlist in file_info.op_asm_offset_list.items():
-                # Serialize the offset list consistently
-                canonical_str = json.dumps(offsetlist, separators=(',', ':'), sort_keys=True)
-                # Compute SHA-256 hash
-                hash_digest = hashlib.sha256(canonical_str.encode('utf-8')).hexdigest()
-                # Write to CSV
-                writer.writerow([opcode, hash_digest])
-
-        print(f"Saved all opcode hashes to {feature_file}")
-
-    print("Finished processing.")
+    metrics_file = configure_metrics(config, args.metrics)
+    if metrics_file:
+        config["metrics"] = 'enable'  # the worker processes read it from the config
+
+    try:
+        validate_config(config)
+    except ValueError as e:
+        print(f"Invalid configuration {args.config}: {e}")
+        sys.exit(1)
+    # pool: one worker job per image or archive; async: staged read/parse/write pipeline (IngestPipeline)
+    async_pipeline = pipeline_mode(config) == PIPELINE_ASYNC
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("No .asm/.7z inputs found.")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    try:
+        pending = plan_jobs(inputs, config, args.config, args.output_dir, args.force)
+    except ValueError as e:
+        print(f"Cannot extract: {e}")
+        sys.exit(1)
+    if async_pipeline:
+        results, failures = run_pipeline(pending, config, args.jobs)
+    else:
+        results, failures = run_batch(pending, config, args.jobs)
+    elapsed = time.perf_counter() - start
+    total_mb = sum(stats["bytes"] for stats in results) / (1024 * 1024)
+    print(f"Finished processing {len(results)} file(s) in {elapsed:.2f}s ({total_mb / max(elapsed, 1e-9):.2f} MB/s overall).")
+    if metrics_file:
+        metrics.add_time("total", elapsed)
+        metrics.count("failures", len(failures))
+        metrics.sample_memory()
+        metrics.write(metrics_file)
+        print(f"Metrics written to {metrics_file}")
+    if failures:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,114 @@
+import sys
+import random
+import argparse
+
+DEFAULT_BRANCH_MIX = {'bl': 4, 'b.n': 3, 'bne.n': 1, 'beq.n': 1, 'ble.n': 1, 'blx': 1}
+DEFAULT_MNEMONICS = [
+    'ldr', 'ldr.w', 'str', 'str.w', 'mov', 'movs', 'mov.w', 'adds', 'add.w', 'subs', 'cmp',
+    'push', 'pop', 'ldrb', 'strb', 'lsls', 'lsrs', 'ands', 'orrs', 'vldr', 'vstr', 'vmov', 'ldmia.w', 'stmdb'
+]
+
+def parse_branch_mix(text):
+    """
+    Parse "bl=4,b.n=3" into {'bl': 4.0, 'b.n': 3.0}.
+    """
+    mix = {}
+    for item in text.split(','):
+        mnemonic, _, weight = item.partition('=')
+        mix[mnemonic.strip()] = float(weight or 1)
+    return mix
+
+def generate_objdump(out, sections=4, labels=1000, instructions=100000, branch_ratio=0.1,
+                     branch_mix=None, undefined_ratio=0.001, seed=0, project="Synthetic",
+                     register_branch_ratio=0.0, shift_label=None):
+    """
+    Write arm-none-eabi-objdump -d style text with the given number of sections, labels
+    and instructions. branch_ratio of the instructions are branches drawn from branch_mix
+    (mnemonic -> weight) and target earlier labels; undefined_ratio are <UNDEFINED> words.
+    register_branch_ratio of the branches take a register operand (blx r3) instead.
+    shift_label=N appends a 2-byte nop to the code block before label N, so every later
+    block moves by 2 bytes and keeps its label; the output is otherwise that of the same seed.
+    Returns the number of lines written.
+    """
+    rng = random.Random(seed)
+    branch_mix = branch_mix or DEFAULT_BRANCH_MIX
+    branch_ops, branch_weights = list(branch_mix), list(branch_mix.values())
+    write = out.write
+    line_count = 4
+    write(f"\n/build/{project}/bin/arducopter:     file format elf32-littlearm\n\n\n")
+
+    address = 0x8000000
+    shift = 0  # bytes inserted by shift_label; labels keep the name of their unshifted address
+    targets = []
+    labels_per_section = max(1, labels // sections)
+    instructions_per_label = max(1, instructions // max(1, labels))
+    for section_index in range(sections):
+        section_name = '.text' if section_index == 0 else f'.text.{section_index}'
+        write(f"Disassembly of section {section_name}:\n\n")
+        line_count += 2
+        for _ in range(labels_per_section):
+            if len(targets) == shift_label and targets:
+                write(f" {address:7x}:\tbf00      \tnop\n")
+                address += 2
+                shift += 2
+                line_count += 1
+            label = f"func_{address - shift:x}"
+            targets.append((address, label))
+            write(f"{address:08x} <{label}>:\n")
+            line_count += 1
+            for _ in range(instructions_per_label):
+                roll = rng.random()
+                if roll < undefined_ratio:
+                    write(f" {address:7x}:\tffff ffff \t\t\t@ <UNDEFINED> instruction: 0xffffffff\n")
+                    size = 4
+                elif roll < undefined_ratio + branch_ratio:
+                    target, target_label = rng.choice(targets)
+                    mnemonic = rng.choices(branch_ops, branch_weights)[0]
+                    if register_branch_ratio and rng.random() < register_branch_ratio:
+                        write(f" {address:7x}:\t4798      \tblx\tr{rng.randint(0, 7)}\n")
+                        size = 2
+                    else:
+                        write(f" {address:7x}:\tf000 f83c \t{mnemonic}\t{target:x} <{target_label}>\n")
+                        size = 4
+                else:
+                    mnemonic = rng.choice(DEFAULT_MNEMONICS)
+                    if rng.random() < 0.5:
+                        write(f" {address:7x}:\t{rng.getrandbits(16):04x}      \t{mnemonic}\tr{rng.randint(0, 7)}, r{rng.randint(0, 7)}\n")
+                        size = 2
+                    else:
+                        write(f" {address:7x}:\tf8df {rng.getrandbits(16):04x} \t{mnemonic}\tr{rng.randint(0, 12)}, [pc, #{rng.randint(0, 255) * 4}]"
+                              f"\t@ {address + 64:x} <{label}+0x40>\n")
+                        size = 4
+                address += size
+                line_count += 1
+            write("\n")
+            line_count += 1
+    return line_count
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic arm-none-eabi-objdump -d output.")
+    parser.add_argument("-o", "--output", help="output .asm path (default: stdout)")
+    parser.add_argument("--sections", type=int, default=4)
+    parser.add_argument("--labels", type=int, default=1000)
+    parser.add_argument("--instructions", type=int, default=100000)
+    parser.add_argument("--branch-ratio", type=float, default=0.1)
+    parser.add_argument("--branch-mix", type=parse_branch_mix, default=None, help="e.g. bl=4,b.n=3,blx=1")
+    parser.add_argument("--undefined-ratio", type=float, default=0.001)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--project", default="Synthetic")
+    parser.add_argument("--register-branch-ratio", type=float, default=0.0, help="branches with a register operand (blx r3)")
+    parser.add_argument("--shift-label", type=int, default=None,
+                        help="move the blocks from this label on by 2 bytes (a later revision of the same seed)")
+    args = parser.parse_args()
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        generate_objdump(out, args.sections, args.labels, args.instructions, args.branch_ratio,
+                         args.branch_mix, args.undefined_ratio, args.seed, args.project,
+                         args.register_branch_ratio, args.shift_label)
+    finally:
+        if args.output:
+            out.close()
+
+if __name__ == "__main__":
+    main()